@@ -1,8 +1,18 @@
 # agents/lyrics_agent.py
 
+import os
 import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from langchain_core.messages import HumanMessage, SystemMessage
-from config import llm
+from config import get_llm
+from song import Song
+from tools.canonical import canonical_request
+from tools.lyric_features import extract_features, prefilter_reason
+from tools.singleflight import FLIGHTS
+
+# Songs analyzed / scored at once per request, each in its own thread
+ANALYSIS_CONCURRENCY = int(os.getenv("ANALYSIS_CONCURRENCY", "4"))
 
 LYRICS_ANALYSIS_PROMPT = """You are a song lyrics analyst.
 
@@ -53,8 +63,13 @@ Respond ONLY with valid JSON:
 """
 
 class LyricsAgent:
+    # Memoize LLM match scores per intent (off for bulk_analyze.py, whose
+    # request is a placeholder no user will send)
+    remember_scores = True
+    
     def __init__(self):
-        self.llm = llm
+        self.analysis_llm = get_llm("lyric_analysis")
+        self.scoring_llm = get_llm("cached_scoring")
     
     async def analyze_batch_with_progress(
         self, 
@@ -63,68 +78,129 @@ class LyricsAgent:
         profile: dict,
         progress_callback=None
     ) -> list:
-        """Analyze songs with progress updates."""
-        from tools.ytmusic import get_lyrics
-        from db.database import get_song, save_song
-        
-        analyzed = []
+        """
+        Analyze songs concurrently (ANALYSIS_CONCURRENCY threads) with
+        progress updates. Results keep the input order.
+        """
         total = len(songs)
+        done = 0
         
-        for i, song in enumerate(songs):
+        async def analyze(song):
+            nonlocal done
+            result = await asyncio.to_thread(self.analyze_and_cache, song, request, profile)
+            done += 1
             # Progress update every 5 songs
-            if progress_callback and (i % 5 == 0 or i == total - 1):
-                await progress_callback(f"🎵 Analyzing songs... {i + 1}/{total}")
-            
-            # Check cache
-            cached = get_song(song['song_id'])
-            if cached and cached.get('mood'):
-                scored = self._score_cached(cached, request, profile)
-                analyzed.append(scored)
-                continue
-            
-            # Fetch lyrics
-            if 'lyrics' not in song or not song['lyrics']:
-                lyrics_data = get_lyrics(song['song_id'])
-                song['lyrics'] = lyrics_data['lyrics'] if lyrics_data else None
-            
-            # Analyze
-            analysis = self._analyze_single(song, request, profile)
-            
-            # Save
-            save_song({
-                "song_id": song['song_id'],
-                "title": song.get('title'),
-                "artist": song.get('artist'),
-                "lyrics": song.get('lyrics'),
-                "mood": analysis.get('mood'),
-                "energy": analysis.get('energy'),
-                "themes": json.dumps(analysis.get('themes', []))
-            })
-            
-            analyzed.append(analysis)
+            if progress_callback and (done % 5 == 0 or done == total):
+                await progress_callback(f"🎵 Analyzing songs... {done}/{total}")
+            return result
         
-        return analyzed
+        if progress_callback and total:
+            await progress_callback(f"🎵 Analyzing songs... 0/{total}")
+        return await self._gather_limited(analyze, songs)
+    
+    async def score_cached_batch(self, songs: list, request: str, profile: dict) -> list:
+        """LLM-score analyzed songs concurrently; results keep the input order."""
+        return await self._gather_limited(
+            lambda song: asyncio.to_thread(self._score_cached, song, request, profile), songs
+        )
+    
+    async def _gather_limited(self, fn, items: list) -> list:
+        limit = asyncio.Semaphore(ANALYSIS_CONCURRENCY)
+        
+        async def run(item):
+            async with limit:
+                return await fn(item)
+        
+        return list(await asyncio.gather(*[run(item) for item in items]))
     
     def analyze_batch(self, songs: list, request: str, profile: dict) -> list:
         """Sync version without progress (for backwards compatibility)."""
+        return [self.analyze_and_cache(song, request, profile) for song in songs]
+    
+    def prefilter(self, songs: list, profile: dict) -> tuple:
+        """
+        Split songs into (worth analyzing, dropped) using cheap local lyric
+        features. Lyrics and features are stored so later runs skip the fetch.
+        """
         from tools.ytmusic import get_lyrics
-        from db.database import get_song, save_song
+        from db.database import get_song_features, save_song_features
         
-        analyzed = []
+        songs = [Song.coerce(song) for song in songs]
+        stored = get_song_features([s['song_id'] for s in songs])
+        keep = []
+        dropped = []
+        
+        # Missing lyrics are fetched concurrently; get_lyrics goes through
+        # the shared YouTube Music limiter, which bounds the real load
+        missing = [s for s in songs if s['song_id'] not in stored and 'lyrics' not in s]
+        if missing:
+            with ThreadPoolExecutor(max_workers=ANALYSIS_CONCURRENCY) as pool:
+                fetched = list(pool.map(lambda s: get_lyrics(s['song_id']), missing))
+            for song, lyrics_data in zip(missing, fetched):
+                # "" marks lyrics as looked up but unavailable
+                song['lyrics'] = lyrics_data['lyrics'] if lyrics_data else ""
         
         for song in songs:
-            cached = get_song(song['song_id'])
-            if cached and cached.get('mood'):
-                scored = self._score_cached(cached, request, profile)
-                analyzed.append(scored)
-                continue
-            
-            if 'lyrics' not in song or not song['lyrics']:
-                lyrics_data = get_lyrics(song['song_id'])
-                song['lyrics'] = lyrics_data['lyrics'] if lyrics_data else None
-            
-            analysis = self._analyze_single(song, request, profile)
+            if song['song_id'] in stored:
+                features, lyrics = stored[song['song_id']]
+                if 'lyrics' not in song and lyrics is not None:
+                    song['lyrics'] = lyrics
+                # Re-extract when lyrics are at hand: profile likes/hates may
+                # have changed. Evicted lyrics fall back to the stored features.
+                if 'lyrics' in song:
+                    features = extract_features(song, profile)
+            else:
+                features = extract_features(song, profile)
+                save_song_features(song, features)
             
+            song['features'] = features
+            reason = prefilter_reason(features, profile)
+            if reason:
+                song['reason'] = reason
+                dropped.append(song)
+            else:
+                keep.append(song)
+        
+        return keep, dropped
+    
+    def analyze_and_cache(self, song: dict, request: str, profile: dict) -> dict:
+        """Score from cache, or fetch lyrics, analyze and save one song."""
+        from db.database import get_song
+        
+        song = Song.coerce(song)
+        
+        # Check cache
+        cached = get_song(song['song_id'])
+        if cached and cached.get('mood'):
+            return self._score_cached(cached, request, profile)
+        
+        # Concurrent requests for the same uncached song share one analysis
+        # (and one save_song); a waiter with a different request re-scores it
+        analysis, analyzed_for = FLIGHTS.do(
+            "analysis", song['song_id'], self._analyze_uncached, song, cached, request, profile,
+            clone=lambda result: (result[0].copy(), result[1])
+        )
+        if analyzed_for != request and not analysis.get('fallback'):
+            return self._score_cached(analysis, request, profile)
+        return analysis
+    
+    def _analyze_uncached(self, song: Song, cached, request: str, profile: dict) -> tuple:
+        """Fetch lyrics, analyze and save. Returns (analysis, request)."""
+        from tools.ytmusic import get_lyrics
+        from db.database import save_song
+        
+        # Fetch lyrics, unless already looked up (possibly by prefilter)
+        if 'lyrics' not in song and cached and cached.get('lyrics'):
+            song['lyrics'] = cached['lyrics']
+        if 'lyrics' not in song:
+            lyrics_data = get_lyrics(song['song_id'])
+            song['lyrics'] = lyrics_data['lyrics'] if lyrics_data else None
+        
+        # Analyze
+        analysis = self._analyze_single(song, request, profile)
+        
+        # Save - fallback defaults are not cached so the song is retried later
+        if not analysis.get('fallback'):
             save_song({
                 "song_id": song['song_id'],
                 "title": song.get('title'),
@@ -132,18 +208,17 @@ class LyricsAgent:
                 "lyrics": song.get('lyrics'),
                 "mood": analysis.get('mood'),
                 "energy": analysis.get('energy'),
-                "themes": json.dumps(analysis.get('themes', []))
+                "themes": json.dumps(analysis.get('themes', [])),
+                "features": song.get('features')
             })
-            
-            analyzed.append(analysis)
         
-        return analyzed
+        return analysis, request
     
     def _analyze_single(self, song: dict, request: str, profile: dict) -> dict:
         profile_str = json.dumps(profile, indent=2)
         prompt = LYRICS_ANALYSIS_PROMPT.format(profile=profile_str, request=request)
         
-        lyrics_preview = song.get('lyrics', 'Not available')
+        lyrics_preview = song.get('lyrics') or 'Not available'
         if lyrics_preview and len(lyrics_preview) > 2000:
             lyrics_preview = lyrics_preview[:2000] + "..."
         
@@ -159,34 +234,36 @@ Lyrics: {lyrics_preview}
         ]
         
         try:
-            response = self.llm.invoke(messages)
+            response = self.analysis_llm.invoke(messages, call_site="lyric_analysis")
             analysis = json.loads(response.content)
-            analysis['song_id'] = song['song_id']
-            analysis['title'] = song.get('title')
-            analysis['artist'] = song.get('artist')
-            return analysis
+            self._remember_score(
+                song['song_id'], request, profile,
+                analysis.get('match_score', 5), analysis.get('reason', '')
+            )
+            return Song.coerce(song).copy(
+                mood=analysis.get('mood'),
+                energy=analysis.get('energy'),
+                themes=analysis.get('themes', []),
+                match_score=analysis.get('match_score', 5),
+                reason=analysis.get('reason', '')
+            )
         except Exception as e:
             print(f"Analysis error for {song.get('title')}: {e}")
-            return {
-                "song_id": song['song_id'],
-                "title": song.get('title'),
-                "artist": song.get('artist'),
-                "mood": "unknown",
-                "energy": 5,
-                "themes": [],
-                "match_score": 5,
-                "reason": "Could not analyze"
-            }
+            self.analysis_llm.record_fallback("lyric_analysis")
+            return Song.coerce(song).copy(
+                mood="unknown",
+                energy=5,
+                themes=[],
+                match_score=5,
+                reason="Could not analyze",
+                fallback=True
+            )
     
     def _score_cached(self, cached: dict, request: str, profile: dict) -> dict:
         profile_str = json.dumps(profile, indent=2)
         
-        themes = cached.get('themes', '[]')
-        if isinstance(themes, str):
-            try:
-                themes = json.loads(themes)
-            except:
-                themes = []
+        cached = Song.coerce(cached)
+        themes = cached.themes or []
         
         prompt = SCORE_CACHED_PROMPT.format(
             profile=profile_str,
@@ -204,14 +281,25 @@ Lyrics: {lyrics_preview}
         ]
         
         try:
-            response = self.llm.invoke(messages)
+            response = self.scoring_llm.invoke(messages, call_site="cached_scoring")
             score_data = json.loads(response.content)
-            return {
-                **cached,
-                "themes": themes,
-                "match_score": score_data.get('match_score', 5),
-                "reason": score_data.get('reason', '')
-            }
+            self._remember_score(
+                cached['song_id'], request, profile,
+                score_data.get('match_score', 5), score_data.get('reason', '')
+            )
+            return cached.with_score(score_data.get('match_score', 5), score_data.get('reason', ''))
         except Exception as e:
             print(f"Scoring error: {e}")
-            return {**cached, "themes": themes, "match_score": 5, "reason": ""}
+            self.scoring_llm.record_fallback("cached_scoring")
+            return cached.with_score(5)
+    
+    def _remember_score(self, song_id: str, request: str, profile: dict, match_score, reason: str):
+        """Memoize an LLM score for warm requests with the same intent and profile."""
+        from db.database import save_match_score, profile_version
+        
+        if not self.remember_scores:
+            return
+        try:
+            save_match_score(song_id, canonical_request(request), profile_version(profile), match_score, reason)
+        except Exception as e:
+            print(f"Score memo error for {song_id}: {e}")
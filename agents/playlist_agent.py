@@ -1,8 +1,10 @@
 # agents/playlist_agent.py
 
+import re
 import json
+import asyncio
 from langchain_core.messages import HumanMessage, SystemMessage
-from config import llm
+from config import get_llm
 
 PLAYLIST_AGENT_PROMPT = """You are a playlist curator and sequencing expert.
 
@@ -42,9 +44,101 @@ Respond ONLY with valid JSON:
 }}
 """
 
+class StreamingPlaylistParser:
+    """
+    Incrementally pulls fields out of the sequencer's JSON as it streams in.
+    
+    `playlist_name` and `description` become available once their string
+    values are closed; each entry of the `songs` array is yielded by `feed`
+    as soon as its object is complete.
+    """
+    
+    def __init__(self):
+        self.buffer = ""
+        self.playlist_name = None
+        self.description = None
+        self.songs_started = False
+        self._pos = None       # scan position inside the songs array
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._obj_start = None
+        self._done = False
+    
+    def feed(self, text: str) -> list:
+        """Add streamed text; returns song objects completed by it."""
+        self.buffer += text
+        
+        if self.playlist_name is None:
+            self.playlist_name = self._string_field("playlist_name")
+        if self.description is None:
+            self.description = self._string_field("description")
+        
+        if self._pos is None:
+            match = re.search(r'"songs"\s*:\s*\[', self.buffer)
+            if not match:
+                return []
+            self.songs_started = True
+            self._pos = match.end()
+        
+        return self._scan_songs()
+    
+    def _string_field(self, key: str):
+        match = re.search(rf'"{key}"\s*:\s*"((?:[^"\\]|\\.)*)"', self.buffer)
+        if not match:
+            return None
+        try:
+            return json.loads(f'"{match.group(1)}"')
+        except ValueError:
+            return match.group(1)
+    
+    def _scan_songs(self) -> list:
+        found = []
+        buf = self.buffer
+        i = self._pos
+        
+        while i < len(buf) and not self._done:
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == '{':
+                if self._depth == 0:
+                    self._obj_start = i
+                self._depth += 1
+            elif ch == '}':
+                self._depth -= 1
+                if self._depth == 0 and self._obj_start is not None:
+                    try:
+                        found.append(json.loads(buf[self._obj_start:i + 1]))
+                    except ValueError as e:
+                        print(f"Skipping malformed streamed song: {e}")
+                    self._obj_start = None
+            elif ch == ']' and self._depth == 0:
+                self._done = True
+            i += 1
+        
+        self._pos = i
+        return found
+
+
+def _energy(song):
+    """Sort key: energies may be strings ("6") or missing; unknown sits mid-scale."""
+    try:
+        return float(song.get('energy'))
+    except (TypeError, ValueError):
+        return 5.0
+
+
 class PlaylistAgent:
     def __init__(self):
-        self.llm = llm
+        self.llm = get_llm("sequencing")
     
     def create_playlist(
         self, 
@@ -52,17 +146,199 @@ class PlaylistAgent:
         request: str, 
         profile: dict,
         target_length: int = 15,
-        create_on_youtube: bool = True
+        create_on_youtube: bool = True,
+        use_llm: bool = True,
+        playlist_id: str = None
     ) -> dict:
         """
-        Create an ordered playlist from analyzed songs.
+        Create an ordered playlist from analyzed songs. use_llm=False
+        sequences locally (see _fallback_playlist) without an LLM call.
+        With a playlist_id, songs go into that (empty) YouTube playlist
+        instead of a new one.
         """
-        profile_str = json.dumps(profile, indent=2)
-        prompt = PLAYLIST_AGENT_PROMPT.format(profile=profile_str)
+        candidates = self._candidates(songs, target_length)
+        
+        if not use_llm:
+            playlist = self._fallback_playlist(candidates, request, target_length)
+        else:
+            messages = self._build_messages(candidates, request, profile, target_length)
+            try:
+                response = self.llm.invoke(messages, call_site="sequencing")
+                playlist = json.loads(response.content)
+            except Exception as e:
+                print(f"Playlist creation error: {e}")
+                self.llm.record_fallback("sequencing")
+                playlist = self._fallback_playlist(candidates, request, target_length)
+        
+        # Create actual YouTube Music playlist
+        if create_on_youtube:
+            from tools.ytmusic import create_playlist, add_to_playlist, get_playlist_url
+            
+            try:
+                yt_playlist_id = playlist_id or create_playlist(
+                    title=playlist.get('playlist_name', request),
+                    description=playlist.get('description', '')
+                )
+                
+                song_ids = [s['song_id'] for s in playlist['songs']]
+                add_to_playlist(yt_playlist_id, song_ids)
+                
+                playlist['youtube_url'] = get_playlist_url(yt_playlist_id)
+                playlist['playlist_id'] = yt_playlist_id
+            except Exception as e:
+                print(f"YouTube playlist error: {e}")
+                playlist['youtube_error'] = str(e)
+                playlist['youtube_url'] = None
+        
+        return playlist
+    
+    async def create_playlist_streaming(
+        self,
+        songs: list,
+        request: str,
+        profile: dict,
+        target_length: int = 15,
+        progress_callback=None,
+        batch_size: int = 3
+    ) -> dict:
+        """
+        Stream the sequencer's output and build the YouTube playlist while it
+        is still being generated: the playlist is created as soon as its name
+        is known and songs are appended in batches of `batch_size`.
+        """
+        from tools.ytmusic import create_playlist, add_to_playlist, get_playlist_url
+        
+        candidates = self._candidates(songs, target_length)
+        candidate_ids = {s['song_id'] for s in candidates}
+        messages = self._build_messages(candidates, request, profile, target_length)
+        
+        parser = StreamingPlaylistParser()
+        picked = []
+        picked_ids = set()
+        pending = []
+        state = {"playlist_id": None, "error": None}
+        writes = asyncio.Queue()
+        
+        async def writer():
+            # Serializes YouTube writes so they overlap with generation
+            while True:
+                item = await writes.get()
+                if item is None:
+                    return
+                if state["error"]:
+                    continue
+                kind, payload = item
+                try:
+                    if kind == "create":
+                        state["playlist_id"] = await asyncio.to_thread(
+                            create_playlist, title=payload[0], description=payload[1]
+                        )
+                    else:
+                        await asyncio.to_thread(add_to_playlist, state["playlist_id"], payload)
+                except Exception as e:
+                    print(f"YouTube playlist error: {e}")
+                    state["error"] = str(e)
+        
+        writer_task = asyncio.create_task(writer())
+        created = False
+        
+        async def flush():
+            if pending:
+                await writes.put(("add", list(pending)))
+                pending.clear()
         
+        async def show_progress():
+            if not progress_callback:
+                return
+            lines = '\n'.join(
+                f"  {i + 1}. {s.get('title', 'Unknown')} - {s.get('artist', '')}"
+                for i, s in enumerate(picked[:5])
+            )
+            text = f"🎼 {parser.playlist_name or request}\n{lines}\n… {len(picked)}/{target_length} sequenced"
+            if state["playlist_id"]:
+                text += f"\n▶️ {get_playlist_url(state['playlist_id'])}"
+            await progress_callback(text)
+        
+        try:
+            async for chunk in self.llm.astream(messages, call_site="sequencing"):
+                new_songs = parser.feed(chunk)
+                
+                if not created and parser.playlist_name and (parser.description is not None or parser.songs_started):
+                    await writes.put(("create", (parser.playlist_name, parser.description or '')))
+                    created = True
+                
+                added = False
+                for song in new_songs:
+                    song_id = song.get('song_id')
+                    if song_id not in candidate_ids or song_id in picked_ids:
+                        continue
+                    picked.append(song)
+                    picked_ids.add(song_id)
+                    pending.append(song_id)
+                    added = True
+                
+                if created and len(pending) >= batch_size:
+                    await flush()
+                if added and (len(picked) <= batch_size or len(picked) % batch_size == 0):
+                    await show_progress()
+        except Exception as e:
+            print(f"Streaming playlist error: {e}")
+            self.llm.record_fallback("sequencing")
+            if not picked:
+                # Let the writer finish: a playlist it already created is
+                # reused instead of left empty next to a second one
+                await writes.put(None)
+                await writer_task
+                return await asyncio.to_thread(
+                    self.create_playlist, songs, request, profile, target_length, True,
+                    playlist_id=state["playlist_id"]
+                )
+        
+        # Top up from the ranked candidates if the stream ended short
+        if len(picked) < target_length:
+            for s in candidates:
+                if len(picked) >= target_length:
+                    break
+                if s['song_id'] not in picked_ids:
+                    picked.append({"song_id": s['song_id'], "title": s.get('title'), "artist": s.get('artist'), "reason": ""})
+                    picked_ids.add(s['song_id'])
+                    pending.append(s['song_id'])
+        
+        if not created:
+            await writes.put(("create", (parser.playlist_name or request, parser.description or '')))
+        await flush()
+        await writes.put(None)
+        await writer_task
+        
+        try:
+            playlist = json.loads(parser.buffer)
+        except ValueError:
+            playlist = {
+                "playlist_name": parser.playlist_name or request,
+                "description": parser.description or '',
+                "flow_description": ""
+            }
+        
+        playlist['songs'] = [{**s, "position": i + 1} for i, s in enumerate(picked)]
+        playlist['total_songs'] = len(picked)
+        
+        if state["error"] or not state["playlist_id"]:
+            playlist['youtube_error'] = state["error"]
+            playlist['youtube_url'] = None
+        else:
+            playlist['youtube_url'] = get_playlist_url(state["playlist_id"])
+            playlist['playlist_id'] = state["playlist_id"]
+        
+        return playlist
+    
+    def _candidates(self, songs: list, target_length: int) -> list:
         # Sort by match_score, take top candidates
         sorted_songs = sorted(songs, key=lambda x: x.get('match_score', 0), reverse=True)
-        candidates = sorted_songs[:target_length * 2]
+        return sorted_songs[:target_length * 2]
+    
+    def _build_messages(self, candidates: list, request: str, profile: dict, target_length: int) -> list:
+        profile_str = json.dumps(profile, indent=2)
+        prompt = PLAYLIST_AGENT_PROMPT.format(profile=profile_str)
         
         songs_info = json.dumps([
             {
@@ -77,7 +353,7 @@ class PlaylistAgent:
             for s in candidates
         ], indent=2)
         
-        messages = [
+        return [
             SystemMessage(content=prompt),
             HumanMessage(content=f"""
 Request: {request}
@@ -89,48 +365,42 @@ Available songs (pick and sequence the best ones):
 Create the playlist.
 """)
         ]
+    
+    def _fallback_playlist(self, candidates: list, request: str, target_length: int) -> dict:
+        picked = self._local_order(candidates[:target_length])
+        return {
+            "playlist_name": request,
+            "description": "",
+            "total_songs": target_length,
+            "songs": [
+                {
+                    "position": i + 1,
+                    "song_id": s['song_id'],
+                    "title": s.get('title'),
+                    "artist": s.get('artist'),
+                    "reason": ""
+                }
+                for i, s in enumerate(picked)
+            ],
+            "flow_description": ""
+        }
+    
+    def _local_order(self, songs: list) -> list:
+        """
+        Rough energy arc without the LLM: build up to the most energetic
+        songs mid-playlist and wind down, then split same-artist neighbours.
+        """
+        by_energy = sorted(songs, key=_energy)
+        ordered = by_energy[0::2] + by_energy[1::2][::-1]
         
-        try:
-            response = self.llm.invoke(messages)
-            playlist = json.loads(response.content)
-        except Exception as e:
-            print(f"Playlist creation error: {e}")
-            playlist = {
-                "playlist_name": request,
-                "description": "",
-                "total_songs": target_length,
-                "songs": [
-                    {
-                        "position": i + 1,
-                        "song_id": s['song_id'],
-                        "title": s.get('title'),
-                        "artist": s.get('artist'),
-                        "reason": ""
-                    }
-                    for i, s in enumerate(candidates[:target_length])
-                ],
-                "flow_description": ""
-            }
-        
-        # Create actual YouTube Music playlist
-        if create_on_youtube:
-            from tools.ytmusic import create_playlist, add_to_playlist, get_playlist_url
-            
-            try:
-                yt_playlist_id = create_playlist(
-                    title=playlist.get('playlist_name', request),
-                    description=playlist.get('description', '')
-                )
-                
-                song_ids = [s['song_id'] for s in playlist['songs']]
-                add_to_playlist(yt_playlist_id, song_ids)
-                
-                playlist['youtube_url'] = get_playlist_url(yt_playlist_id)
-                playlist['playlist_id'] = yt_playlist_id
-            except Exception as e:
-                print(f"YouTube playlist error: {e}")
-                playlist['youtube_error'] = str(e)
-                playlist['youtube_url'] = None
-        
-        return playlist
-
+        for i in range(1, len(ordered)):
+            artist = ordered[i].get('artist')
+            if not artist or artist != ordered[i - 1].get('artist'):
+                continue
+            swap = next(
+                (j for j in range(i + 1, len(ordered)) if ordered[j].get('artist') != artist),
+                None
+            )
+            if swap is not None:
+                ordered[i], ordered[swap] = ordered[swap], ordered[i]
+        return ordered
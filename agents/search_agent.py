@@ -3,7 +3,11 @@
 import json
 from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_core.tools import tool
-from config import llm
+from config import get_llm
+from llm_client import current_ledger
+
+# Stop searching once this share of the request's token budget is spent
+SEARCH_BUDGET_SHARE = 0.25
 
 @tool
 def search_songs(query: str) -> list:
@@ -48,7 +52,7 @@ Rules:
 class SearchAgent:
     def __init__(self):
         self.tools = [search_songs, get_artist_songs, get_watch_playlist, get_liked_songs]
-        self.llm_with_tools = llm.bind_tools(self.tools)
+        self.llm_with_tools = get_llm("search_tools").bind_tools(self.tools)
     
     def run(self, request: str, profile: dict) -> list:
         """Search for songs based on request and profile"""
@@ -63,8 +67,19 @@ class SearchAgent:
         all_songs = []
         max_iterations = 10  # prevent infinite loop
         
+        ledger = current_ledger()
+        
         for _ in range(max_iterations):
-            response = self.llm_with_tools.invoke(messages)
+            if ledger and ledger.spent_fraction() >= SEARCH_BUDGET_SHARE:
+                ledger.degrade("fewer searches")
+                break
+            try:
+                response = self.llm_with_tools.invoke(messages, call_site="search_tools")
+            except Exception as e:
+                # Keep whatever the earlier iterations found
+                print(f"Search agent LLM error: {e}")
+                self.llm_with_tools.record_fallback("search_tools")
+                break
             
             if not response.tool_calls:
                 break
@@ -1,17 +1,56 @@
 # bot.py
 
 import os
+import asyncio
+import threading
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 
 from orchestrator import Orchestrator
-from db.database import init_db, get_profile, set_profile
-from config import TELEGRAM_TOKEN, ALLOWED_USER_ID
+from formatting import format_playlist_response
+from db.database import init_db, get_profile, set_profile, cache_stats, run_maintenance
+from db.jobs import enqueue_job, purge_jobs, queue_stats
+from db.graph import graph_stats, prune_graph
+from db.prebuilt import list_prebuilt
+from db.ledger import ledger_stats, purge_ledger
+from tools.canonical import canonical_request
+from config import (
+    TELEGRAM_TOKEN,
+    ALLOWED_USER_ID,
+    CACHE_MAINTENANCE_INTERVAL,
+    BOT_MODE,
+    BOT_CONCURRENT_UPDATES,
+    WEBHOOK_URL,
+    WEBHOOK_SECRET,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_PATH,
+    WORKER_MODE,
+    JOB_RETENTION_DAYS,
+    ADMIN_USER_ID,
+    PROFILE_RUNS,
+    ROUTINES,
+    ROUTINE_LEAD_MINUTES,
+    TIMEZONE,
+    REQUEST_TOKEN_BUDGET,
+    LEDGER_RETENTION_DAYS
+)
+from llm_client import STAGE_METRICS
+from profiling import profile_run
+from tools.ratelimit import limiter_stats
+from tools.singleflight import flight_stats
 
 # Initialize
 init_db()
 orchestrator = Orchestrator()
 
+# Routine prebuilds run on their own thread and event loop, so they get
+# their own Orchestrator (library cache, agents), one build at a time
+_prebuild_orchestrator = None
+_prebuild_lock = threading.Lock()
+
 # --- Auth Check ---
 
 def is_authorized(user_id: int) -> bool:
@@ -19,6 +58,9 @@ def is_authorized(user_id: int) -> bool:
         return True
     return user_id == ALLOWED_USER_ID
 
+def is_admin(user_id: int) -> bool:
+    return ADMIN_USER_ID != 0 and user_id == ADMIN_USER_ID
+
 # --- Handlers ---
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -48,6 +90,18 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Send initial message
     status_msg = await update.message.reply_text("🎵 Starting...")
     
+    # A worker process (worker.py) picks the job up and edits status_msg
+    if WORKER_MODE == "queue":
+        try:
+            job_id = await asyncio.to_thread(
+                enqueue_job, user_id, status_msg.chat_id, status_msg.message_id, user_request
+            )
+            stats = await asyncio.to_thread(queue_stats)
+            await status_msg.edit_text(f"🕒 Queued (job {job_id}, {stats.get('queued', 1)} waiting)")
+        except Exception as e:
+            await status_msg.edit_text(f"Something went wrong: {str(e)}")
+        return
+    
     # Progress callback
     async def update_progress(text: str):
         try:
@@ -56,7 +110,12 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             print(f"Progress update error: {e}")
     
     try:
-        result = await orchestrator.run(user_request, progress_callback=update_progress)
+        if PROFILE_RUNS:
+            result, _ = await profile_run(
+                orchestrator, user_request, progress_callback=update_progress, user_id=user_id
+            )
+        else:
+            result = await orchestrator.run(user_request, progress_callback=update_progress, user_id=user_id)
     
         # Check response type
         if result.get('type') == 'chat':
@@ -69,7 +128,43 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await status_msg.edit_text(response, parse_mode='HTML')
 
     except Exception as e:
-        await status_msg.edit_text(f"Something went wrong: {str(e)}") 
+        await status_msg.edit_text(f"Something went wrong: {str(e)}")
+
+
+async def profile_request(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("Admin only.")
+        return
+    
+    user_request = ' '.join(context.args)
+    if not user_request:
+        await update.message.reply_text("Usage: /profilerun your request\n\nExample: /profilerun gym playlist")
+        return
+    
+    status_msg = await update.message.reply_text("🔬 Profiling...")
+    
+    async def update_progress(text: str):
+        try:
+            await status_msg.edit_text(f"🔬 {text}")
+        except Exception as e:
+            print(f"Progress update error: {e}")
+    
+    try:
+        result, path = await profile_run(
+            orchestrator, user_request, progress_callback=update_progress, user_id=update.effective_user.id
+        )
+    except Exception as e:
+        await status_msg.edit_text(f"Run failed: {str(e)} (profile written)")
+        return
+    
+    if path is None:
+        await status_msg.edit_text("Another profiled run is in progress; this one ran unprofiled.")
+        return
+    
+    await status_msg.edit_text(f"🔬 Profiled: {result.get('type')} | report {os.path.basename(path)}")
+    with open(path, 'rb') as f:
+        await update.message.reply_document(f, filename=os.path.basename(path))
+
 async def set_taste(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_authorized(update.effective_user.id):
         return
@@ -111,57 +206,221 @@ async def get_my_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     await update.message.reply_text(f"Your user ID: {user_id}")
 
-# --- Helpers ---
+async def llm_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_authorized(update.effective_user.id):
+        return
+    
+    report = STAGE_METRICS.report()
+    if not report:
+        await update.message.reply_text("No LLM calls yet.")
+        return
+    
+    text = "🤖 LLM stages:\n\n"
+    for stage, stats in report.items():
+        avg = f"{stats['avg_latency']:.2f}s" if stats['avg_latency'] is not None else "-"
+        p95 = f"{stats['p95_latency']:.2f}s" if stats['p95_latency'] is not None else "-"
+        text += (
+            f"<b>{stage}</b> ({stats['model']})\n"
+            f"  calls {stats['calls']} | errors {stats['errors']} | fallbacks {stats['fallbacks']}\n"
+            f"  avg {avg} | p95 {p95}\n"
+        )
+    
+    await update.message.reply_text(text, parse_mode='HTML')
 
-def format_playlist_response(result: dict) -> str:
-    name = result.get('playlist_name', 'Your Playlist')
-    description = result.get('description', '')
-    total = result.get('total_songs', 0)
-    duration = result.get('estimated_duration', '')
-    url = result.get('youtube_url', '')
-    flow = result.get('flow_description', '')
+async def show_spend(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_authorized(update.effective_user.id):
+        return
     
-    songs = result.get('songs', [])[:5]
-    song_list = '\n'.join([
-        f"  {s.get('position', i+1)}. {s.get('title', 'Unknown')} - {s.get('artist', '')}"
-        for i, s in enumerate(songs)
-    ])
-    if len(result.get('songs', [])) > 5:
-        song_list += f"\n  ... and {len(result.get('songs', [])) - 5} more"
+    stats = ledger_stats(days=7)
+    if not stats['requests']:
+        await update.message.reply_text("No requests in the last 7 days.")
+        return
     
-    response = f"""🎵 <b>{name}</b>
+    budget = f"{REQUEST_TOKEN_BUDGET:,}" if REQUEST_TOKEN_BUDGET else "unlimited"
+    text = (
+        "💸 LLM spend (last 7 days):\n\n"
+        f"Requests: {stats['requests']} | Tokens: {stats['tokens']:,} | Cost: ${stats['cost']:.4f}\n"
+        f"Per request: avg {stats['avg_tokens']:,.0f} | p95 {stats['p95_tokens']:,} | max {stats['max_tokens']:,}\n"
+        f"Budget: {budget} | Degraded: {stats['degraded']}\n\n"
+    )
+    for stage, entry in stats['stages'].items():
+        avg = f"{entry['avg_latency']:.2f}s" if entry['avg_latency'] is not None else "-"
+        text += (
+            f"<b>{stage}</b>: {entry['calls']} calls | {entry['errors']} errors\n"
+            f"  in {entry['input_tokens']:,} | out {entry['output_tokens']:,} | avg {avg}\n"
+        )
+    
+    await update.message.reply_text(text, parse_mode='HTML')
 
-{description}
+async def yt_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_authorized(update.effective_user.id):
+        return
+    
+    text = "📡 YouTube Music limits:\n\n"
+    for endpoint, stats in limiter_stats().items():
+        avg = f"{stats['avg_latency']:.2f}s" if stats['avg_latency'] is not None else "-"
+        text += (
+            f"<b>{endpoint}</b>: {stats['rate']:g}/s, concurrency {stats['concurrency_limit']}\n"
+            f"  in flight {stats['in_flight']} | queued {stats['queue_depth']} | avg {avg}\n"
+            f"  calls {stats['calls']} | errors {stats['errors']} | throttled {stats['throttled']}\n"
+        )
+    
+    flights = flight_stats()
+    if flights:
+        text += "\n🔗 Collapsed duplicate calls:\n\n"
+        for group, stats in flights.items():
+            text += (
+                f"<b>{group}</b>: {stats['collapsed']} of {stats['calls']} shared"
+                f" | in flight {stats['in_flight']}\n"
+            )
+    
+    await update.message.reply_text(text, parse_mode='HTML')
 
-<b>Songs ({total}):</b>
-{song_list}
+async def show_cache_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_authorized(update.effective_user.id):
+        return
+    
+    stats = cache_stats()
+    await update.message.reply_text(
+        "💾 Song cache:\n\n"
+        f"Rows: {stats['rows']} / {stats['max_rows']} ({stats['analyzed']} analyzed)\n"
+        f"Lyrics: {stats['with_lyrics']} songs, {stats['lyrics_mb']} / {stats['max_lyrics_mb']} MB\n"
+        f"DB file: {stats['db_mb']} MB ({stats['free_mb']} MB free pages)\n"
+        f"Oldest access: {stats['oldest_access'] or '-'}"
+    )
+    
+    graph = graph_stats()
+    await update.message.reply_text(
+        "🕸 Song graph:\n\n"
+        f"Songs: {graph['nodes']} | Links: {graph['edges']} / {graph['max_edges']}"
+    )
 
-{f'<i>{flow}</i>' if flow else ''}
-{f'⏱ {duration}' if duration else ''}
-"""
+async def show_queue_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_authorized(update.effective_user.id):
+        return
     
-    if url:
-        response += f"\n▶️ <a href='{url}'>Open in YouTube Music</a>"
+    stats = queue_stats()
+    await update.message.reply_text(
+        f"🗂 Job queue ({WORKER_MODE} mode):\n\n"
+        f"Queued: {stats.get('queued', 0)} | Running: {stats.get('running', 0)}\n"
+        f"Done: {stats.get('done', 0)} | Failed: {stats.get('failed', 0)}"
+    )
+
+async def show_routines(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_authorized(update.effective_user.id):
+        return
     
-    plan = result.get('orchestrator_plan', {})
-    if plan:
-        response += f"\n\n<i>Strategy: {plan.get('strategy', '')} | Mood: {plan.get('inferred_mood', '')}</i>"
+    if not ROUTINES:
+        await update.message.reply_text("No routines configured. Set ROUTINES, e.g. 07:30=morning commute;18:00=gym playlist")
+        return
     
-    return response
+    built = list_prebuilt()
+    text = f"⏰ Routines (built {ROUTINE_LEAD_MINUTES} min ahead):\n\n"
+    for when, request in ROUTINES:
+        built_at = built.get(canonical_request(request))
+        state = f"ready since {built_at[11:16]}" if built_at else "not built"
+        text += f"{when} {request} - {state}\n"
+    await update.message.reply_text(text)
+
+def _prebuild(request: str):
+    global _prebuild_orchestrator
+    with _prebuild_lock:
+        if _prebuild_orchestrator is None:
+            _prebuild_orchestrator = Orchestrator()
+        asyncio.run(_prebuild_orchestrator.run(request, prebuild=True))
+
+async def prebuild_routine(context: ContextTypes.DEFAULT_TYPE):
+    request = context.job.data
+    try:
+        # Own thread and loop: the pipeline blocks, and updates keep flowing
+        await asyncio.to_thread(_prebuild, request)
+        print(f"Prebuilt routine playlist: {request}")
+    except Exception as e:
+        print(f"Routine prebuild error ({request}): {e}")
+
+def routine_timezone():
+    """TIMEZONE, else the system zone - a real zone, so routines follow DST."""
+    if TIMEZONE:
+        return ZoneInfo(TIMEZONE)
+    try:
+        with open("/etc/localtime", "rb") as f:
+            return ZoneInfo.from_file(f, key="localtime")
+    except (OSError, ValueError) as e:
+        print(f"System time zone unavailable ({e}); set TIMEZONE, using the current UTC offset")
+        return datetime.now().astimezone().tzinfo
+
+def schedule_routines(job_queue):
+    tz = routine_timezone()
+    for when, request in ROUTINES:
+        try:
+            at = datetime.strptime(when, "%H:%M") - timedelta(minutes=ROUTINE_LEAD_MINUTES)
+        except ValueError:
+            print(f"Bad routine time {when!r}, expected HH:MM")
+            continue
+        job_queue.run_daily(
+            prebuild_routine,
+            time=at.time().replace(tzinfo=tz),
+            data=request,
+            name=f"routine:{request}"
+        )
+
+async def cache_maintenance(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await asyncio.to_thread(run_maintenance)
+        await asyncio.to_thread(purge_jobs, JOB_RETENTION_DAYS)
+        await asyncio.to_thread(prune_graph)
+        await asyncio.to_thread(purge_ledger, LEDGER_RETENTION_DAYS)
+    except Exception as e:
+        print(f"Cache maintenance error: {e}")
 
 # --- Main ---
 
-def main():
-    app = Application.builder().token(TELEGRAM_TOKEN).build()
+def build_application() -> Application:
+    app = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .concurrent_updates(BOT_CONCURRENT_UPDATES)
+        .build()
+    )
     
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("taste", set_taste))
     app.add_handler(CommandHandler("profile", show_profile))
     app.add_handler(CommandHandler("myid", get_my_id))
+    app.add_handler(CommandHandler("llmstats", llm_stats))
+    app.add_handler(CommandHandler("spend", show_spend))
+    app.add_handler(CommandHandler("ytstats", yt_stats))
+    app.add_handler(CommandHandler("cachestats", show_cache_stats))
+    app.add_handler(CommandHandler("queuestats", show_queue_stats))
+    app.add_handler(CommandHandler("profilerun", profile_request))
+    app.add_handler(CommandHandler("routines", show_routines))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     
-    print("Bot started...")
-    app.run_polling()
+    if app.job_queue:
+        app.job_queue.run_repeating(cache_maintenance, interval=CACHE_MAINTENANCE_INTERVAL, first=60)
+        schedule_routines(app.job_queue)
+    else:
+        print("Job queue unavailable (install python-telegram-bot[job-queue]); cache maintenance and routines disabled")
+    
+    return app
+
+def main():
+    app = build_application()
+    
+    if BOT_MODE == "webhook":
+        from webhook import serve
+        print("Bot started (webhook)...")
+        asyncio.run(serve(
+            app,
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            path=WEBHOOK_PATH,
+            secret=WEBHOOK_SECRET,
+            webhook_url=WEBHOOK_URL
+        ))
+    else:
+        print("Bot started...")
+        app.run_polling()
 
 if __name__ == "__main__":
     main()
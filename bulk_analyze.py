@@ -0,0 +1,202 @@
+# bulk_analyze.py
+"""
+Pre-populate the songs analysis cache offline.
+
+    python bulk_analyze.py --job seed --liked --artist "Sid Sriram" --playlist PLxxx
+    python bulk_analyze.py --job seed            # resume after a crash/kill
+    python bulk_analyze.py --job seed --max-tokens 200000 --max-cost 0.05
+
+Progress is checkpointed per song in the bulk_jobs table, so a killed run
+picks up where it stopped. With a token or cost budget the run stops
+starting songs once its ledger reaches it; the rest stay pending for the
+next run. The run's ledger is stored like a request's (/spend).
+"""
+
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from agents.lyrics_agent import LyricsAgent
+from config import LLM_PRICE_INPUT, LLM_PRICE_OUTPUT
+from llm_client import RequestLedger, ledger_scope
+from db.ledger import save_ledger
+from db.database import (
+    init_db,
+    get_profile,
+    get_cached_songs,
+    add_bulk_items,
+    get_pending_bulk_items,
+    mark_bulk_item,
+    retry_failed_bulk_items,
+    get_bulk_progress
+)
+
+# Analysis is cached independently of any request; the match score from
+# this run is not memoized (LyricsAgent.remember_scores).
+CACHE_REQUEST = "General song analysis for the cache (no specific request)"
+
+def collect_songs(args) -> list:
+    from tools.ytmusic import get_song_info, get_playlist_songs, get_artist_songs, get_liked_songs
+    
+    songs = []
+    for song_id in args.songs:
+        try:
+            songs.append(get_song_info(song_id))
+        except Exception as e:
+            print(f"Song lookup error for {song_id}: {e}")
+    for playlist_id in args.playlist:
+        try:
+            songs.extend(get_playlist_songs(playlist_id, limit=args.limit))
+        except Exception as e:
+            print(f"Playlist error for {playlist_id}: {e}")
+    for artist in args.artist:
+        try:
+            songs.extend(get_artist_songs(artist, limit=args.limit))
+        except Exception as e:
+            print(f"Artist error for {artist}: {e}")
+    if args.liked:
+        try:
+            songs.extend(get_liked_songs(limit=args.limit))
+        except Exception as e:
+            print(f"Liked songs error: {e}")
+    return songs
+
+def run_job(
+    job_id, workers=4, max_calls=None, per_minute=None, max_tokens=None, max_cost=None, report_every=25
+):
+    """
+    Analyze every pending song in a job, until max_tokens / max_cost (USD)
+    are spent. Returns the number analyzed.
+    """
+    agent = LyricsAgent()
+    agent.remember_scores = False
+    profile = get_profile()
+    ledger = RequestLedger(max_tokens or 0, LLM_PRICE_INPUT, LLM_PRICE_OUTPUT)
+    
+    def over_budget():
+        return bool(
+            (max_tokens and ledger.tokens >= max_tokens)
+            or (max_cost and ledger.cost >= max_cost)
+        )
+    
+    pending = get_pending_bulk_items(job_id)
+    cached, _ = get_cached_songs([s['song_id'] for s in pending])
+    for song in cached:
+        mark_bulk_item(job_id, song['song_id'], 'cached')
+    cached_ids = {s['song_id'] for s in cached}
+    pending = [s for s in pending if s['song_id'] not in cached_ids]
+    
+    if max_calls is not None:
+        pending = pending[:max_calls]
+    
+    print(f"Job {job_id}: {len(pending)} to analyze, {len(cached)} already cached")
+    
+    interval = 60.0 / per_minute if per_minute else 0
+    started = time.monotonic()
+    done = 0
+    failed = 0
+    
+    def analyze(song):
+        # Pool threads don't inherit the context: bind the run's ledger here
+        with ledger_scope(ledger):
+            analysis = agent.analyze_and_cache(song, CACHE_REQUEST, profile)
+        return song, analysis
+    
+    def record(future):
+        # Songs cut off by the budget stay pending for the next run
+        nonlocal done, failed
+        done, failed = _record(job_id, future, done, failed, keep_pending=over_budget())
+        if (done + failed) % report_every == 0:
+            _report(job_id, done, failed, started)
+    
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        next_slot = time.monotonic()
+        for song in pending:
+            if over_budget():
+                print(f"Job {job_id}: budget reached ({ledger.tokens} tokens, ${ledger.cost:.4f}), stopping")
+                break
+            # Spread submissions to stay within the songs/minute budget
+            if interval:
+                now = time.monotonic()
+                if next_slot > now:
+                    time.sleep(next_slot - now)
+                next_slot = max(next_slot, now) + interval
+            futures.append(pool.submit(analyze, song))
+            
+            # Bound in-flight work so a kill loses at most one window
+            if len(futures) >= workers * 2:
+                finished = next(as_completed(futures))
+                futures.remove(finished)
+                record(finished)
+        
+        for finished in as_completed(futures):
+            record(finished)
+    
+    _report(job_id, done, failed, started)
+    try:
+        save_ledger(ledger, f"bulk analysis: {job_id}", kind="bulk", elapsed=time.monotonic() - started)
+    except Exception as e:
+        print(f"Ledger save error: {e}")
+    return done
+
+def _record(job_id, future, done, failed, keep_pending=False):
+    try:
+        song, analysis = future.result()
+    except Exception as e:
+        print(f"Bulk analysis error: {e}")
+        return done, failed + 1
+    
+    if analysis.get('fallback'):
+        if not keep_pending:
+            mark_bulk_item(job_id, song['song_id'], 'failed', analysis.get('reason'))
+        return done, failed + 1
+    
+    mark_bulk_item(job_id, song['song_id'], 'done')
+    return done + 1, failed
+
+def _report(job_id, done, failed, started):
+    elapsed = time.monotonic() - started
+    rate = done / elapsed * 60 if elapsed else 0
+    progress = get_bulk_progress(job_id)
+    print(
+        f"[{job_id}] analyzed {done}, failed {failed} in {elapsed:.0f}s "
+        f"({rate:.1f} songs/min) | remaining {progress.get('pending', 0)}"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-populate the song analysis cache")
+    parser.add_argument("--job", default="default", help="job name; rerun with the same name to resume")
+    parser.add_argument("--songs", nargs="*", default=[], help="song (video) IDs")
+    parser.add_argument("--playlist", nargs="*", default=[], help="playlist IDs")
+    parser.add_argument("--artist", nargs="*", default=[], help="artist names")
+    parser.add_argument("--liked", action="store_true", help="include liked songs")
+    parser.add_argument("--limit", type=int, default=100, help="max songs per playlist/artist/liked source")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent analyses")
+    parser.add_argument("--max-calls", type=int, default=None, help="LLM analysis budget for this run")
+    parser.add_argument("--per-minute", type=float, default=None, help="max songs started per minute")
+    parser.add_argument("--max-tokens", type=int, default=None, help="stop once this many LLM tokens are spent")
+    parser.add_argument("--max-cost", type=float, default=None, help="stop once this much USD is spent")
+    parser.add_argument("--retry-failed", action="store_true", help="retry songs that failed before")
+    args = parser.parse_args()
+    
+    init_db()
+    
+    songs = collect_songs(args)
+    if songs:
+        add_bulk_items(args.job, songs)
+        print(f"Queued {len(songs)} songs for job {args.job}")
+    if args.retry_failed:
+        retry_failed_bulk_items(args.job)
+    
+    run_job(
+        args.job,
+        workers=args.workers,
+        max_calls=args.max_calls,
+        per_minute=args.per_minute,
+        max_tokens=args.max_tokens,
+        max_cost=args.max_cost
+    )
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,118 @@
 
 import os
 from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
 from langchain_xai import ChatXAI
 
+from llm_client import ResilientLLM, CircuitBreaker
+
 load_dotenv()
 
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 ALLOWED_USER_ID = int(os.getenv("ALLOWED_USER_ID", "0"))
 
-llm = ChatXAI(model="grok-4-1-fast-reasoning")
+# "polling" or "webhook". Webhook mode runs an embedded HTTP server
+# (webhook.py); WEBHOOK_URL is the public base URL registered with Telegram.
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+
+# Updates handled at the same time (both modes)
+BOT_CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "4"))
+
+# "inline" runs playlist jobs in the bot process; "queue" hands them to
+# worker processes (worker.py) through the playlist_jobs table
+WORKER_MODE = os.getenv("WORKER_MODE", "inline")
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", str(os.cpu_count() or 2)))
+# A job whose worker stops heartbeating is picked up again after this many seconds
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", "7"))
+
+# Admin-only commands (/profilerun); defaults to the allowed user
+ADMIN_USER_ID = int(os.getenv("ADMIN_USER_ID", str(ALLOWED_USER_ID)))
+
+# Profile every request (profiling.py); reports go to PROFILE_DIR
+PROFILE_RUNS = os.getenv("PROFILE_RUNS", "false").lower() == "true"
+
+# Routine requests built ahead of their usual time, "HH:MM=request" pairs
+# separated by ";", e.g. "07:30=morning commute;18:00=gym playlist"
+ROUTINES = [
+    (when.strip(), request.strip())
+    for when, _, request in (
+        item.partition("=") for item in os.getenv("ROUTINES", "").split(";") if "=" in item
+    )
+]
+# How long before the routine time its playlist is built
+ROUTINE_LEAD_MINUTES = int(os.getenv("ROUTINE_LEAD_MINUTES", "45"))
+# IANA zone routine times are in, e.g. "Asia/Kolkata"; defaults to the system zone
+TIMEZONE = os.getenv("TIMEZONE")
+
+# Seconds between cache eviction / vacuum / ANALYZE runs
+CACHE_MAINTENANCE_INTERVAL = int(os.getenv("CACHE_MAINTENANCE_INTERVAL", str(6 * 60 * 60)))
+
+# Stream the sequencer's output and write the YouTube playlist as it arrives
+STREAMING_PLAYLIST = os.getenv("STREAMING_PLAYLIST", "true").lower() == "true"
+
+# Per-call-site deadlines in seconds. Cheap classification stages get short
+# deadlines so a slow provider response falls back quickly.
+LLM_DEADLINES = {
+    "intent": float(os.getenv("LLM_DEADLINE_INTENT", "8")),
+    "plan": float(os.getenv("LLM_DEADLINE_PLAN", "20")),
+    "search_tools": float(os.getenv("LLM_DEADLINE_SEARCH_TOOLS", "20")),
+    "lyric_analysis": float(os.getenv("LLM_DEADLINE_LYRIC_ANALYSIS", "15")),
+    "cached_scoring": float(os.getenv("LLM_DEADLINE_CACHED_SCORING", "10")),
+    "sequencing": float(os.getenv("LLM_DEADLINE_SEQUENCING", "45")),
+}
+
+# Token budget per request (0 = unlimited). As it runs low the pipeline
+# searches less, analyzes fewer songs and scores/sequences locally; once it
+# is spent, further LLM calls fail fast and take their fallbacks.
+REQUEST_TOKEN_BUDGET = int(os.getenv("REQUEST_TOKEN_BUDGET", "0"))
+
+# USD per million tokens, for the cost column of the LLM ledger
+LLM_PRICE_INPUT = float(os.getenv("LLM_PRICE_INPUT", "0.20"))
+LLM_PRICE_OUTPUT = float(os.getenv("LLM_PRICE_OUTPUT", "0.50"))
+LEDGER_RETENTION_DAYS = int(os.getenv("LEDGER_RETENTION_DAYS", "30"))
+
+# Model per pipeline stage. Cheap classification stages run on the
+# non-reasoning tier; override any stage with LLM_MODEL_<STAGE>.
+REASONING_MODEL = os.getenv("LLM_REASONING_MODEL", "grok-4-1-fast-reasoning")
+FAST_MODEL = os.getenv("LLM_FAST_MODEL", "grok-4-1-fast-non-reasoning")
+
+STAGE_MODELS = {
+    "intent": os.getenv("LLM_MODEL_INTENT", FAST_MODEL),
+    "plan": os.getenv("LLM_MODEL_PLAN", REASONING_MODEL),
+    "search_tools": os.getenv("LLM_MODEL_SEARCH_TOOLS", FAST_MODEL),
+    "lyric_analysis": os.getenv("LLM_MODEL_LYRIC_ANALYSIS", REASONING_MODEL),
+    "cached_scoring": os.getenv("LLM_MODEL_CACHED_SCORING", FAST_MODEL),
+    "sequencing": os.getenv("LLM_MODEL_SEQUENCING", REASONING_MODEL),
+}
+
+# One breaker and thread pool for the provider, shared by every tier
+_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+    reset_timeout=float(os.getenv("LLM_BREAKER_RESET", "30"))
+)
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="llm")
+_stage_llms = {}
+
+def get_llm(stage: str) -> ResilientLLM:
+    """LLM client for a pipeline stage, routed to that stage's model tier."""
+    if stage not in _stage_llms:
+        model_name = STAGE_MODELS.get(stage, REASONING_MODEL)
+        # Retries and timeouts are handled by ResilientLLM, not the HTTP client.
+        # The client still times out at the stage deadline, so abandoned and
+        # hedged attempts don't hold shared executor threads for longer.
+        deadline = LLM_DEADLINES.get(stage, max(LLM_DEADLINES.values()))
+        _stage_llms[stage] = ResilientLLM(
+            ChatXAI(model=model_name, max_retries=0, timeout=deadline),
+            model_name=model_name,
+            deadlines=LLM_DEADLINES,
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", "2")),
+            breaker=_breaker,
+            executor=_executor
+        )
+    return _stage_llms[stage]
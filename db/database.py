@@ -1,17 +1,82 @@
 # db/database.py
 
+import os
+import re
+import json
+import hashlib
 import sqlite3
+import threading
 from datetime import datetime
 
+from song import Song
+from tools.canonical import KEY_VERSION, canonical_key
+
 DB_PATH = 'music.db'
 
+# Cache policy: beyond these limits the least recently used lyrics are
+# dropped first (analysis is kept), then whole rows, unanalyzed ones first.
+CACHE_MAX_ROWS = int(os.getenv("CACHE_MAX_ROWS", "50000"))
+CACHE_MAX_LYRICS_MB = float(os.getenv("CACHE_MAX_LYRICS_MB", "50"))
+
+# Reads are counted in memory and written in one batch by maintenance (or
+# once this many songs are pending), so lookups stay read-only
+ACCESS_FLUSH_ROWS = int(os.getenv("ACCESS_FLUSH_ROWS", "1000"))
+_access = {}    # song_id -> (last_accessed, reads since last flush)
+_access_lock = threading.Lock()
+
+# Memoized match scores older than this are dropped by maintenance
+MATCH_SCORE_TTL_DAYS = int(os.getenv("MATCH_SCORE_TTL_DAYS", "30"))
+
+# Optional read-only analysis snapshot (db/snapshot.py) layered under the
+# songs table: rows missing from SQLite are looked up there by song ID
+# (get_song / get_songs only; query_catalog and get_analyzed_versions don't).
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH")
+_snapshot = None
+
+# Canonical mood vocabulary. Free-text moods from the LLM are mapped onto
+# these terms so the catalog can be queried without another LLM call.
+MOOD_VOCABULARY = {
+    "happy": ["happy", "joyful", "cheerful", "upbeat", "playful", "fun", "celebratory", "festive"],
+    "sad": ["sad", "heartbreak", "heartbroken", "grief", "sorrow", "painful", "lonely"],
+    "melancholic": ["melancholic", "melancholy", "bittersweet", "wistful", "nostalgic", "longing", "yearning"],
+    "romantic": ["romantic", "love", "loving", "tender", "sensual", "intimate"],
+    "energetic": ["energetic", "high energy", "intense", "powerful", "aggressive", "mass", "hype"],
+    "motivational": ["motivational", "inspiring", "inspirational", "empowering", "triumphant", "determined"],
+    "calm": ["calm", "peaceful", "soothing", "relaxed", "chill", "serene", "dreamy", "mellow"],
+    "devotional": ["devotional", "spiritual", "divine", "prayer"],
+    "angry": ["angry", "rebellious", "defiant", "rage"],
+    "dark": ["dark", "haunting", "eerie", "brooding"],
+}
+
 def get_connection():
-    return sqlite3.connect(DB_PATH, check_same_thread=False)
+    # Generous busy timeout: bot and worker processes share the file
+    return sqlite3.connect(DB_PATH, check_same_thread=False, timeout=30)
+
+def get_snapshot():
+    """The memory-mapped snapshot at SNAPSHOT_PATH, opened on first use."""
+    global _snapshot
+    if _snapshot is None and SNAPSHOT_PATH:
+        from db.snapshot import Snapshot
+        try:
+            _snapshot = Snapshot(SNAPSHOT_PATH)
+            print(f"Loaded snapshot {SNAPSHOT_PATH} ({len(_snapshot)} songs)")
+        except (OSError, ValueError) as e:
+            print(f"Snapshot error: {e}")
+            return None
+    return _snapshot
 
 def init_db():
     conn = get_connection()
     c = conn.cursor()
     
+    # Incremental auto-vacuum lets maintenance give freed pages back to the
+    # filesystem. This takes effect for a new DB; an existing one is
+    # converted by the first maintenance run (one full VACUUM, off startup).
+    c.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    
+    # WAL lets worker processes read while another process writes
+    c.execute('PRAGMA journal_mode = WAL')
+    
     # Songs cache + analysis
     c.execute('''
         CREATE TABLE IF NOT EXISTS songs (
@@ -25,6 +90,13 @@ def init_db():
             analyzed_at TIMESTAMP
         )
     ''')
+    _add_column(c, 'songs', 'features', 'TEXT')
+    _add_column(c, 'songs', 'last_accessed', 'TIMESTAMP')
+    _add_column(c, 'songs', 'access_count', 'INTEGER DEFAULT 0')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_songs_last_accessed ON songs (last_accessed)')
+    # Same song across uploads (tools/canonical.py), for sharing analysis
+    _add_column(c, 'songs', 'canonical', 'TEXT')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_songs_canonical ON songs (canonical)')
     
     # User taste profile
     c.execute('''
@@ -34,6 +106,25 @@ def init_db():
         )
     ''')
     
+    # Normalized themes/moods for local catalog queries
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS song_themes (
+            song_id TEXT,
+            theme TEXT,
+            PRIMARY KEY (song_id, theme)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS song_moods (
+            song_id TEXT,
+            mood TEXT,
+            PRIMARY KEY (song_id, mood)
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_song_themes_theme ON song_themes (theme, song_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_song_moods_mood ON song_moods (mood, song_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_songs_energy ON songs (energy)')
+    
     # Recommendations log
     c.execute('''
         CREATE TABLE IF NOT EXISTS recommendations (
@@ -44,38 +135,287 @@ def init_db():
         )
     ''')
     
+    # Playlist jobs for worker processes (db/jobs.py, worker.py)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS playlist_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            chat_id INTEGER,
+            message_id INTEGER,
+            request TEXT,
+            status TEXT DEFAULT 'queued',
+            worker_id TEXT,
+            lease_expires REAL,
+            attempts INTEGER DEFAULT 0,
+            result TEXT,
+            error TEXT,
+            created_at TIMESTAMP,
+            updated_at TIMESTAMP
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_playlist_jobs_status ON playlist_jobs (status, id)')
+    
+    # Memoized match scores per (song, canonical request, profile version)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS match_scores (
+            song_id TEXT,
+            intent TEXT,
+            profile_version TEXT,
+            match_score NUMERIC,
+            reason TEXT,
+            scored_at TIMESTAMP,
+            PRIMARY KEY (song_id, intent, profile_version)
+        ) WITHOUT ROWID
+    ''')
+    
+    # Last playlist per user, for follow-ups like "make it longer" (db/sessions.py)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS sessions (
+            user_id INTEGER PRIMARY KEY,
+            request TEXT,
+            plan TEXT,
+            pool TEXT,
+            playlist_id TEXT,
+            playlist_name TEXT,
+            used_ids TEXT,
+            updated_at TIMESTAMP
+        )
+    ''')
+    
+    # Routine playlists built ahead of time (db/prebuilt.py)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS prebuilt_playlists (
+            intent TEXT PRIMARY KEY,
+            request TEXT,
+            profile_version TEXT,
+            plan TEXT,
+            playlist TEXT,
+            pool TEXT,
+            built_at TIMESTAMP
+        )
+    ''')
+    
+    # Song co-occurrence graph from watch playlists (db/graph.py). Edges are
+    # stored in both directions so neighbours are one index range.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS song_edges (
+            src TEXT,
+            dst TEXT,
+            weight REAL,
+            updated_at TIMESTAMP,
+            PRIMARY KEY (src, dst)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS graph_nodes (
+            song_id TEXT PRIMARY KEY,
+            title TEXT,
+            artist TEXT
+        )
+    ''')
+    
+    # LLM usage per request and per stage (db/ledger.py)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS llm_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            request TEXT,
+            user_id INTEGER,
+            kind TEXT,
+            calls INTEGER,
+            input_tokens INTEGER,
+            output_tokens INTEGER,
+            cost REAL,
+            budget INTEGER,
+            degraded TEXT,
+            elapsed REAL,
+            created_at TIMESTAMP
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_llm_requests_created ON llm_requests (created_at)')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS llm_calls (
+            request_id INTEGER,
+            stage TEXT,
+            model TEXT,
+            calls INTEGER,
+            errors INTEGER,
+            input_tokens INTEGER,
+            output_tokens INTEGER,
+            latency REAL,
+            PRIMARY KEY (request_id, stage, model)
+        ) WITHOUT ROWID
+    ''')
+    
+    # Checkpoints for bulk_analyze.py runs
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS bulk_jobs (
+            job_id TEXT,
+            song_id TEXT,
+            title TEXT,
+            artist TEXT,
+            status TEXT DEFAULT 'pending',
+            error TEXT,
+            updated_at TIMESTAMP,
+            PRIMARY KEY (job_id, song_id)
+        )
+    ''')
+    
+    _backfill_song_index(c)
+    _backfill_canonical(c)
+    
     conn.commit()
     conn.close()
     print("Database initialized.")
 
+def _add_column(c, table, column, decl):
+    """Add a column to an existing table if an older DB lacks it."""
+    c.execute(f'PRAGMA table_info({table})')
+    if column not in [row[1] for row in c.fetchall()]:
+        c.execute(f'ALTER TABLE {table} ADD COLUMN {column} {decl}')
+
+def _backfill_song_index(c):
+    """Index analyzed songs that predate the song_themes/song_moods tables."""
+    c.execute('''
+        SELECT song_id, mood, themes FROM songs
+        WHERE mood IS NOT NULL
+        AND song_id NOT IN (SELECT song_id FROM song_moods)
+        AND song_id NOT IN (SELECT song_id FROM song_themes)
+    ''')
+    for song_id, mood, themes in c.fetchall():
+        _index_song(c, song_id, mood, themes)
+
+def _backfill_canonical(c):
+    """
+    Canonical keys for songs saved before the canonical column existed, or
+    with an older canonical_key (PRAGMA user_version holds KEY_VERSION).
+    """
+    c.execute('PRAGMA user_version')
+    if c.fetchone()[0] < KEY_VERSION:
+        c.execute('UPDATE songs SET canonical = NULL')
+        c.execute(f'PRAGMA user_version = {KEY_VERSION}')
+    c.execute('SELECT song_id, title, artist FROM songs WHERE canonical IS NULL')
+    c.executemany(
+        'UPDATE songs SET canonical = ? WHERE song_id = ?',
+        [(canonical_key({"title": title, "artist": artist}), song_id) for song_id, title, artist in c.fetchall()]
+    )
+
 # --- Songs ---
 
+# Column order expected by Song.from_row
+SONG_COLUMNS = 'song_id, title, artist, mood, energy, themes, analyzed_at'
+
 def get_song(song_id):
     conn = get_connection()
     c = conn.cursor()
-    c.execute('SELECT * FROM songs WHERE song_id = ?', (song_id,))
+    c.execute(f'SELECT {SONG_COLUMNS}, lyrics FROM songs WHERE song_id = ?', (song_id,))
     row = c.fetchone()
     conn.close()
     if row:
-        return {
-            "song_id": row[0],
-            "title": row[1],
-            "artist": row[2],
-            "lyrics": row[3],
-            "mood": row[4],
-            "energy": row[5],
-            "themes": row[6],
-            "analyzed_at": row[7]
-        }
-    return None
+        _touch([song_id])
+        return Song.from_row(row, with_lyrics=True)
+    snapshot = get_snapshot()
+    return snapshot.get(song_id) if snapshot else None
+
+def get_songs(song_ids):
+    """Bulk load songs (lyrics deferred) as {song_id: Song}."""
+    song_ids = list(dict.fromkeys(song_ids))
+    songs = {}
+    conn = get_connection()
+    c = conn.cursor()
+    for i in range(0, len(song_ids), 500):
+        chunk = song_ids[i:i + 500]
+        c.execute(
+            f'SELECT {SONG_COLUMNS} FROM songs WHERE song_id IN ({",".join("?" * len(chunk))})',
+            chunk
+        )
+        for row in c.fetchall():
+            songs[row[0]] = Song.from_row(row)
+    conn.close()
+    _touch(list(songs))
+    
+    snapshot = get_snapshot()
+    if snapshot:
+        songs.update(snapshot.get_many([i for i in song_ids if i not in songs]))
+    return songs
+
+def get_analyzed_versions(keys):
+    """Most recently analyzed song per canonical key, as {canonical_key: Song}."""
+    keys = list(dict.fromkeys(keys))
+    found = {}
+    conn = get_connection()
+    c = conn.cursor()
+    for i in range(0, len(keys), 500):
+        chunk = keys[i:i + 500]
+        c.execute(f'''
+            SELECT canonical, {SONG_COLUMNS} FROM songs
+            WHERE canonical IN ({",".join("?" * len(chunk))}) AND mood IS NOT NULL
+            ORDER BY analyzed_at
+        ''', chunk)
+        for row in c.fetchall():
+            found[row[0]] = Song.from_row(row[1:])
+    conn.close()
+    return found
+
+def _touch(song_ids):
+    """Record a read for LRU eviction (in memory until flush_access_stats)."""
+    if not song_ids:
+        return
+    now = datetime.now().isoformat()
+    with _access_lock:
+        for song_id in song_ids:
+            _, count = _access.get(song_id, (None, 0))
+            _access[song_id] = (now, count + 1)
+        pending = len(_access)
+    if pending >= ACCESS_FLUSH_ROWS:
+        flush_access_stats()
+
+def flush_access_stats():
+    """Write the buffered read counts to the songs table. Returns songs updated."""
+    global _access
+    with _access_lock:
+        pending, _access = _access, {}
+    if not pending:
+        return 0
+    conn = get_connection()
+    c = conn.cursor()
+    c.executemany('''
+        UPDATE songs SET last_accessed = MAX(COALESCE(last_accessed, ''), ?),
+                         access_count = COALESCE(access_count, 0) + ?
+        WHERE song_id = ?
+    ''', [(last, count, song_id) for song_id, (last, count) in pending.items()])
+    conn.commit()
+    conn.close()
+    return len(pending)
+
+def get_song_lyrics(song_id):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('SELECT lyrics FROM songs WHERE song_id = ?', (song_id,))
+    row = c.fetchone()
+    conn.close()
+    return row[0] if row else None
 
 def save_song(song):
     conn = get_connection()
     c = conn.cursor()
+    # Upsert: lyrics and features stored by save_song_features survive an
+    # analysis record that doesn't carry them
     c.execute('''
-        INSERT OR REPLACE INTO songs 
-        (song_id, title, artist, lyrics, mood, energy, themes, analyzed_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        INSERT INTO songs
+        (song_id, title, artist, lyrics, mood, energy, themes, analyzed_at, features,
+         last_accessed, canonical, access_count)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
+        ON CONFLICT(song_id) DO UPDATE SET
+            title = excluded.title,
+            artist = excluded.artist,
+            lyrics = COALESCE(excluded.lyrics, songs.lyrics),
+            mood = excluded.mood,
+            energy = excluded.energy,
+            themes = excluded.themes,
+            analyzed_at = excluded.analyzed_at,
+            features = COALESCE(excluded.features, songs.features),
+            last_accessed = excluded.last_accessed,
+            canonical = excluded.canonical
     ''', (
         song['song_id'],
         song.get('title'),
@@ -84,23 +424,282 @@ def save_song(song):
         song.get('mood'),
         song.get('energy'),
         song.get('themes'),
-        datetime.now().isoformat()
+        datetime.now().isoformat(),
+        json.dumps(song['features']) if song.get('features') else None,
+        datetime.now().isoformat(),
+        canonical_key(song)
+    ))
+    _index_song(c, song['song_id'], song.get('mood'), song.get('themes'))
+    conn.commit()
+    conn.close()
+
+def save_song_features(song, features):
+    """Store lyrics and local features without touching any existing analysis."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        INSERT INTO songs (song_id, title, artist, lyrics, features, canonical)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(song_id) DO UPDATE SET
+            features = excluded.features,
+            lyrics = COALESCE(excluded.lyrics, songs.lyrics)
+    ''', (
+        song['song_id'],
+        song.get('title'),
+        song.get('artist'),
+        song.get('lyrics'),
+        json.dumps(features),
+        canonical_key(song)
     ))
     conn.commit()
     conn.close()
 
+def get_song_features(song_ids):
+    """Stored local features as {song_id: (features, lyrics)}."""
+    song_ids = list(dict.fromkeys(song_ids))
+    result = {}
+    conn = get_connection()
+    c = conn.cursor()
+    for i in range(0, len(song_ids), 500):
+        chunk = song_ids[i:i + 500]
+        c.execute(
+            f'''SELECT song_id, features, lyrics FROM songs
+            WHERE features IS NOT NULL AND song_id IN ({",".join("?" * len(chunk))})''',
+            chunk
+        )
+        for song_id, features, lyrics in c.fetchall():
+            result[song_id] = (json.loads(features), lyrics)
+    conn.close()
+    return result
+
 def get_cached_songs(song_ids):
     """Split into cached and uncached"""
+    songs = get_songs(song_ids)
     cached = []
     uncached = []
     for song_id in song_ids:
-        song = get_song(song_id)
+        song = songs.get(song_id)
         if song and song.get('mood'):  # has analysis
             cached.append(song)
         else:
             uncached.append(song_id)
     return cached, uncached
 
+# --- Cache maintenance ---
+
+def enforce_cache_limits(max_rows=None, max_lyrics_mb=None):
+    """Evict least recently used lyrics, then rows, until within limits."""
+    max_rows = CACHE_MAX_ROWS if max_rows is None else max_rows
+    max_lyrics_bytes = int((CACHE_MAX_LYRICS_MB if max_lyrics_mb is None else max_lyrics_mb) * 1024 * 1024)
+    
+    conn = get_connection()
+    c = conn.cursor()
+    
+    # Lyrics are only needed to re-analyze; analysis stays usable without them
+    c.execute('SELECT COALESCE(SUM(LENGTH(lyrics)), 0) FROM songs')
+    excess = c.fetchone()[0] - max_lyrics_bytes
+    lyrics_evicted = 0
+    if excess > 0:
+        c.execute('''
+            SELECT song_id, LENGTH(lyrics) FROM songs
+            WHERE lyrics IS NOT NULL AND lyrics != ''
+            ORDER BY mood IS NULL DESC, COALESCE(last_accessed, analyzed_at) ASC, access_count ASC
+        ''')
+        evict = []
+        for song_id, size in c.fetchall():
+            if excess <= 0:
+                break
+            evict.append((song_id,))
+            excess -= size
+        c.executemany('UPDATE songs SET lyrics = NULL WHERE song_id = ?', evict)
+        lyrics_evicted = len(evict)
+    
+    c.execute('SELECT COUNT(*) FROM songs')
+    excess_rows = c.fetchone()[0] - max_rows
+    rows_evicted = 0
+    if excess_rows > 0:
+        c.execute('''
+            SELECT song_id FROM songs
+            ORDER BY mood IS NOT NULL ASC, COALESCE(last_accessed, analyzed_at) ASC, access_count ASC
+            LIMIT ?
+        ''', (excess_rows,))
+        evict = c.fetchall()
+        c.executemany('DELETE FROM songs WHERE song_id = ?', evict)
+        c.executemany('DELETE FROM song_themes WHERE song_id = ?', evict)
+        c.executemany('DELETE FROM song_moods WHERE song_id = ?', evict)
+        rows_evicted = len(evict)
+    
+    conn.commit()
+    conn.close()
+    return {"lyrics_evicted": lyrics_evicted, "rows_evicted": rows_evicted}
+
+def run_maintenance():
+    """Enforce cache limits, return free pages to disk and refresh planner stats."""
+    flush_access_stats()
+    evicted = enforce_cache_limits()
+    
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('PRAGMA auto_vacuum')
+    if c.fetchone()[0] != 2:
+        # One-time conversion of a DB created before incremental auto-vacuum
+        c.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        c.execute('VACUUM')
+    # Scores of evicted songs and stale scores
+    c.execute('DELETE FROM match_scores WHERE song_id NOT IN (SELECT song_id FROM songs)')
+    c.execute(
+        "DELETE FROM match_scores WHERE scored_at < datetime('now', ?)",
+        (f'-{MATCH_SCORE_TTL_DAYS} days',)
+    )
+    c.execute('PRAGMA incremental_vacuum')
+    c.fetchall()
+    c.execute('ANALYZE')
+    conn.commit()
+    conn.close()
+    
+    print(f"Cache maintenance: {evicted}")
+    return evicted
+
+def cache_stats():
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        SELECT
+            COUNT(*),
+            SUM(mood IS NOT NULL),
+            SUM(lyrics IS NOT NULL AND lyrics != ''),
+            COALESCE(SUM(LENGTH(lyrics)), 0),
+            MIN(last_accessed)
+        FROM songs
+    ''')
+    rows, analyzed, with_lyrics, lyrics_bytes, oldest_access = c.fetchone()
+    c.execute('PRAGMA page_count')
+    page_count = c.fetchone()[0]
+    c.execute('PRAGMA page_size')
+    page_size = c.fetchone()[0]
+    c.execute('PRAGMA freelist_count')
+    free_pages = c.fetchone()[0]
+    conn.close()
+    return {
+        "rows": rows,
+        "analyzed": analyzed or 0,
+        "with_lyrics": with_lyrics or 0,
+        "lyrics_mb": round(lyrics_bytes / 1024 / 1024, 2),
+        "db_mb": round(page_count * page_size / 1024 / 1024, 2),
+        "free_mb": round(free_pages * page_size / 1024 / 1024, 2),
+        "oldest_access": oldest_access,
+        "max_rows": CACHE_MAX_ROWS,
+        "max_lyrics_mb": CACHE_MAX_LYRICS_MB,
+    }
+
+# --- Catalog ---
+
+def normalize_theme(theme):
+    return re.sub(r'\s+', ' ', str(theme).strip().lower())
+
+def normalize_mood(mood):
+    """Map free-text mood onto MOOD_VOCABULARY terms."""
+    if not mood:
+        return []
+    text = str(mood).lower()
+    return [
+        term for term, synonyms in MOOD_VOCABULARY.items()
+        if any(re.search(rf'\b{re.escape(word)}\b', text) for word in synonyms)
+    ]
+
+def _index_song(c, song_id, mood, themes):
+    """Rewrite the normalized theme/mood rows for one song."""
+    if isinstance(themes, str):
+        try:
+            themes = json.loads(themes)
+        except ValueError:
+            themes = []
+    
+    c.execute('DELETE FROM song_themes WHERE song_id = ?', (song_id,))
+    c.execute('DELETE FROM song_moods WHERE song_id = ?', (song_id,))
+    c.executemany(
+        'INSERT OR IGNORE INTO song_themes (song_id, theme) VALUES (?, ?)',
+        [(song_id, normalize_theme(t)) for t in (themes or []) if str(t).strip()]
+    )
+    c.executemany(
+        'INSERT OR IGNORE INTO song_moods (song_id, mood) VALUES (?, ?)',
+        [(song_id, m) for m in normalize_mood(mood)]
+    )
+
+def query_catalog(
+    energy_min=None,
+    energy_max=None,
+    themes=None,
+    moods=None,
+    exclude_artists=None,
+    exclude_ids=None,
+    limit=50
+):
+    """
+    Find already-analyzed songs without touching YouTube or the LLM.
+    
+    Songs must match at least one of the requested themes/moods (if any are
+    given) and are ranked by how many of them they match.
+    """
+    themes = [normalize_theme(t) for t in (themes or []) if str(t).strip()]
+    moods = sorted({m for mood in (moods or []) for m in normalize_mood(mood)})
+    
+    where = ['s.mood IS NOT NULL']
+    params = []
+    
+    if energy_min is not None:
+        where.append('s.energy >= ?')
+        params.append(float(energy_min))
+    if energy_max is not None:
+        where.append('s.energy <= ?')
+        params.append(float(energy_max))
+    if exclude_artists:
+        where.append(f'LOWER(s.artist) NOT IN ({",".join("?" * len(exclude_artists))})')
+        params.extend(str(a).strip().lower() for a in exclude_artists)
+    exclude_ids = sorted(set(exclude_ids or []))
+    if exclude_ids:
+        where.append(f's.song_id NOT IN ({",".join("?" * len(exclude_ids))})')
+        params.extend(exclude_ids)
+    
+    if themes or moods:
+        hits_sql = []
+        hit_params = []
+        if themes:
+            hits_sql.append(f'SELECT song_id FROM song_themes WHERE theme IN ({",".join("?" * len(themes))})')
+            hit_params.extend(themes)
+        if moods:
+            hits_sql.append(f'SELECT song_id FROM song_moods WHERE mood IN ({",".join("?" * len(moods))})')
+            hit_params.extend(moods)
+        sql = f'''
+            SELECT s.song_id, s.title, s.artist, s.mood, s.energy, s.themes, s.analyzed_at
+            FROM (
+                SELECT song_id, COUNT(*) AS hits
+                FROM ({" UNION ALL ".join(hits_sql)})
+                GROUP BY song_id
+            ) h
+            JOIN songs s ON s.song_id = h.song_id
+            WHERE {" AND ".join(where)}
+            ORDER BY h.hits DESC, s.energy DESC
+            LIMIT ?
+        '''
+        params = hit_params + params
+    else:
+        sql = f'''
+            SELECT s.song_id, s.title, s.artist, s.mood, s.energy, s.themes, s.analyzed_at
+            FROM songs s
+            WHERE {" AND ".join(where)}
+            ORDER BY s.energy DESC
+            LIMIT ?
+        '''
+    params.append(limit)
+    
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(sql, params)
+    rows = c.fetchall()
+    conn.close()
+    return [Song.from_row(row) for row in rows]
+
 # --- Profile ---
 
 def get_profile():
@@ -118,6 +717,43 @@ def set_profile(key, value):
         INSERT OR REPLACE INTO profile (key, value)
         VALUES (?, ?)
     ''', (key, value))
+    # Scores were computed against the old profile
+    c.execute('DELETE FROM match_scores')
+    conn.commit()
+    conn.close()
+
+def profile_version(profile):
+    """Short hash of the profile contents, part of the match score key."""
+    encoded = json.dumps(profile or {}, sort_keys=True).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()[:12]
+
+# --- Match scores ---
+
+def get_match_scores(song_ids, intent, version):
+    """Memoized scores as {song_id: (match_score, reason)}."""
+    song_ids = list(dict.fromkeys(song_ids))
+    scores = {}
+    conn = get_connection()
+    c = conn.cursor()
+    for i in range(0, len(song_ids), 500):
+        chunk = song_ids[i:i + 500]
+        c.execute(f'''
+            SELECT song_id, match_score, reason FROM match_scores
+            WHERE intent = ? AND profile_version = ? AND song_id IN ({",".join("?" * len(chunk))})
+        ''', [intent, version] + chunk)
+        for song_id, match_score, reason in c.fetchall():
+            scores[song_id] = (match_score, reason)
+    conn.close()
+    return scores
+
+def save_match_score(song_id, intent, version, match_score, reason):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        INSERT OR REPLACE INTO match_scores
+        (song_id, intent, profile_version, match_score, reason, scored_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (song_id, intent, version, match_score, reason, datetime.now().isoformat()))
     conn.commit()
     conn.close()
 
@@ -144,6 +780,83 @@ def get_recent_recommendations(days=30):
     conn.close()
     return [row[0] for row in rows]
 
+# --- Bulk analysis jobs ---
+
+def add_bulk_items(job_id, songs):
+    """Queue songs for a bulk job; songs already in the job keep their status."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.executemany('''
+        INSERT OR IGNORE INTO bulk_jobs (job_id, song_id, title, artist, status, updated_at)
+        VALUES (?, ?, ?, ?, 'pending', ?)
+    ''', [
+        (job_id, s['song_id'], s.get('title'), s.get('artist'), datetime.now().isoformat())
+        for s in songs
+    ])
+    conn.commit()
+    conn.close()
+
+def get_pending_bulk_items(job_id):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        SELECT song_id, title, artist FROM bulk_jobs
+        WHERE job_id = ? AND status = 'pending'
+        ORDER BY rowid
+    ''', (job_id,))
+    rows = c.fetchall()
+    conn.close()
+    return [Song(row[0], title=row[1], artist=row[2]) for row in rows]
+
+def mark_bulk_item(job_id, song_id, status, error=None):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        UPDATE bulk_jobs SET status = ?, error = ?, updated_at = ?
+        WHERE job_id = ? AND song_id = ?
+    ''', (status, error, datetime.now().isoformat(), job_id, song_id))
+    conn.commit()
+    conn.close()
+
+def retry_failed_bulk_items(job_id):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        UPDATE bulk_jobs SET status = 'pending', error = NULL
+        WHERE job_id = ? AND status = 'failed'
+    ''', (job_id,))
+    conn.commit()
+    conn.close()
+
+def get_bulk_progress(job_id):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        SELECT status, COUNT(*) FROM bulk_jobs
+        WHERE job_id = ? GROUP BY status
+    ''', (job_id,))
+    rows = c.fetchall()
+    conn.close()
+    return {row[0]: row[1] for row in rows}
+
+def get_recommendation_counts(song_ids, older_than_days=30):
+    """How often each song was recommended before the recent window."""
+    song_ids = list(dict.fromkeys(song_ids))
+    counts = {}
+    conn = get_connection()
+    c = conn.cursor()
+    for i in range(0, len(song_ids), 500):
+        chunk = song_ids[i:i + 500]
+        c.execute(f'''
+            SELECT song_id, COUNT(*) FROM recommendations
+            WHERE recommended_at <= datetime('now', ?)
+            AND song_id IN ({",".join("?" * len(chunk))})
+            GROUP BY song_id
+        ''', [f'-{older_than_days} days'] + chunk)
+        counts.update(dict(c.fetchall()))
+    conn.close()
+    return counts
+
 # Initialize on import
 if __name__ == "__main__":
     init_db()
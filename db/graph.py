@@ -0,0 +1,187 @@
+# db/graph.py
+"""
+Weighted song co-occurrence graph built from watch-playlist ("radio")
+responses.
+
+Every get_watch_playlist result links the seed to each track (weight
+decays with position) and each track to the next one. expand() runs a
+personalized PageRank from seed songs over the local graph, so related
+candidates come out of SQLite without another network call.
+"""
+
+import os
+from datetime import datetime
+
+from db.database import get_connection
+from song import Song
+
+# Seed -> track weight is 1 / (1 + position * POSITION_DECAY)
+POSITION_DECAY = 0.1
+# Neighbouring tracks in the same radio list
+ADJACENT_WEIGHT = 0.3
+# Repeated observations add up to this
+MAX_EDGE_WEIGHT = 10.0
+
+GRAPH_MAX_EDGES = int(os.getenv("GRAPH_MAX_EDGES", "500000"))
+
+
+def record_watch_playlist(seed_id, tracks):
+    """Add one watch-playlist response to the graph. Returns edges written."""
+    tracks = [t for t in tracks if t.get('song_id')]
+    if not tracks:
+        return 0
+
+    weights = {}
+
+    def link(a, b, weight):
+        if a == b:
+            return
+        for edge in ((a, b), (b, a)):
+            weights[edge] = weights.get(edge, 0) + weight
+
+    for position, track in enumerate(tracks):
+        link(seed_id, track['song_id'], 1.0 / (1 + position * POSITION_DECAY))
+    for a, b in zip(tracks, tracks[1:]):
+        link(a['song_id'], b['song_id'], ADJACENT_WEIGHT)
+
+    now = datetime.now().isoformat()
+    conn = get_connection()
+    c = conn.cursor()
+    c.executemany('''
+        INSERT INTO graph_nodes (song_id, title, artist) VALUES (?, ?, ?)
+        ON CONFLICT(song_id) DO UPDATE SET title = excluded.title, artist = excluded.artist
+    ''', [(t['song_id'], t.get('title'), t.get('artist')) for t in tracks])
+    c.executemany('''
+        INSERT INTO song_edges (src, dst, weight, updated_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT(src, dst) DO UPDATE SET
+            weight = MIN(weight + excluded.weight, ?),
+            updated_at = excluded.updated_at
+    ''', [(a, b, w, now, MAX_EDGE_WEIGHT) for (a, b), w in weights.items()])
+    conn.commit()
+    conn.close()
+    return len(weights)
+
+
+def _load_subgraph(c, seeds, hops, max_nodes):
+    """Adjacency {src: {dst: weight}} for nodes within `hops` of the seeds."""
+    adjacency = {}
+    frontier = list(seeds)
+    for _ in range(hops):
+        frontier = [n for n in frontier if n not in adjacency]
+        if not frontier:
+            break
+        next_frontier = set()
+        for i in range(0, len(frontier), 500):
+            chunk = frontier[i:i + 500]
+            placeholders = ','.join('?' * len(chunk))
+            c.execute(f'SELECT src, dst, weight FROM song_edges WHERE src IN ({placeholders})', chunk)
+            for src, dst, weight in c.fetchall():
+                adjacency.setdefault(src, {})[dst] = weight
+                next_frontier.add(dst)
+            for node in chunk:
+                adjacency.setdefault(node, {})
+        if len(adjacency) + len(next_frontier) > max_nodes:
+            break
+        frontier = list(next_frontier)
+    return adjacency
+
+
+def expand(seeds, limit=30, exclude=(), alpha=0.15, hops=3, max_nodes=5000, iterations=30):
+    """
+    Songs related to `seeds` by personalized PageRank over the local graph.
+
+    seeds   -- song IDs, or {song_id: weight}
+    exclude -- song IDs never returned (seeds are always excluded)
+    alpha   -- restart probability; higher stays closer to the seeds
+
+    Returns up to `limit` Songs with a `graph_score`, best first.
+    """
+    if not isinstance(seeds, dict):
+        seeds = {s: 1.0 for s in seeds}
+    seeds = {s: w for s, w in seeds.items() if w > 0}
+    if not seeds:
+        return []
+
+    conn = get_connection()
+    c = conn.cursor()
+    adjacency = _load_subgraph(c, seeds, hops, max_nodes)
+
+    total = sum(seeds.values())
+    restart = {s: w / total for s, w in seeds.items()}
+    out_weight = {n: sum(edges.values()) for n, edges in adjacency.items()}
+
+    rank = dict(restart)
+    for _ in range(iterations):
+        nxt = {n: alpha * p for n, p in restart.items()}
+        dangling = 0.0
+        for node, score in rank.items():
+            edges = adjacency.get(node)
+            if not edges:
+                # Unexpanded or isolated: walk back to the seeds
+                dangling += score
+                continue
+            share = (1 - alpha) * score / out_weight[node]
+            for dst, weight in edges.items():
+                nxt[dst] = nxt.get(dst, 0.0) + share * weight
+        if dangling:
+            for n, p in restart.items():
+                nxt[n] = nxt.get(n, 0.0) + (1 - alpha) * dangling * p
+        rank = nxt
+
+    skip = set(exclude) | set(seeds)
+    ranked = sorted(
+        ((score, song_id) for song_id, score in rank.items() if song_id not in skip),
+        reverse=True
+    )[:limit]
+    if not ranked:
+        conn.close()
+        return []
+
+    ids = [song_id for _, song_id in ranked]
+    placeholders = ','.join('?' * len(ids))
+    c.execute(f'SELECT song_id, title, artist FROM graph_nodes WHERE song_id IN ({placeholders})', ids)
+    nodes = {row[0]: row for row in c.fetchall()}
+    conn.close()
+
+    songs = []
+    for score, song_id in ranked:
+        if song_id not in nodes:
+            continue
+        song = Song(song_id=song_id, title=nodes[song_id][1], artist=nodes[song_id][2])
+        song['graph_score'] = round(score, 6)
+        songs.append(song)
+    return songs
+
+
+def graph_stats():
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('SELECT COUNT(*) FROM graph_nodes')
+    nodes = c.fetchone()[0]
+    c.execute('SELECT COUNT(*) FROM song_edges')
+    edges = c.fetchone()[0]
+    conn.close()
+    return {"nodes": nodes, "edges": edges // 2, "max_edges": GRAPH_MAX_EDGES // 2}
+
+
+def prune_graph(max_edges=None):
+    """Drop the weakest, then oldest, edges beyond GRAPH_MAX_EDGES and orphaned nodes."""
+    max_edges = GRAPH_MAX_EDGES if max_edges is None else max_edges
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('SELECT COUNT(*) FROM song_edges')
+    excess = c.fetchone()[0] - max_edges
+    pruned = 0
+    if excess > 0:
+        c.execute('''
+            DELETE FROM song_edges WHERE (src, dst) IN (
+                SELECT src, dst FROM song_edges
+                ORDER BY weight, updated_at, MIN(src, dst), MAX(src, dst)
+                LIMIT ?
+            )
+        ''', (excess,))
+        pruned = c.rowcount
+        c.execute('DELETE FROM graph_nodes WHERE song_id NOT IN (SELECT dst FROM song_edges)')
+    conn.commit()
+    conn.close()
+    return pruned
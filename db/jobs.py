@@ -0,0 +1,195 @@
+# db/jobs.py
+"""
+Durable playlist job queue in music.db.
+
+The bot enqueues jobs; worker processes (worker.py) claim them under a
+time-limited lease, extend the lease with heartbeats while running, and
+complete or fail them. A job whose worker died is claimed again once its
+lease expires, up to MAX_ATTEMPTS; after that expire_jobs() fails it and
+hands it to a worker to tell the user. A user's jobs run one at a time,
+so a follow-up sees the session saved by the job before it.
+"""
+
+import json
+import time
+from datetime import datetime
+
+from db.database import get_connection
+
+MAX_ATTEMPTS = 3
+
+JOB_COLUMNS = 'id, user_id, chat_id, message_id, request, status, worker_id, attempts, result, error'
+
+
+def _job(row):
+    if not row:
+        return None
+    return {
+        "id": row[0],
+        "user_id": row[1],
+        "chat_id": row[2],
+        "message_id": row[3],
+        "request": row[4],
+        "status": row[5],
+        "worker_id": row[6],
+        "attempts": row[7],
+        "result": json.loads(row[8]) if row[8] else None,
+        "error": row[9]
+    }
+
+
+def enqueue_job(user_id, chat_id, message_id, request):
+    conn = get_connection()
+    c = conn.cursor()
+    now = datetime.now().isoformat()
+    c.execute('''
+        INSERT INTO playlist_jobs (user_id, chat_id, message_id, request, status, created_at, updated_at)
+        VALUES (?, ?, ?, ?, 'queued', ?, ?)
+    ''', (user_id, chat_id, message_id, request, now, now))
+    job_id = c.lastrowid
+    conn.commit()
+    conn.close()
+    return job_id
+
+
+def claim_job(worker_id, lease_seconds=120):
+    """Atomically take the oldest runnable job, or None."""
+    conn = get_connection()
+    conn.isolation_level = None
+    c = conn.cursor()
+    now = time.time()
+    try:
+        # IMMEDIATE takes the write lock up front so two workers can't
+        # claim the same row
+        c.execute('BEGIN IMMEDIATE')
+        
+        # Expired jobs out of attempts are left to expire_jobs(). Users
+        # with a job under a live lease wait for it to finish.
+        c.execute('''
+            SELECT id FROM playlist_jobs
+            WHERE (status = 'queued'
+               OR (status = 'running' AND lease_expires < ? AND attempts < ?))
+            AND user_id NOT IN (
+                SELECT user_id FROM playlist_jobs
+                WHERE status = 'running' AND lease_expires >= ? AND user_id IS NOT NULL
+            )
+            ORDER BY id
+            LIMIT 1
+        ''', (now, MAX_ATTEMPTS, now))
+        row = c.fetchone()
+        if not row:
+            c.execute('COMMIT')
+            return None
+        
+        c.execute('''
+            UPDATE playlist_jobs
+            SET status = 'running', worker_id = ?, lease_expires = ?,
+                attempts = attempts + 1, updated_at = ?
+            WHERE id = ?
+        ''', (worker_id, now + lease_seconds, datetime.now().isoformat(), row[0]))
+        c.execute(f'SELECT {JOB_COLUMNS} FROM playlist_jobs WHERE id = ?', (row[0],))
+        job = _job(c.fetchone())
+        c.execute('COMMIT')
+        return job
+    except Exception:
+        c.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+
+def expire_jobs():
+    """
+    Fail running jobs whose lease expired after MAX_ATTEMPTS claims, so
+    their workers evidently keep dying. Returns them, each to exactly one
+    caller, so the user's status message can be updated.
+    """
+    conn = get_connection()
+    conn.isolation_level = None
+    c = conn.cursor()
+    try:
+        c.execute('BEGIN IMMEDIATE')
+        c.execute(f'''
+            SELECT {JOB_COLUMNS} FROM playlist_jobs
+            WHERE status = 'running' AND lease_expires < ? AND attempts >= ?
+        ''', (time.time(), MAX_ATTEMPTS))
+        jobs = [_job(row) for row in c.fetchall()]
+        c.executemany('''
+            UPDATE playlist_jobs SET status = 'failed', error = 'worker lease expired', updated_at = ?
+            WHERE id = ?
+        ''', [(datetime.now().isoformat(), job['id']) for job in jobs])
+        c.execute('COMMIT')
+        for job in jobs:
+            job['status'] = 'failed'
+            job['error'] = 'worker lease expired'
+        return jobs
+    except Exception:
+        c.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+
+def heartbeat(job_id, worker_id, lease_seconds=120):
+    """Extend the lease. False means another worker has taken the job over."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        UPDATE playlist_jobs SET lease_expires = ?, updated_at = ?
+        WHERE id = ? AND worker_id = ? AND status = 'running'
+    ''', (time.time() + lease_seconds, datetime.now().isoformat(), job_id, worker_id))
+    owned = c.rowcount == 1
+    conn.commit()
+    conn.close()
+    return owned
+
+
+def complete_job(job_id, worker_id, result):
+    _finish(job_id, worker_id, 'done', result=json.dumps(result, default=str))
+
+
+def fail_job(job_id, worker_id, error):
+    _finish(job_id, worker_id, 'failed', error=str(error))
+
+
+def _finish(job_id, worker_id, status, result=None, error=None):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        UPDATE playlist_jobs SET status = ?, result = ?, error = ?, updated_at = ?
+        WHERE id = ? AND worker_id = ?
+    ''', (status, result, error, datetime.now().isoformat(), job_id, worker_id))
+    conn.commit()
+    conn.close()
+
+
+def get_job(job_id):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(f'SELECT {JOB_COLUMNS} FROM playlist_jobs WHERE id = ?', (job_id,))
+    job = _job(c.fetchone())
+    conn.close()
+    return job
+
+
+def queue_stats():
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('SELECT status, COUNT(*) FROM playlist_jobs GROUP BY status')
+    stats = dict(c.fetchall())
+    conn.close()
+    return stats
+
+
+def purge_jobs(days=7):
+    """Delete finished jobs older than `days`."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        DELETE FROM playlist_jobs
+        WHERE status IN ('done', 'failed') AND updated_at < datetime('now', ?)
+    ''', (f'-{days} days',))
+    deleted = c.rowcount
+    conn.commit()
+    conn.close()
+    return deleted
@@ -0,0 +1,118 @@
+# db/ledger.py
+"""
+LLM usage ledger: one row per Orchestrator.run (calls, tokens, cost,
+budget and what was cut back to stay within it) plus per-stage totals for
+that run. Filled from the run's RequestLedger (llm_client.py).
+"""
+
+import json
+import math
+from datetime import datetime, timedelta
+
+from db.database import get_connection
+
+
+def save_ledger(ledger, request, user_id=None, kind="playlist", elapsed=None):
+    """Store a finished request's ledger. Returns the llm_requests row id."""
+    stages = {}
+    for call in list(ledger.calls):
+        entry = stages.setdefault(
+            (call["stage"], call["model"]),
+            {"calls": 0, "errors": 0, "input_tokens": 0, "output_tokens": 0, "latency": 0.0}
+        )
+        entry["calls"] += 1
+        entry["errors"] += 0 if call["ok"] else 1
+        entry["input_tokens"] += call["input_tokens"]
+        entry["output_tokens"] += call["output_tokens"]
+        entry["latency"] += call["latency"]
+
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        INSERT INTO llm_requests
+        (request, user_id, kind, calls, input_tokens, output_tokens, cost, budget, degraded, elapsed, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        request,
+        user_id,
+        kind,
+        sum(e["calls"] for e in stages.values()),
+        sum(e["input_tokens"] for e in stages.values()),
+        sum(e["output_tokens"] for e in stages.values()),
+        ledger.cost,
+        ledger.budget_tokens,
+        json.dumps(ledger.degraded),
+        elapsed,
+        datetime.now().isoformat()
+    ))
+    request_id = c.lastrowid
+    c.executemany('''
+        INSERT INTO llm_calls
+        (request_id, stage, model, calls, errors, input_tokens, output_tokens, latency)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [
+        (request_id, stage, model, e["calls"], e["errors"], e["input_tokens"], e["output_tokens"], e["latency"])
+        for (stage, model), e in stages.items()
+    ])
+    conn.commit()
+    conn.close()
+    return request_id
+
+
+def ledger_stats(days=7):
+    """Totals, per-request spread and per-stage usage over the last `days`."""
+    since = (datetime.now() - timedelta(days=days)).isoformat()
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        SELECT input_tokens + output_tokens, cost, degraded != '[]'
+        FROM llm_requests WHERE created_at >= ?
+        ORDER BY input_tokens + output_tokens
+    ''', (since,))
+    rows = c.fetchall()
+    c.execute('''
+        SELECT stage, SUM(l.calls), SUM(l.errors), SUM(l.input_tokens), SUM(l.output_tokens), SUM(l.latency)
+        FROM llm_calls l JOIN llm_requests r ON r.id = l.request_id
+        WHERE r.created_at >= ?
+        GROUP BY stage ORDER BY SUM(l.input_tokens + l.output_tokens) DESC
+    ''', (since,))
+    stages = {
+        row[0]: {
+            "calls": row[1],
+            "errors": row[2],
+            "input_tokens": row[3],
+            "output_tokens": row[4],
+            "avg_latency": row[5] / row[1] if row[1] else None,
+        }
+        for row in c.fetchall()
+    }
+    conn.close()
+
+    tokens = [row[0] for row in rows]
+    return {
+        "requests": len(rows),
+        "tokens": sum(tokens),
+        "cost": sum(row[1] for row in rows),
+        "degraded": sum(1 for row in rows if row[2]),
+        "avg_tokens": sum(tokens) / len(tokens) if tokens else None,
+        "p95_tokens": tokens[math.ceil(0.95 * len(tokens)) - 1] if tokens else None,
+        "max_tokens": tokens[-1] if tokens else None,
+        "stages": stages,
+    }
+
+
+def purge_ledger(days=30):
+    """Delete ledger rows older than `days`."""
+    cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        DELETE FROM llm_calls WHERE request_id IN (
+            SELECT id FROM llm_requests WHERE created_at < ?
+        )
+    ''', (cutoff,))
+    c.execute("DELETE FROM llm_requests WHERE created_at < ?", (cutoff,))
+    deleted = c.rowcount
+    conn.commit()
+    conn.close()
+    return deleted
@@ -0,0 +1,80 @@
+# db/prebuilt.py
+"""
+Playlists built ahead of time for routine requests (see ROUTINES in
+config.py), keyed by canonical request. Each entry holds the plan, the
+sequenced playlist and the scored candidate pool, but no YouTube playlist:
+that is only created when a matching request comes in.
+"""
+
+import os
+import json
+from datetime import datetime, timedelta
+
+from db.database import get_connection
+from db.sessions import pool_entry
+from song import Song
+
+# Prebuilt playlists older than this are rebuilt from scratch on request
+PREBUILT_TTL = int(os.getenv("PREBUILT_TTL", str(4 * 60 * 60)))
+
+
+def save_prebuilt(intent, request, version, plan, playlist, pool):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        INSERT OR REPLACE INTO prebuilt_playlists
+        (intent, request, profile_version, plan, playlist, pool, built_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        intent,
+        request,
+        version,
+        json.dumps(plan),
+        json.dumps(playlist, default=str),
+        json.dumps([pool_entry(s) for s in pool]),
+        datetime.now().isoformat()
+    ))
+    conn.commit()
+    conn.close()
+
+
+def get_prebuilt(intent, version, max_age=None):
+    """A fresh prebuilt playlist for this intent and profile version, or None."""
+    max_age = PREBUILT_TTL if max_age is None else max_age
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        SELECT request, profile_version, plan, playlist, pool, built_at
+        FROM prebuilt_playlists WHERE intent = ?
+    ''', (intent,))
+    row = c.fetchone()
+    conn.close()
+    if not row or row[1] != version:
+        return None
+    if datetime.fromisoformat(row[5]) < datetime.now() - timedelta(seconds=max_age):
+        return None
+    return {
+        "request": row[0],
+        "plan": json.loads(row[2]),
+        "playlist": json.loads(row[3]),
+        "pool": [Song(**entry) for entry in json.loads(row[4])],
+        "built_at": row[5],
+    }
+
+
+def delete_prebuilt(intent):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('DELETE FROM prebuilt_playlists WHERE intent = ?', (intent,))
+    conn.commit()
+    conn.close()
+
+
+def list_prebuilt():
+    """{intent: built_at} for every stored prebuilt playlist."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('SELECT intent, built_at FROM prebuilt_playlists')
+    rows = dict(c.fetchall())
+    conn.close()
+    return rows
@@ -0,0 +1,77 @@
+# db/sessions.py
+"""
+Per-user session state: the last request's plan, its scored candidate pool
+and the YouTube playlist built from it. Kept in SQLite so a follow-up can be
+handled by any worker process.
+"""
+
+import os
+import json
+from datetime import datetime, timedelta
+
+from db.database import get_connection
+from song import Song
+
+# Follow-ups older than this start a fresh playlist
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(3 * 60 * 60)))
+
+# Song fields kept in the pool (no lyrics)
+POOL_FIELDS = ("song_id", "title", "artist", "mood", "energy", "themes", "match_score", "reason")
+
+
+def pool_entry(song):
+    return {key: song.get(key) for key in POOL_FIELDS}
+
+
+def save_session(user_id, request, plan, pool, playlist_id, playlist_name, used_ids):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        INSERT OR REPLACE INTO sessions
+        (user_id, request, plan, pool, playlist_id, playlist_name, used_ids, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        user_id,
+        request,
+        json.dumps(plan),
+        json.dumps([pool_entry(s) for s in pool]),
+        playlist_id,
+        playlist_name,
+        json.dumps(list(used_ids)),
+        datetime.now().isoformat()
+    ))
+    conn.commit()
+    conn.close()
+
+
+def get_session(user_id, max_age=None):
+    """The user's session as a dict with `pool` as Songs, or None if missing or stale."""
+    max_age = SESSION_TTL if max_age is None else max_age
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        SELECT request, plan, pool, playlist_id, playlist_name, used_ids, updated_at
+        FROM sessions WHERE user_id = ?
+    ''', (user_id,))
+    row = c.fetchone()
+    conn.close()
+    if not row:
+        return None
+    if datetime.fromisoformat(row[6]) < datetime.now() - timedelta(seconds=max_age):
+        return None
+    return {
+        "request": row[0],
+        "plan": json.loads(row[1]) if row[1] else {},
+        "pool": [Song(**entry) for entry in json.loads(row[2] or "[]")],
+        "playlist_id": row[3],
+        "playlist_name": row[4],
+        "used_ids": json.loads(row[5] or "[]"),
+    }
+
+
+def clear_session(user_id):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('DELETE FROM sessions WHERE user_id = ?', (user_id,))
+    conn.commit()
+    conn.close()
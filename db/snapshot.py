@@ -0,0 +1,301 @@
+# db/snapshot.py
+"""
+Portable, read-only snapshot of the song analysis cache.
+
+A snapshot is one columnar file that can be memory-mapped at startup and
+layered under the live SQLite cache (see SNAPSHOT_PATH in db/database.py),
+so a fresh deployment starts warm without re-running thousands of LLM
+analyses. The layered snapshot only serves lookups by song ID (get_song,
+get_songs): the local catalog query and cross-version sharing read the
+SQLite index tables, so for those import the snapshot instead.
+
+    python -m db.snapshot export songs.snap
+    python -m db.snapshot import songs.snap    # materialize into music.db
+    python -m db.snapshot info songs.snap
+
+Layout (little-endian):
+
+    header   magic "MASNAP1\\0", version, row count, feature dim, section count
+    sections (offset, length) per section, in SECTIONS order
+
+    ids        string pool, sorted (binary search)
+    titles     string pool
+    artists    u32 per row -> artist_dict
+    moods      u32 per row -> mood_dict
+    energy     u8 per row (0 = unknown)
+    themes     u32 offsets per row into u32 theme ids -> theme_dict
+    features   float32 x dim per row (FEATURE_FIELDS)
+
+A string pool is a u32 count n, u32 offsets (n + 1), then the UTF-8 blob.
+"""
+
+import sys
+import json
+import mmap
+import struct
+import sqlite3
+from array import array
+
+from song import Song
+
+MAGIC = b"MASNAP1\0"
+VERSION = 1
+HEADER = struct.Struct("<8sIIII")
+SECTION = struct.Struct("<QQ")
+
+SECTIONS = (
+    "ids", "titles", "artists", "artist_dict", "moods", "mood_dict",
+    "energy", "theme_offsets", "theme_ids", "theme_dict", "features"
+)
+
+# Numeric lyric features (tools/lyric_features.py) stored per row, followed
+# by a one-hot over MOOD_VOCABULARY
+FEATURE_FIELDS = ("has_lyrics", "line_count", "word_count", "unique_word_ratio", "repetition_ratio")
+
+
+def _le(values):
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values.tobytes()
+
+
+def _pack_strings(strings):
+    offsets = array("I", [0])
+    blob = bytearray()
+    for s in strings:
+        blob += (s or "").encode("utf-8")
+        offsets.append(len(blob))
+    return struct.pack("<I", len(offsets) - 1) + _le(offsets) + bytes(blob)
+
+
+def _dictionary(values):
+    """Dictionary-encode values into (u32 codes, distinct values)."""
+    index = {}
+    codes = array("I")
+    for value in values:
+        value = value or ""
+        if value not in index:
+            index[value] = len(index)
+        codes.append(index[value])
+    return codes, list(index)
+
+
+def _energy_byte(value):
+    """Stored energy as 1-255 (0 = unknown); text the LLM left in the column counts as unknown."""
+    try:
+        return max(0, min(255, round(float(value or 0))))
+    except (TypeError, ValueError):
+        return 0
+
+
+def feature_vector(features, mood):
+    from db.database import MOOD_VOCABULARY, normalize_mood
+
+    features = features or {}
+    moods = set(normalize_mood(mood))
+    return [float(features.get(f) or 0) for f in FEATURE_FIELDS] + [
+        1.0 if term in moods else 0.0 for term in MOOD_VOCABULARY
+    ]
+
+
+def export_snapshot(path, db_path=None):
+    """Write every analyzed song in the SQLite cache to `path`. Returns row count."""
+    from db.database import DB_PATH, MOOD_VOCABULARY
+
+    conn = sqlite3.connect(db_path or DB_PATH)
+    c = conn.cursor()
+    c.execute('''
+        SELECT song_id, title, artist, mood, energy, themes, features
+        FROM songs WHERE mood IS NOT NULL
+        ORDER BY song_id
+    ''')
+    rows = c.fetchall()
+    conn.close()
+
+    artist_codes, artist_dict = _dictionary(r[2] for r in rows)
+    mood_codes, mood_dict = _dictionary(r[3] for r in rows)
+
+    theme_index = {}
+    theme_offsets = array("I", [0])
+    theme_ids = array("I")
+    for r in rows:
+        try:
+            themes = json.loads(r[5]) if r[5] else []
+        except ValueError:
+            themes = []
+        for theme in themes:
+            theme = str(theme).strip().lower()
+            if theme not in theme_index:
+                theme_index[theme] = len(theme_index)
+            theme_ids.append(theme_index[theme])
+        theme_offsets.append(len(theme_ids))
+
+    dim = len(FEATURE_FIELDS) + len(MOOD_VOCABULARY)
+    vectors = array("f")
+    for r in rows:
+        vectors.extend(feature_vector(json.loads(r[6]) if r[6] else None, r[3]))
+
+    sections = [
+        _pack_strings(r[0] for r in rows),
+        _pack_strings(r[1] for r in rows),
+        _le(artist_codes),
+        _pack_strings(artist_dict),
+        _le(mood_codes),
+        _pack_strings(mood_dict),
+        bytes(_energy_byte(r[4]) for r in rows),
+        _le(theme_offsets),
+        _le(theme_ids),
+        _pack_strings(list(theme_index)),
+        _le(vectors),
+    ]
+
+    offset = HEADER.size + SECTION.size * len(sections)
+    table = b""
+    for data in sections:
+        table += SECTION.pack(offset, len(data))
+        offset += len(data)
+
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(rows), dim, len(sections)))
+        f.write(table)
+        for data in sections:
+            f.write(data)
+
+    return len(rows)
+
+
+class Snapshot:
+    """Read-only, memory-mapped view of a snapshot file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.count, self.dim, nsections = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a v{VERSION} song snapshot")
+        self._sections = {
+            name: SECTION.unpack_from(self._mm, HEADER.size + i * SECTION.size)[0]
+            for i, name in enumerate(SECTIONS[:nsections])
+        }
+        self._artists = self._read_pool("artist_dict")
+        self._moods = self._read_pool("mood_dict")
+        self._themes = self._read_pool("theme_dict")
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, song_id):
+        return self._find(song_id) is not None
+
+    def _u32(self, section, i):
+        return struct.unpack_from("<I", self._mm, self._sections[section] + 4 * i)[0]
+
+    def _string(self, section, i):
+        start = self._sections[section]
+        n = self._u32(section, 0)
+        blob = start + 4 * (n + 2)
+        lo, hi = struct.unpack_from("<II", self._mm, start + 4 * (i + 1))
+        return self._mm[blob + lo:blob + hi].decode("utf-8")
+
+    def _read_pool(self, section):
+        return [self._string(section, i) for i in range(self._u32(section, 0))]
+
+    def _id(self, i):
+        return self._string("ids", i)
+
+    def _find(self, song_id):
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._id(mid) < song_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and self._id(lo) == song_id:
+            return lo
+        return None
+
+    def _row(self, i):
+        energy = self._mm[self._sections["energy"] + i]
+        t_lo = self._u32("theme_offsets", i)
+        t_hi = self._u32("theme_offsets", i + 1)
+        theme_ids = struct.unpack_from(f"<{t_hi - t_lo}I", self._mm, self._sections["theme_ids"] + 4 * t_lo)
+        return Song(
+            song_id=self._id(i),
+            title=self._string("titles", i),
+            artist=self._artists[self._u32("artists", i)] or None,
+            mood=self._moods[self._u32("moods", i)] or None,
+            energy=energy or None,
+            themes=[self._themes[t] for t in theme_ids],
+        )
+
+    def get(self, song_id):
+        i = self._find(song_id)
+        return self._row(i) if i is not None else None
+
+    def get_many(self, song_ids):
+        """{song_id: Song} for the IDs present in the snapshot."""
+        found = {}
+        for song_id in song_ids:
+            i = self._find(song_id)
+            if i is not None:
+                found[song_id] = self._row(i)
+        return found
+
+    def vector(self, song_id):
+        i = self._find(song_id)
+        if i is None:
+            return None
+        return list(struct.unpack_from(f"<{self.dim}f", self._mm, self._sections["features"] + 4 * self.dim * i))
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self._row(i)
+
+
+def import_snapshot(path):
+    """Copy snapshot songs missing from the live cache into SQLite. Returns rows added."""
+    from db.database import get_connection, _index_song
+
+    snapshot = Snapshot(path)
+    conn = get_connection()
+    c = conn.cursor()
+    added = 0
+    for song in snapshot:
+        c.execute('''
+            INSERT OR IGNORE INTO songs (song_id, title, artist, mood, energy, themes, analyzed_at)
+            VALUES (?, ?, ?, ?, ?, ?, datetime('now'))
+        ''', (song.song_id, song.title, song.artist, song.mood, song.energy, json.dumps(song.themes)))
+        if c.rowcount:
+            _index_song(c, song.song_id, song.mood, song.themes)
+            added += 1
+    conn.commit()
+    conn.close()
+    snapshot.close()
+    return added
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export/import song analysis snapshots")
+    parser.add_argument("command", choices=["export", "import", "info"])
+    parser.add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        print(f"Exported {export_snapshot(args.path)} songs to {args.path}")
+    elif args.command == "import":
+        from db.database import init_db
+        init_db()
+        print(f"Imported {import_snapshot(args.path)} new songs from {args.path}")
+    else:
+        snapshot = Snapshot(args.path)
+        print(f"{args.path}: {len(snapshot)} songs, {len(snapshot._artists)} artists, "
+              f"{len(snapshot._themes)} themes, {snapshot.dim}-d feature vectors")
@@ -0,0 +1,37 @@
+# formatting.py
+
+def format_playlist_response(result: dict) -> str:
+    name = result.get('playlist_name', 'Your Playlist')
+    description = result.get('description', '')
+    total = result.get('total_songs', 0)
+    duration = result.get('estimated_duration', '')
+    url = result.get('youtube_url', '')
+    flow = result.get('flow_description', '')
+    
+    songs = result.get('songs', [])[:5]
+    song_list = '\n'.join([
+        f"  {s.get('position', i+1)}. {s.get('title', 'Unknown')} - {s.get('artist', '')}"
+        for i, s in enumerate(songs)
+    ])
+    if len(result.get('songs', [])) > 5:
+        song_list += f"\n  ... and {len(result.get('songs', [])) - 5} more"
+    
+    response = f"""🎵 <b>{name}</b>
+
+{description}
+
+<b>Songs ({total}):</b>
+{song_list}
+
+{f'<i>{flow}</i>' if flow else ''}
+{f'⏱ {duration}' if duration else ''}
+"""
+    
+    if url:
+        response += f"\n▶️ <a href='{url}'>Open in YouTube Music</a>"
+    
+    plan = result.get('orchestrator_plan', {})
+    if plan:
+        response += f"\n\n<i>Strategy: {plan.get('strategy', '')} | Mood: {plan.get('inferred_mood', '')}</i>"
+    
+    return response
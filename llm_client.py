@@ -0,0 +1,531 @@
+# llm_client.py
+
+import time
+import asyncio
+import random
+import threading
+import contextvars
+from collections import deque, defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class LLMTimeoutError(TimeoutError):
+    """The call site's deadline passed before any attempt returned."""
+
+
+class CircuitOpenError(RuntimeError):
+    """The provider is considered unhealthy; callers should use their local fallback."""
+
+
+class BudgetExceededError(RuntimeError):
+    """The current request has used up its token budget."""
+
+
+class CircuitBreaker:
+    """
+    Classic closed/open/half-open breaker.
+
+    After `failure_threshold` consecutive failures the circuit opens and every
+    call fails fast for `reset_timeout` seconds. Then a single probe call is
+    let through; its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self.probing:
+                    print(f"LLM circuit opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+    def release(self):
+        """End a call that neither succeeded nor failed (cancelled), freeing the probe slot."""
+        with self._lock:
+            self.probing = False
+
+
+class StageMetrics:
+    """Per-stage latency, outcome and fallback counters, shared by all tiers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+
+    def _stage(self, stage, model_name=None):
+        if stage not in self.stages:
+            self.stages[stage] = {
+                "model": model_name,
+                "calls": 0,
+                "errors": 0,
+                "fallbacks": 0,
+                "total_latency": 0.0,
+                "latencies": deque(maxlen=200)
+            }
+        if model_name:
+            self.stages[stage]["model"] = model_name
+        return self.stages[stage]
+
+    def record_call(self, stage, model_name, latency, ok):
+        with self._lock:
+            entry = self._stage(stage, model_name)
+            entry["calls"] += 1
+            entry["total_latency"] += latency
+            entry["latencies"].append(latency)
+            if not ok:
+                entry["errors"] += 1
+
+    def record_fallback(self, stage):
+        with self._lock:
+            self._stage(stage)["fallbacks"] += 1
+
+    def report(self) -> dict:
+        with self._lock:
+            report = {}
+            for stage, entry in self.stages.items():
+                ordered = sorted(entry["latencies"])
+                report[stage] = {
+                    "model": entry["model"],
+                    "calls": entry["calls"],
+                    "errors": entry["errors"],
+                    "fallbacks": entry["fallbacks"],
+                    "avg_latency": entry["total_latency"] / entry["calls"] if entry["calls"] else None,
+                    "p95_latency": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] if ordered else None
+                }
+            return report
+
+
+STAGE_METRICS = StageMetrics()
+
+
+def _estimate_tokens(text):
+    # Rough: ~4 characters per token, used when the provider reports no usage
+    return max(1, len(text) // 4) if text else 0
+
+
+def _message_text(messages):
+    return "".join(str(getattr(m, "content", m)) for m in messages)
+
+
+class RequestLedger:
+    """
+    LLM calls, tokens and latency for one request, with an optional token
+    budget. Every request sent to a model is a call: hedged duplicates,
+    retries and failed or abandoned attempts included. Bound to the running
+    request through a context variable (see ledger_scope), so every
+    ResilientLLM call made on its behalf is counted.
+    """
+
+    def __init__(self, budget_tokens=0, price_input=0.0, price_output=0.0):
+        self.budget_tokens = budget_tokens
+        self.price_input = price_input
+        self.price_output = price_output
+        self.calls = []
+        self.degraded = []
+        self._lock = threading.Lock()
+
+    def record(self, call_site, model_name, input_tokens, output_tokens, latency, ok):
+        with self._lock:
+            self.calls.append({
+                "stage": call_site,
+                "model": model_name,
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "latency": latency,
+                "ok": ok,
+            })
+
+    def degrade(self, what):
+        """Note a step that was cut back to stay within the budget."""
+        with self._lock:
+            if what not in self.degraded:
+                self.degraded.append(what)
+
+    @property
+    def tokens(self):
+        with self._lock:
+            return sum(c["input_tokens"] + c["output_tokens"] for c in self.calls)
+
+    @property
+    def cost(self):
+        with self._lock:
+            return sum(
+                c["input_tokens"] * self.price_input + c["output_tokens"] * self.price_output
+                for c in self.calls
+            ) / 1_000_000
+
+    def spent_fraction(self):
+        """Share of the budget used so far (0 without a budget)."""
+        if not self.budget_tokens:
+            return 0.0
+        return self.tokens / self.budget_tokens
+
+    def remaining_tokens(self):
+        if not self.budget_tokens:
+            return None
+        return max(0, self.budget_tokens - self.tokens)
+
+    def average_tokens(self, call_site):
+        """Mean tokens per call at a call site so far, or None."""
+        with self._lock:
+            sizes = [c["input_tokens"] + c["output_tokens"] for c in self.calls if c["stage"] == call_site]
+        return sum(sizes) / len(sizes) if sizes else None
+
+    def check(self, call_site):
+        if self.budget_tokens and self.tokens >= self.budget_tokens:
+            self.degrade(f"{call_site} skipped")
+            raise BudgetExceededError(f"token budget of {self.budget_tokens} used, skipping {call_site}")
+
+
+_current_ledger = contextvars.ContextVar("llm_ledger", default=None)
+
+
+def current_ledger():
+    """The ledger of the request being handled, or None outside one."""
+    return _current_ledger.get()
+
+
+class ledger_scope:
+    """Bind a RequestLedger to the current context for the duration of a block."""
+
+    def __init__(self, ledger):
+        self.ledger = ledger
+
+    def __enter__(self):
+        self._token = _current_ledger.set(self.ledger)
+        return self.ledger
+
+    def __exit__(self, *exc):
+        _current_ledger.reset(self._token)
+
+
+class _Attempt:
+    """One request to the model, recorded in the ledger exactly once."""
+
+    def __init__(self, model, model_name, ledger, call_site, messages):
+        self.model = model
+        self.model_name = model_name
+        self.ledger = ledger
+        self.call_site = call_site
+        self.messages = messages
+        self.started = None
+        self._recorded = False
+        self._lock = threading.Lock()
+
+    def run(self, kwargs):
+        self.started = time.monotonic()
+        try:
+            result = self.model.invoke(self.messages, **kwargs)
+        except Exception:
+            self.record()
+            raise
+        self.record(result)
+        return result
+
+    def record(self, result=None):
+        """
+        Count the attempt: the reported (or estimated) usage on success;
+        on failure, or when abandoned still running, its input tokens.
+        """
+        if self.ledger is None:
+            return
+        with self._lock:
+            if self._recorded:
+                return
+            self._recorded = True
+        usage = getattr(result, "usage_metadata", None) or {}
+        output_tokens = 0
+        if result is not None:
+            output_tokens = usage.get("output_tokens") or _estimate_tokens(str(getattr(result, "content", "")))
+        self.ledger.record(
+            self.call_site,
+            self.model_name,
+            usage.get("input_tokens") or _estimate_tokens(_message_text(self.messages)),
+            output_tokens,
+            time.monotonic() - (self.started or time.monotonic()),
+            ok=result is not None
+        )
+
+
+class ResilientLLM:
+    """
+    Wraps a LangChain chat model with per-call-site deadlines, hedged
+    requests, bounded retries with jitter and a circuit breaker.
+
+    Usage mirrors the wrapped model: `llm.invoke(messages, call_site="intent")`.
+    Every failure mode raises, so the existing `except` fallbacks at each
+    call site still apply - they just trigger sooner.
+    """
+
+    def __init__(
+        self,
+        model,
+        model_name=None,
+        deadlines=None,
+        default_deadline=30.0,
+        hedge_percentile=0.95,
+        hedge_min_samples=10,
+        max_retries=2,
+        backoff_base=0.5,
+        breaker=None,
+        executor=None,
+        latencies=None,
+        metrics=None
+    ):
+        self.model = model
+        self.model_name = model_name
+        self.deadlines = deadlines or {}
+        self.default_deadline = default_deadline
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.breaker = breaker or CircuitBreaker()
+        self.executor = executor or ThreadPoolExecutor(max_workers=16, thread_name_prefix="llm")
+        # call_site -> recent successful latencies (seconds)
+        self.latencies = latencies if latencies is not None else defaultdict(lambda: deque(maxlen=100))
+        self.hedges_fired = defaultdict(int)
+        self.metrics = metrics or STAGE_METRICS
+
+    def bind_tools(self, tools, **kwargs):
+        """Bind tools on the wrapped model, sharing breaker, pool and latency stats."""
+        return ResilientLLM(
+            self.model.bind_tools(tools, **kwargs),
+            model_name=self.model_name,
+            deadlines=self.deadlines,
+            default_deadline=self.default_deadline,
+            hedge_percentile=self.hedge_percentile,
+            hedge_min_samples=self.hedge_min_samples,
+            max_retries=self.max_retries,
+            backoff_base=self.backoff_base,
+            breaker=self.breaker,
+            executor=self.executor,
+            latencies=self.latencies,
+            metrics=self.metrics
+        )
+
+    def invoke(self, messages, call_site="default", deadline=None, **kwargs):
+        ledger = current_ledger()
+        if ledger:
+            ledger.check(call_site)
+        # Each attempt (retry, hedge) is recorded in the ledger by _hedged_call
+        started = time.monotonic()
+        try:
+            result = self._invoke(messages, call_site, deadline, kwargs)
+        except Exception:
+            self.metrics.record_call(call_site, self.model_name, time.monotonic() - started, ok=False)
+            raise
+        self.metrics.record_call(call_site, self.model_name, time.monotonic() - started, ok=True)
+        return result
+
+    async def astream(self, messages, call_site="default", deadline=None, **kwargs):
+        """
+        Stream text chunks from the model.
+
+        The call site's deadline applies to the gap between chunks rather
+        than the whole response, so long outputs are fine as long as tokens
+        keep arriving. No retries or hedging: once chunks have been consumed
+        a retry would duplicate them.
+        """
+        ledger = current_ledger()
+        if ledger:
+            ledger.check(call_site)
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"LLM circuit open, skipping {call_site}")
+
+        deadline = deadline or self.deadlines.get(call_site, self.default_deadline)
+        started = time.monotonic()
+        stream = self.model.astream(messages, **kwargs).__aiter__()
+        usage = {}
+        streamed = 0
+
+        def record(ok):
+            latency = time.monotonic() - started
+            self.metrics.record_call(call_site, self.model_name, latency, ok=ok)
+            if ledger:
+                ledger.record(
+                    call_site,
+                    self.model_name,
+                    usage.get("input_tokens") or _estimate_tokens(_message_text(messages)),
+                    usage.get("output_tokens") or streamed // 4,
+                    latency,
+                    ok=ok
+                )
+
+        # Cancellation and early close (GeneratorExit) are not model
+        # failures, but the attempt is still counted and a half-open
+        # probe is always released
+        outcome = None
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), timeout=deadline)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    raise LLMTimeoutError(f"{call_site} stream stalled for {deadline:.1f}s")
+                # Providers that report usage do so on the last chunk
+                usage = getattr(chunk, "usage_metadata", None) or usage
+                if chunk.content:
+                    streamed += len(chunk.content)
+                    yield chunk.content
+            outcome = "ok"
+        except Exception:
+            outcome = "failed"
+            raise
+        finally:
+            if outcome == "ok":
+                self.breaker.record_success()
+            elif outcome == "failed":
+                self.breaker.record_failure()
+            else:
+                self.breaker.release()
+            record(ok=outcome == "ok")
+
+    def record_fallback(self, call_site):
+        """Count a call site that had to use its local default instead of the model."""
+        self.metrics.record_fallback(call_site)
+
+    def _invoke(self, messages, call_site, deadline, kwargs):
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"LLM circuit open, skipping {call_site}")
+
+        deadline = deadline or self.deadlines.get(call_site, self.default_deadline)
+        deadline_at = time.monotonic() + deadline
+        last_error = None
+
+        for attempt in range(self.max_retries + 1):
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                break
+
+            started = time.monotonic()
+            try:
+                result = self._hedged_call(messages, call_site, remaining, kwargs)
+            except Exception as e:
+                last_error = e
+                self.breaker.record_failure()
+                if self.breaker.state == "open":
+                    raise CircuitOpenError(f"LLM circuit open during {call_site}: {e}") from e
+
+                # Full jitter, never sleeping past the deadline
+                backoff = random.uniform(0, self.backoff_base * (2 ** attempt))
+                time.sleep(min(backoff, max(0.0, deadline_at - time.monotonic())))
+                continue
+
+            self.latencies[call_site].append(time.monotonic() - started)
+            self.breaker.record_success()
+            return result
+
+        if last_error is None or isinstance(last_error, LLMTimeoutError):
+            raise LLMTimeoutError(f"{call_site} exceeded {deadline:.1f}s deadline")
+        raise last_error
+
+    def hedge_delay(self, call_site):
+        """Latency percentile after which a second request is fired, or None."""
+        samples = self.latencies.get(call_site)
+        if not samples or len(samples) < self.hedge_min_samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile))
+        return ordered[index]
+
+    def _hedged_call(self, messages, call_site, timeout, kwargs):
+        ledger = current_ledger()
+        attempts = {}
+
+        def submit():
+            attempt = _Attempt(self.model, self.model_name, ledger, call_site, messages)
+            future = self.executor.submit(attempt.run, kwargs)
+            attempts[future] = attempt
+            return future
+
+        def abandon(futures):
+            # Requests already sent are paid for even if never awaited
+            for future in futures:
+                if not future.cancel():
+                    attempts[future].record()
+
+        started = time.monotonic()
+        pending = {submit()}
+        hedge_after = self.hedge_delay(call_site)
+        hedged = False
+        first_error = None
+
+        while pending:
+            remaining = timeout - (time.monotonic() - started)
+            if remaining <= 0:
+                break
+
+            wait_for = remaining
+            if not hedged and hedge_after is not None:
+                wait_for = min(remaining, max(0.0, hedge_after - (time.monotonic() - started)))
+
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                error = future.exception()
+                if error is None:
+                    abandon(pending)
+                    return future.result()
+                first_error = first_error or error
+
+            out_of_time = time.monotonic() - started >= timeout
+            if not done and not hedged and hedge_after is not None and not out_of_time:
+                hedged = True
+                self.hedges_fired[call_site] += 1
+                pending.add(submit())
+            elif not pending and first_error is not None:
+                raise first_error
+
+        abandon(pending)
+        if first_error is not None and not pending:
+            raise first_error
+        raise LLMTimeoutError(f"{call_site} attempt timed out after {timeout:.1f}s")
+
+    def stats(self) -> dict:
+        return {
+            "model": self.model_name,
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "call_sites": {
+                site: {
+                    "samples": len(samples),
+                    "hedge_after": self.hedge_delay(site),
+                    "hedges_fired": self.hedges_fired.get(site, 0)
+                }
+                for site, samples in self.latencies.items()
+            }
+        }
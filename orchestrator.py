@@ -1,10 +1,13 @@
 # orchestrator.py
 
 import json
+import time
 import asyncio
+from collections import Counter
 from datetime import datetime
 from langchain_core.messages import HumanMessage, SystemMessage
-from config import llm
+from config import get_llm, STREAMING_PLAYLIST, REQUEST_TOKEN_BUDGET, LLM_PRICE_INPUT, LLM_PRICE_OUTPUT
+from llm_client import RequestLedger, current_ledger, ledger_scope
 
 from agents.search_agent import SearchAgent
 from agents.lyrics_agent import LyricsAgent
@@ -13,8 +16,41 @@ from db.database import (
     get_profile,
     get_recent_recommendations,
     log_recommendation,
-    get_cached_songs
+    get_songs,
+    get_recommendation_counts,
+    get_analyzed_versions,
+    get_match_scores,
+    profile_version,
+    query_catalog
 )
+from db.graph import expand as expand_graph
+from db.sessions import get_session, save_session
+from db.prebuilt import get_prebuilt, save_prebuilt, delete_prebuilt
+from db.ledger import save_ledger
+from tools.canonical import canonical_key, canonical_request, collapse_versions
+from tools.prerank import prerank_songs, local_match_score
+
+# How long liked songs/history are reused for pre-ranking
+LIBRARY_TTL = 30 * 60
+
+# A prebuilt playlist is only served if at most this share of its songs
+# were recommended since it was built (the gap is filled from its pool)
+PREBUILT_MAX_REPLACED = 0.2
+
+# With a token budget: score cached songs locally below this share of the
+# budget left, and sequence locally below SEQUENCE_LOCALLY_BELOW (which is
+# also held back from lyric analysis)
+SCORE_LOCALLY_BELOW = 0.3
+SEQUENCE_LOCALLY_BELOW = 0.15
+# Tokens per lyric analysis until the request has measured its own
+ANALYSIS_TOKENS_ESTIMATE = 1500
+
+# Requests that want to get away from the usual listening
+DISCOVERY_MARKERS = ["surprise", "not the usual", "something new", "something different", "discover", "explore"]
+
+# A discovery request whose library-seeded graph walk finds this many
+# candidates per target song skips the search agent and most plan searches
+GRAPH_ENOUGH_PER_SONG = 2
 
 INTENT_PROMPT = """You are a music agent assistant.
 
@@ -22,6 +58,9 @@ Determine if the user wants:
 1. A playlist/music recommendation
 2. Just chatting/greeting
 3. Help with settings or profile
+4. A change to the playlist they just got (only if there is one below)
+
+Playlist they just got: {session}
 
 Examples:
 - "Hi" → chat
@@ -31,11 +70,23 @@ Examples:
 - "something melancholic" → playlist
 - "what can you do" → chat
 - "set my taste" → settings
+- "more like this" / "make it longer" → followup, extend
+- "swap the slow ones" / "less sad" → followup, refine
+
+For a followup, "extend" adds songs to the same playlist and "refine"
+rebuilds it. energy_range (1-10) and exclude_artists describe what the
+changed songs must satisfy; leave them null/empty if unspecified.
 
 Respond ONLY with valid JSON:
 {{
-    "intent": "chat" | "playlist" | "settings",
-    "response": "your friendly response if chat, null if playlist/settings"
+    "intent": "chat" | "playlist" | "settings" | "followup",
+    "response": "your friendly response if chat, null otherwise",
+    "followup": {{
+        "action": "extend" | "refine",
+        "count": 5,
+        "energy_range": [6, 10],
+        "exclude_artists": []
+    }}
 }}
 """
 
@@ -68,6 +119,9 @@ Respond ONLY with valid JSON:
     "strategy": "match mood / shift mood / surprise",
     "search_queries": ["query1", "query2"],
     "search_artists": ["artist1"],
+    "avoid_artists": ["artist to leave out"],
+    "energy_range": [1, 10],
+    "themes": ["theme1", "theme2"],
     "target_songs": 15,
     "playlist_mood": "how playlist should feel",
     "playlist_flow": "energy flow description",
@@ -77,20 +131,63 @@ Respond ONLY with valid JSON:
 
 class Orchestrator:
     def __init__(self):
-        self.llm = llm
+        self.intent_llm = get_llm("intent")
+        self.plan_llm = get_llm("plan")
         self.search_agent = SearchAgent()
         self.lyrics_agent = LyricsAgent()
         self.playlist_agent = PlaylistAgent()
+        self._library = None
+        self._library_fetched_at = 0
+        # Per-user guard: follow-ups read, extend and rewrite the session
+        self._session_locks = {}
     
-    async def run(self, user_request: str, progress_callback=None) -> dict:
-        """Main entry point with progress updates."""
+    async def run(self, user_request: str, progress_callback=None, user_id=None, prebuild=False) -> dict:
+        """
+        Main entry point with progress updates. With a user_id, the result
+        is kept as that user's session so follow-ups can reuse it.
+        
+        prebuild=True builds and stores a routine playlist ahead of time
+        (no YouTube playlist, nothing logged); matching requests are then
+        served from it.
         
+        Every LLM call made for the request is counted against its ledger
+        (REQUEST_TOKEN_BUDGET), which is stored when the run ends.
+        """
+        ledger = RequestLedger(REQUEST_TOKEN_BUDGET, LLM_PRICE_INPUT, LLM_PRICE_OUTPUT)
+        started = time.monotonic()
+        result = None
+        try:
+            with ledger_scope(ledger):
+                result = await self._run(user_request, progress_callback, user_id, prebuild)
+            return result
+        finally:
+            kind = "prebuild" if prebuild else (result or {}).get('type', 'error')
+            try:
+                save_ledger(ledger, user_request, user_id, kind, time.monotonic() - started)
+            except Exception as e:
+                print(f"Ledger save error: {e}")
+    
+    async def _run(self, user_request: str, progress_callback, user_id, prebuild) -> dict:
         async def update(msg):
             if progress_callback:
                 await progress_callback(msg)
         
-        # Step 0: Check intent
-        intent_result = self._check_intent(user_request)
+        session = None
+        if prebuild:
+            intent_result = {"intent": "playlist"}
+        else:
+            session = get_session(user_id) if user_id is not None else None
+            
+            # Step 0: Check intent
+            intent_result = await asyncio.to_thread(self._check_intent, user_request, session)
+        
+        if intent_result['intent'] == 'followup' and session and session['pool']:
+            async with self._session_locks.setdefault(user_id, asyncio.Lock()):
+                # Re-read: a concurrent follow-up may have extended it meanwhile
+                session = get_session(user_id) or session
+                return await self._follow_up(
+                    user_request, intent_result.get('followup') or {}, session, user_id, update
+                )
         
         if intent_result['intent'] == 'chat':
             return {
@@ -104,42 +201,65 @@ class Orchestrator:
                 "message": "Use /taste to set preferences.\nExample: /taste favorite_artists Sid Sriram, DSP"
             }
         
-        # Intent is playlist - continue with full flow
+        # Intent is playlist (or a follow-up without a session): a routine
+        # playlist built ahead of time, else the full flow
+        if not prebuild:
+            served = await self._serve_prebuilt(user_request, user_id, update)
+            if served:
+                return served
+        
         await update("🧠 Understanding your request...")
         
         profile = get_profile()
         recent = get_recent_recommendations(days=30)
         now = datetime.now()
-        plan = self._create_plan(user_request, profile, recent, now)
+        plan = await asyncio.to_thread(self._create_plan, user_request, profile, recent, now)
         
         # Step 2: Search
-        await update(f"🔍 Searching for songs...")
-        
-        all_songs = self.search_agent.run(user_request, profile)
-        
-        from tools.ytmusic import search_songs, get_artist_songs
-        
-        for query in plan.get('search_queries', []):
-            try:
-                results = search_songs(query, limit=30)
-                all_songs.extend(results)
-            except Exception as e:
-                print(f"Search error: {e}")
+        sources, library = await self._gather_sources(user_request, plan, profile, recent, update)
         
-        for artist in plan.get('search_artists', []):
-            try:
-                results = get_artist_songs(artist, limit=20)
-                all_songs.extend(results)
-            except Exception as e:
-                print(f"Artist search error: {e}")
+        source_counts = Counter(
+            song_id for results in sources for song_id in {s['song_id'] for s in results}
+        )
         
         # Deduplicate
         seen = set()
         unique_songs = []
-        for song in all_songs:
-            if song['song_id'] not in seen and song['song_id'] not in recent:
-                seen.add(song['song_id'])
-                unique_songs.append(song)
+        for results in sources:
+            for song in results:
+                if song['song_id'] not in seen:
+                    seen.add(song['song_id'])
+                    unique_songs.append(song)
+        
+        # One upload per song: lyric videos, "From <movie>", slowed/live
+        # versions collapse onto the best version. A song recommended
+        # recently is skipped in every version.
+        unique_songs, versions = collapse_versions(
+            unique_songs, source_counts, f"{user_request} {plan.get('playlist_mood', '')}"
+        )
+        recent_ids = set(recent)
+        unique_songs = [
+            s for s in unique_songs if not recent_ids.intersection(versions[s['song_id']])
+        ]
+        representative = {
+            song_id: rep_id for rep_id, ids in versions.items() for song_id in ids
+        }
+        source_counts = Counter(
+            rep_id for results in sources
+            for rep_id in {representative.get(s['song_id'], s['song_id']) for s in results}
+        )
+        known = self._known_versions(unique_songs, versions)
+        
+        # Pre-rank on local signals, then spend the analysis budget on the top
+        unique_songs = prerank_songs(
+            unique_songs,
+            source_counts,
+            profile,
+            plan,
+            known,
+            library=library,
+            past_counts=get_recommendation_counts([s['song_id'] for s in unique_songs])
+        )
         
         # Limit
         target = plan.get('target_songs', 15)
@@ -150,11 +270,29 @@ class Orchestrator:
         await update(f"📋 Found {len(unique_songs)} songs")
         
         # Step 3: Check cache
-        cached, uncached_ids = get_cached_songs([s['song_id'] for s in unique_songs])
-        uncached_songs = [s for s in unique_songs if s['song_id'] in uncached_ids]
+        cached = [
+            known[s['song_id']] for s in unique_songs
+            if s['song_id'] in known and known[s['song_id']].get('mood')
+        ]
+        cached_ids = {s['song_id'] for s in cached}
+        uncached_songs = [s for s in unique_songs if s['song_id'] not in cached_ids]
         
         await update(f"💾 Cached: {len(cached)} | New: {len(uncached_songs)}")
         
+        # Drop obvious mismatches before paying for LLM analysis
+        if uncached_songs:
+            uncached_songs, skipped = await asyncio.to_thread(
+                self.lyrics_agent.prefilter, uncached_songs, profile
+            )
+            if skipped:
+                await update(f"🧹 Skipped {len(skipped)} unlikely songs | Analyzing {len(uncached_songs)}")
+        
+        # Pre-ranked order: what the budget can't cover is the least promising
+        allowed = self._analysis_allowance(len(uncached_songs))
+        if allowed < len(uncached_songs):
+            await update(f"💸 Token budget: analyzing the top {allowed} of {len(uncached_songs)}")
+            uncached_songs = uncached_songs[:allowed]
+        
         # Step 4: Analyze with progress
         if uncached_songs:
             analyzed_new = await self.lyrics_agent.analyze_batch_with_progress(
@@ -166,51 +304,511 @@ class Orchestrator:
         else:
             analyzed_new = []
         
-        # Step 5: Score cached
-        await update("⚖️ Scoring songs against your request...")
+        # Step 5: Score cached - scores for the same intent and profile are remembered
+        memo = get_match_scores(
+            [s['song_id'] for s in cached], canonical_request(user_request), profile_version(profile)
+        )
+        remembered = sum(1 for s in cached if s['song_id'] in memo)
+        await update(
+            f"⚖️ Scoring songs against your request... ({remembered} remembered)"
+            if remembered else "⚖️ Scoring songs against your request..."
+        )
+        
+        score_locally = self._budget_left() < SCORE_LOCALLY_BELOW
+        if score_locally and len(memo) < len(cached):
+            current_ledger().degrade("local scoring")
         
+        # Not remembered: LLM-scored concurrently, or locally on a low
+        # budget (only LLM scores go into the memo)
+        to_score = [] if score_locally else [s for s in cached if s['song_id'] not in memo]
+        scored = iter(await self.lyrics_agent.score_cached_batch(to_score, user_request, profile))
         analyzed_cached = []
         for song in cached:
-            scored = self.lyrics_agent._score_cached(song, user_request, profile)
-            analyzed_cached.append(scored)
+            if song['song_id'] in memo:
+                analyzed_cached.append(song.with_score(*memo[song['song_id']]))
+            elif score_locally:
+                analyzed_cached.append(song.with_score(local_match_score(song, plan, profile), ""))
+            else:
+                analyzed_cached.append(next(scored))
         
         all_analyzed = analyzed_cached + analyzed_new
         
         # Step 6: Create playlist
         await update("🎼 Creating playlist...")
         
-        playlist = self.playlist_agent.create_playlist(
-            songs=all_analyzed,
-            request=user_request,
-            profile=profile,
-            target_length=plan.get('target_songs', 15),
-            create_on_youtube=True
+        if prebuild:
+            playlist = await asyncio.to_thread(
+                self.playlist_agent.create_playlist,
+                songs=all_analyzed,
+                request=user_request,
+                profile=profile,
+                target_length=plan.get('target_songs', 15),
+                create_on_youtube=False,
+                use_llm=self._budget_left() >= SEQUENCE_LOCALLY_BELOW
+            )
+            save_prebuilt(
+                canonical_request(user_request), user_request, profile_version(profile),
+                plan, playlist, all_analyzed
+            )
+            playlist['orchestrator_plan'] = plan
+            playlist['type'] = 'playlist'
+            return playlist
+        
+        playlist = await self._build_playlist(
+            all_analyzed, user_request, profile, plan.get('target_songs', 15), update
         )
         
         # Step 7: Log
         for song in playlist.get('songs', []):
             log_recommendation(song['song_id'], user_request)
         
+        if user_id is not None:
+            save_session(
+                user_id,
+                user_request,
+                plan,
+                all_analyzed,
+                playlist.get('playlist_id'),
+                playlist.get('playlist_name'),
+                [s['song_id'] for s in playlist.get('songs', [])]
+            )
+        
         playlist['orchestrator_plan'] = plan
         playlist['type'] = 'playlist'
         
         return playlist
     
-    def _check_intent(self, request: str) -> dict:
-        """Determine if user wants playlist, chat, or settings."""
+    async def _serve_prebuilt(self, user_request: str, user_id, update):
+        """
+        Serve a fresh prebuilt playlist for this request, after dropping songs
+        recommended since it was built. None if there is nothing usable.
+        """
+        intent = canonical_request(user_request)
+        try:
+            prebuilt = get_prebuilt(intent, profile_version(get_profile()))
+        except Exception as e:
+            print(f"Prebuilt lookup error: {e}")
+            return None
+        if not prebuilt:
+            return None
+        
+        playlist = prebuilt['playlist']
+        recent = set(get_recent_recommendations(days=30))
+        songs = [s for s in playlist.get('songs', []) if s['song_id'] not in recent]
+        replaced = len(playlist.get('songs', [])) - len(songs)
+        if not songs or replaced > PREBUILT_MAX_REPLACED * len(playlist.get('songs', [])):
+            return None
+        
+        if replaced:
+            picked = {s['song_id'] for s in songs}
+            spare = sorted(
+                (s for s in prebuilt['pool'] if s['song_id'] not in recent and s['song_id'] not in picked),
+                key=lambda s: s.get('match_score') or 0,
+                reverse=True
+            )
+            songs += [{**s, "reason": s.get('reason') or ""} for s in spare[:replaced]]
+        
+        await update("⚡ Using your ready-made playlist...")
+        
+        from tools.ytmusic import create_playlist, add_to_playlist, get_playlist_url
+        
+        playlist = dict(playlist)
+        playlist['songs'] = [{**s, "position": i + 1} for i, s in enumerate(songs)]
+        playlist['total_songs'] = len(songs)
+        try:
+            playlist_id = await asyncio.to_thread(
+                create_playlist, playlist.get('playlist_name', user_request), playlist.get('description', '')
+            )
+            await asyncio.to_thread(add_to_playlist, playlist_id, [s['song_id'] for s in songs])
+            playlist['playlist_id'] = playlist_id
+            playlist['youtube_url'] = get_playlist_url(playlist_id)
+        except Exception as e:
+            print(f"YouTube playlist error: {e}")
+            playlist['youtube_error'] = str(e)
+            playlist['youtube_url'] = None
+        
+        # Served once; the next build happens on schedule
+        delete_prebuilt(intent)
+        
+        for song in playlist['songs']:
+            log_recommendation(song['song_id'], user_request)
+        
+        if user_id is not None:
+            save_session(
+                user_id,
+                user_request,
+                prebuilt['plan'],
+                prebuilt['pool'],
+                playlist.get('playlist_id'),
+                playlist.get('playlist_name'),
+                [s['song_id'] for s in playlist['songs']]
+            )
+        
+        playlist['orchestrator_plan'] = prebuilt['plan']
+        playlist['type'] = 'playlist'
+        playlist['prebuilt_at'] = prebuilt['built_at']
+        return playlist
+    
+    async def _build_playlist(self, songs: list, request: str, profile: dict, target: int, update) -> dict:
+        if self._budget_left() < SEQUENCE_LOCALLY_BELOW:
+            current_ledger().degrade("local sequencing")
+            await update("💸 Token budget low: sequencing locally")
+            return await asyncio.to_thread(
+                self.playlist_agent.create_playlist, songs, request, profile, target, True, False
+            )
+        if STREAMING_PLAYLIST:
+            return await self.playlist_agent.create_playlist_streaming(
+                songs=songs,
+                request=request,
+                profile=profile,
+                target_length=target,
+                progress_callback=update
+            )
+        # Blocking LLM call and YouTube writes: keep them off the event loop
+        return await asyncio.to_thread(
+            self.playlist_agent.create_playlist,
+            songs=songs,
+            request=request,
+            profile=profile,
+            target_length=target,
+            create_on_youtube=True
+        )
+    
+    async def _follow_up(self, user_request: str, followup: dict, session: dict, user_id, update) -> dict:
+        """
+        Answer "more like this" / "swap the slow ones" from the session's
+        scored pool: extend appends to the same YouTube playlist, refine
+        re-sequences a new one. Searches only when the pool runs dry.
+        """
+        plan = session['plan']
+        used = list(session['used_ids'])
+        pool = {s['song_id']: s for s in session['pool']}
+        action = followup.get('action') or 'extend'
+        try:
+            count = max(1, int(followup.get('count') or 5))
+        except (TypeError, ValueError):
+            count = 5
+        
+        # The intent LLM may send numbers as strings ("6"); ignore a range it garbled
+        try:
+            low, high = (float(x) for x in followup.get('energy_range') or [])
+        except (TypeError, ValueError):
+            low = high = None
+        excluded_artists = {a.lower() for a in followup.get('exclude_artists') or []}
+        
+        def fits(song):
+            if (song.get('artist') or '').lower() in excluded_artists:
+                return False
+            if low is not None:
+                try:
+                    return low <= float(song.get('energy')) <= high
+                except (TypeError, ValueError):
+                    return False
+            return True
+        
+        if action == 'refine':
+            needed = max(len(used), count)
+            available = [s for s in pool.values() if fits(s)]
+        else:
+            needed = count
+            available = [s for s in pool.values() if s['song_id'] not in used and fits(s)]
+        
+        if len(available) < needed:
+            await update("🔍 Topping up the pool...")
+            fresh = await asyncio.to_thread(self._top_up, session, used, pool, needed - len(available))
+            for song in fresh:
+                pool[song['song_id']] = song
+            available += [s for s in fresh if fits(s)]
+        
+        available.sort(key=lambda s: s.get('match_score') or 0, reverse=True)
+        
+        if action == 'refine':
+            await update("🎼 Rebuilding playlist...")
+            playlist = await self._build_playlist(
+                available,
+                f"{session['request']} ({user_request})",
+                get_profile(),
+                needed,
+                update
+            )
+            used = [s['song_id'] for s in playlist.get('songs', [])]
+            playlist_id = playlist.get('playlist_id')
+            playlist_name = playlist.get('playlist_name')
+        else:
+            picks = available[:needed]
+            playlist_id = session['playlist_id']
+            playlist_name = session['playlist_name'] or session['request']
+            
+            from tools.ytmusic import add_to_playlist, get_playlist_url
+            
+            playlist = {
+                "playlist_name": playlist_name,
+                "description": f"Added {len(picks)} songs",
+                "total_songs": len(used) + len(picks),
+                "songs": [
+                    {**s, "position": len(used) + i + 1} for i, s in enumerate(picks)
+                ],
+                "youtube_url": get_playlist_url(playlist_id) if playlist_id else None
+            }
+            if playlist_id and picks:
+                try:
+                    await asyncio.to_thread(add_to_playlist, playlist_id, [s['song_id'] for s in picks])
+                except Exception as e:
+                    print(f"YouTube playlist error: {e}")
+                    playlist['youtube_error'] = str(e)
+            used += [s['song_id'] for s in picks]
+        
+        for song in playlist.get('songs', []):
+            log_recommendation(song['song_id'], user_request)
+        
+        save_session(user_id, session['request'], plan, list(pool.values()), playlist_id, playlist_name, used)
+        
+        playlist['orchestrator_plan'] = plan
+        playlist['type'] = 'playlist'
+        return playlist
+    
+    def _top_up(self, session: dict, used: list, pool: dict, shortfall: int) -> list:
+        """A few new analyzed songs for the session: graph neighbours first, then one search."""
+        plan = session['plan']
+        profile = get_profile()
+        skip = set(pool) | set(get_recent_recommendations(days=30))
+        
+        try:
+            candidates = expand_graph(used, limit=shortfall * 2, exclude=skip)
+        except Exception as e:
+            print(f"Graph expansion error: {e}")
+            candidates = []
+        if len(candidates) < shortfall * 2 and plan.get('search_queries'):
+            from tools.ytmusic import search_songs
+            try:
+                candidates += search_songs(plan['search_queries'][0], limit=15)
+            except Exception as e:
+                print(f"Search error: {e}")
+        
+        seen = set(skip)
+        fresh = []
+        for song in candidates:
+            if song['song_id'] not in seen:
+                seen.add(song['song_id'])
+                fresh.append(song)
+        fresh = fresh[:shortfall * 2]
+        if not fresh:
+            return []
+        
+        fresh, _ = self.lyrics_agent.prefilter(fresh, profile)
+        fresh = fresh[:self._analysis_allowance(len(fresh))]
+        return self.lyrics_agent.analyze_batch(fresh, session['request'], profile)
+    
+    def _budget_left(self) -> float:
+        """Share of the request's token budget still available (1.0 without one)."""
+        ledger = current_ledger()
+        if ledger is None or not ledger.budget_tokens:
+            return 1.0
+        return 1 - ledger.spent_fraction()
+    
+    def _analysis_allowance(self, wanted: int) -> int:
+        """
+        How many of `wanted` lyric analyses fit the remaining budget, keeping
+        SEQUENCE_LOCALLY_BELOW of it for sequencing.
+        """
+        ledger = current_ledger()
+        if ledger is None or not ledger.budget_tokens or not wanted:
+            return wanted
+        spendable = ledger.remaining_tokens() - SEQUENCE_LOCALLY_BELOW * ledger.budget_tokens
+        per_song = ledger.average_tokens("lyric_analysis") or ANALYSIS_TOKENS_ESTIMATE
+        allowed = max(0, min(wanted, int(spendable // per_song)))
+        if allowed < wanted:
+            ledger.degrade("smaller analysis set")
+        return allowed
+    
+    def _check_intent(self, request: str, session: dict = None) -> dict:
+        """Determine if user wants playlist, chat, settings, or a follow-up."""
+        if session:
+            described = f"\"{session['request']}\" ({len(session['used_ids'])} songs)"
+        else:
+            described = "none"
         messages = [
-            SystemMessage(content=INTENT_PROMPT),
+            SystemMessage(content=INTENT_PROMPT.format(session=described)),
             HumanMessage(content=request)
         ]
         
         try:
-            response = self.llm.invoke(messages)
+            response = self.intent_llm.invoke(messages, call_site="intent")
             return json.loads(response.content)
         except Exception as e:
             print(f"Intent check error: {e}")
+            self.intent_llm.record_fallback("intent")
             # Default to playlist if unsure
             return {"intent": "playlist", "response": None}
     
+    def _get_library(self) -> dict:
+        """
+        Liked songs and history for pre-ranking, refreshed every LIBRARY_TTL.
+        Makes YouTube Music calls: run it in a thread.
+        """
+        if self._library is not None and time.time() - self._library_fetched_at < LIBRARY_TTL:
+            return self._library
+        
+        from tools.ytmusic import get_liked_songs, get_history
+        
+        library = {"liked_ids": set(), "liked_artists": set(), "history_ids": set()}
+        try:
+            liked = get_liked_songs(limit=200)
+            library["liked_ids"] = {s['song_id'] for s in liked}
+            library["liked_artists"] = {(s.get('artist') or '').lower() for s in liked}
+        except Exception as e:
+            print(f"Liked songs error: {e}")
+        try:
+            library["history_ids"] = {s['song_id'] for s in get_history(limit=100)}
+        except Exception as e:
+            print(f"History error: {e}")
+        
+        self._library = library
+        self._library_fetched_at = time.time()
+        return library
+    
+    def _known_versions(self, songs: list, versions: dict) -> dict:
+        """
+        Stored songs by representative ID. A representative without analysis
+        borrows it from another version of the same song, found in this
+        request or in the cache by canonical key.
+        """
+        known = get_songs([song_id for s in songs for song_id in versions[s['song_id']]])
+        
+        missing = []
+        for song in songs:
+            song_id = song['song_id']
+            if song_id in known and known[song_id].get('mood'):
+                continue
+            sibling = next(
+                (known[i] for i in versions[song_id] if i in known and known[i].get('mood')),
+                None
+            )
+            if sibling is not None:
+                known[song_id] = sibling.copy(song_id=song_id, title=song.get('title'), artist=song.get('artist'))
+            else:
+                missing.append(song)
+        
+        if missing:
+            try:
+                shared = get_analyzed_versions([canonical_key(s) for s in missing])
+            except Exception as e:
+                print(f"Version lookup error: {e}")
+                shared = {}
+            for song in missing:
+                analyzed = shared.get(canonical_key(song))
+                if analyzed is not None:
+                    known[song['song_id']] = analyzed.copy(
+                        song_id=song['song_id'], title=song.get('title'), artist=song.get('artist')
+                    )
+        
+        return known
+    
+    async def _gather_sources(self, user_request: str, plan: dict, profile: dict, recent: list, update) -> tuple:
+        """
+        Candidate lists from every source, and the user's library. Returns
+        (sources, library).
+        
+        A discovery request walks the graph from the library first. If that
+        finds enough songs, the search agent (an LLM tool loop) is skipped
+        and only the first plan search runs.
+        """
+        from tools.ytmusic import search_songs, get_artist_songs
+        
+        async def fetch(fn, arg, limit, label):
+            try:
+                return await asyncio.to_thread(fn, arg, limit=limit)
+            except Exception as e:
+                print(f"{label} error: {e}")
+                return []
+        
+        graph_first = []
+        if self._is_discovery(user_request, plan):
+            library = await asyncio.to_thread(self._get_library)
+            graph_first = self._graph_candidates(user_request, plan, [], recent, library)
+            library_fetch = None
+        else:
+            # Liked songs / history for pre-ranking, fetched alongside
+            library_fetch = asyncio.ensure_future(asyncio.to_thread(self._get_library))
+        
+        queries = plan.get('search_queries', [])
+        graph_enough = len(graph_first) >= plan.get('target_songs', 15) * GRAPH_ENOUGH_PER_SONG
+        if graph_enough:
+            await update(f"🕸 Found {len(graph_first)} related songs locally, searching less...")
+            queries = queries[:1]
+        else:
+            await update(f"🔍 Searching for songs...")
+        
+        # Each source is one independent search; songs found by several
+        # of them rank higher below. They run in threads, concurrently: the
+        # YouTube Music limiter blocks and must stay off the event loop.
+        agent = [] if graph_enough else [asyncio.to_thread(self.search_agent.run, user_request, profile)]
+        sources = list(await asyncio.gather(
+            *agent,
+            *[fetch(search_songs, query, 30, "Search") for query in queries],
+            *[fetch(get_artist_songs, artist, 20, "Artist search") for artist in plan.get('search_artists', [])]
+        ))
+        
+        if library_fetch is not None:
+            library = await library_fetch
+        
+        # Songs we already know that fit the plan - no network or LLM needed
+        sources.append(self._query_catalog(plan, recent))
+        
+        # Radio neighbours of what the searches agree on, from the local graph
+        if graph_enough:
+            sources.append(graph_first)
+        else:
+            sources.append(self._graph_candidates(user_request, plan, sources, recent, library))
+        return sources, library
+    
+    def _is_discovery(self, request: str, plan: dict) -> bool:
+        text = f"{request} {plan.get('strategy', '')}".lower()
+        return any(marker in text for marker in DISCOVERY_MARKERS)
+    
+    def _graph_candidates(self, request: str, plan: dict, sources: list, recent: list, library: dict) -> list:
+        """Related songs from the co-occurrence graph (db/graph.py), no network calls."""
+        discovery = self._is_discovery(request, plan)
+        
+        counts = Counter(s['song_id'] for results in sources for s in results)
+        seeds = {song_id: float(n) for song_id, n in counts.most_common(20)}
+        exclude = set(recent)
+        if discovery:
+            # Start from the library but leave the usual songs out
+            for song_id in library["liked_ids"]:
+                seeds[song_id] = seeds.get(song_id, 0) + 0.5
+            exclude |= library["liked_ids"] | library["history_ids"]
+        
+        try:
+            return expand_graph(
+                seeds,
+                limit=plan.get('target_songs', 15) * (3 if discovery else 1),
+                exclude=exclude
+            )
+        except Exception as e:
+            print(f"Graph expansion error: {e}")
+            return []
+    
+    def _query_catalog(self, plan: dict, recent: list) -> list:
+        # The plan comes from the LLM: an energy_range of 7 or ["x"] is ignored
+        energy_range = plan.get('energy_range')
+        if not isinstance(energy_range, (list, tuple)) or len(energy_range) != 2:
+            energy_range = [None, None]
+        
+        try:
+            return query_catalog(
+                energy_min=energy_range[0],
+                energy_max=energy_range[1],
+                themes=plan.get('themes', []),
+                moods=[plan.get('playlist_mood', ''), plan.get('inferred_mood', '')],
+                exclude_artists=plan.get('avoid_artists', []),
+                exclude_ids=set(recent),
+                limit=plan.get('target_songs', 15) * 2
+            )
+        except Exception as e:
+            print(f"Catalog query error: {e}")
+            return []
+    
     def _create_plan(self, request: str, profile: dict, recent: list, now: datetime) -> dict:
         profile_str = json.dumps(profile, indent=2) if profile else "Not set yet"
         
@@ -227,16 +825,20 @@ class Orchestrator:
         ]
         
         try:
-            response = self.llm.invoke(messages)
+            response = self.plan_llm.invoke(messages, call_site="plan")
             return json.loads(response.content)
         except Exception as e:
             print(f"Plan error: {e}")
+            self.plan_llm.record_fallback("plan")
             return {
                 "understood_request": request,
                 "inferred_mood": "neutral",
                 "strategy": "match mood",
                 "search_queries": [request],
                 "search_artists": [],
+                "avoid_artists": [],
+                "energy_range": [1, 10],
+                "themes": [],
                 "target_songs": 15,
                 "playlist_mood": request,
                 "playlist_flow": "balanced",
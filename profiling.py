@@ -0,0 +1,261 @@
+# profiling.py
+"""
+Opt-in profiling of a single Orchestrator.run.
+
+profile_run() wraps one run with cProfile, tracemalloc and call counters
+for LLM calls, YouTube Music calls and SQLite statements, then writes a
+self-contained text report to PROFILE_DIR. The counters are installed by
+patching ResilientLLM, EndpointLimiter and sqlite3.connect for the duration
+of the run only, so nothing is measured (or slowed down) otherwise.
+
+Most of a run happens off the event loop (asyncio.to_thread, the LLM
+executor, the lyrics prefetch pool), where the event-loop profiler can't
+see it. ThreadPoolExecutor.submit is patched too, so each task submitted
+during the run gets its own cProfile; these are merged into a separate
+worker-thread section of the report.
+
+Triggered by PROFILE_RUNS=true (every request) or the admin-only
+/profilerun command.
+"""
+
+import io
+import os
+import re
+import time
+import pstats
+import sqlite3
+import asyncio
+import cProfile
+import threading
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from llm_client import ResilientLLM
+from tools.ratelimit import EndpointLimiter
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+# tracemalloc and the patches are process-wide: one profiled run at a time
+_lock = asyncio.Lock()
+
+
+class CallCounters:
+    """Calls and wall time per (kind, label), safe to update from any thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = defaultdict(lambda: {"calls": 0, "errors": 0, "seconds": 0.0, "max": 0.0})
+
+    def record(self, kind, label, seconds, ok=True):
+        with self._lock:
+            entry = self.calls[(kind, label)]
+            entry["calls"] += 1
+            entry["seconds"] += seconds
+            entry["max"] = max(entry["max"], seconds)
+            if not ok:
+                entry["errors"] += 1
+
+    def timed(self, kind, label, fn, *args, **kwargs):
+        started = time.monotonic()
+        ok = False
+        try:
+            result = fn(*args, **kwargs)
+            ok = True
+            return result
+        finally:
+            self.record(kind, label, time.monotonic() - started, ok)
+
+
+def _install(counters, thread_profiles):
+    """
+    Patch the call counters in, and a profiler around every task submitted
+    to a thread pool (appended to thread_profiles once it finishes).
+    Returns a function that restores the originals.
+    """
+    original_invoke = ResilientLLM.invoke
+    original_astream = ResilientLLM.astream
+    original_call = EndpointLimiter.call
+    original_connect = sqlite3.connect
+    original_submit = ThreadPoolExecutor.submit
+
+    def invoke(self, messages, call_site="default", deadline=None, **kwargs):
+        return counters.timed(
+            "llm", f"{call_site} ({self.model_name})",
+            original_invoke, self, messages, call_site=call_site, deadline=deadline, **kwargs
+        )
+
+    async def astream(self, messages, call_site="default", deadline=None, **kwargs):
+        started = time.monotonic()
+        ok = False
+        try:
+            async for chunk in original_astream(self, messages, call_site=call_site, deadline=deadline, **kwargs):
+                yield chunk
+            ok = True
+        finally:
+            counters.record("llm", f"{call_site} ({self.model_name}, stream)", time.monotonic() - started, ok)
+
+    def call(self, fn, *args, **kwargs):
+        label = f"{self.name}: {getattr(fn, '__name__', 'call')}"
+        return counters.timed("ytmusic", label, original_call, self, fn, *args, **kwargs)
+
+    def connect(*args, **kwargs):
+        conn = original_connect(*args, **kwargs)
+
+        def trace(statement):
+            # Group by statement shape: strip literals and collapse IN lists
+            shape = re.sub(r"\s+", " ", statement).strip()
+            shape = re.sub(r"'[^']*'|\b\d+(\.\d+)?\b", "?", shape)
+            shape = re.sub(r"\((\?,\s*)+\?\)", "(?...)", shape)
+            counters.record("sqlite", shape[:120], 0.0)
+
+        conn.set_trace_callback(trace)
+        return conn
+
+    def submit(self, fn, *args, **kwargs):
+        def profiled(*args, **kwargs):
+            profiler = cProfile.Profile()
+            try:
+                return profiler.runcall(fn, *args, **kwargs)
+            finally:
+                thread_profiles.append(profiler)
+        return original_submit(self, profiled, *args, **kwargs)
+
+    ResilientLLM.invoke = invoke
+    ResilientLLM.astream = astream
+    EndpointLimiter.call = call
+    sqlite3.connect = connect
+    ThreadPoolExecutor.submit = submit
+
+    def restore():
+        ResilientLLM.invoke = original_invoke
+        ResilientLLM.astream = original_astream
+        EndpointLimiter.call = original_call
+        sqlite3.connect = original_connect
+        ThreadPoolExecutor.submit = original_submit
+
+    return restore
+
+
+def _print_stats(w, profilers):
+    stats = None
+    for profiler in profilers:
+        profiler.create_stats()
+        # pstats refuses a profile that recorded nothing
+        if not profiler.stats:
+            continue
+        if stats is None:
+            stats = pstats.Stats(profiler, stream=io.StringIO())
+        else:
+            stats.add(profiler)
+    if stats is None:
+        w("  (nothing recorded)\n")
+        return
+    stats.sort_stats("cumulative").print_stats(40)
+    w(stats.stream.getvalue())
+
+
+def _report(request, started_at, wall, timeline, counters, profiler, thread_profiles, snapshot, baseline, peak,
+            result, error):
+    out = io.StringIO()
+    w = out.write
+
+    w(f"Profiled run: {request!r}\n")
+    w(f"Started: {started_at}\n")
+    w(f"Wall time: {wall:.2f}s\n")
+    w(f"Result: {'error: ' + repr(error) if error else (result or {}).get('type', '-')}\n")
+    w(f"Peak traced memory: {peak / 1024 / 1024:.1f} MB\n")
+    w("Counters are process-wide: concurrent requests during the run are included.\n")
+
+    w("\n== Timeline ==\n")
+    for offset, _, message in timeline:
+        w(f"  {offset:7.2f}s  {message}\n")
+
+    for kind in ("llm", "ytmusic", "sqlite"):
+        rows = sorted(
+            ((label, entry) for (k, label), entry in counters.calls.items() if k == kind),
+            key=lambda item: (-item[1]["seconds"], -item[1]["calls"])
+        )
+        total = sum(entry["calls"] for _, entry in rows)
+        w(f"\n== {kind} calls ({total}) ==\n")
+        for label, entry in rows[:40]:
+            if kind == "sqlite":
+                w(f"  {entry['calls']:6d}  {label}\n")
+            else:
+                w(
+                    f"  {entry['calls']:4d} calls  {entry['errors']:3d} errors  "
+                    f"{entry['seconds']:7.2f}s total  {entry['max']:6.2f}s max  {label}\n"
+                )
+
+    w("\n== CPU, event loop thread (cProfile, by cumulative time) ==\n")
+    _print_stats(w, [profiler])
+
+    w(f"\n== CPU, worker threads ({len(thread_profiles)} tasks merged, by cumulative time) ==\n")
+    _print_stats(w, list(thread_profiles))
+
+    w("\n== Allocations (tracemalloc, growth during the run) ==\n")
+    for stat in snapshot.compare_to(baseline, "lineno")[:25]:
+        w(f"  {stat}\n")
+
+    return out.getvalue()
+
+
+async def profile_run(orchestrator, request, progress_callback=None, report_dir=None, user_id=None):
+    """
+    Run orchestrator.run(request) under the profiler.
+
+    Returns (result, report_path). Exceptions from the run are re-raised
+    after the report is written. If another profiled run is in progress the
+    request runs unprofiled and report_path is None.
+    """
+    if _lock.locked():
+        return await orchestrator.run(request, progress_callback=progress_callback, user_id=user_id), None
+
+    async with _lock:
+        started = time.monotonic()
+        started_at = datetime.now().isoformat()
+        timeline = []
+
+        async def progress(message):
+            timeline.append((time.monotonic() - started, datetime.now().isoformat(), message))
+            if progress_callback:
+                await progress_callback(message)
+
+        counters = CallCounters()
+        thread_profiles = []
+        restore = _install(counters, thread_profiles)
+        tracemalloc.start(10)
+        baseline = tracemalloc.take_snapshot()
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+        result, error = None, None
+        try:
+            result = await orchestrator.run(request, progress_callback=progress, user_id=user_id)
+        except Exception as e:
+            error = e
+        finally:
+            profiler.disable()
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            restore()
+
+        wall = time.monotonic() - started
+        report = _report(
+            request, started_at, wall, timeline, counters, profiler, thread_profiles, snapshot, baseline, peak,
+            result, error
+        )
+
+        report_dir = report_dir or PROFILE_DIR
+        os.makedirs(report_dir, exist_ok=True)
+        slug = re.sub(r"[^a-z0-9]+", "-", request.lower()).strip("-")[:40] or "run"
+        path = os.path.join(report_dir, f"{datetime.now():%Y%m%d-%H%M%S}-{slug}.txt")
+        with open(path, "w") as f:
+            f.write(report)
+        print(f"Profile written to {path} ({wall:.2f}s)")
+
+        if error is not None:
+            raise error
+        return result, path
@@ -0,0 +1,166 @@
+# song.py
+
+import sys
+import json
+
+# Lyrics exist in the songs table but were not selected; load on first access
+_DEFERRED = object()
+
+FIELDS = (
+    "song_id", "title", "artist", "album", "lyrics", "mood", "energy",
+    "themes", "match_score", "reason", "analyzed_at"
+)
+
+
+class Song:
+    """
+    Compact song record passed between tools, agents and the DB layer.
+
+    Slotted, with interned artist names. `themes` is kept as the raw JSON
+    string until first read, and lyrics of DB-loaded songs are only fetched
+    when accessed. Supports the dict-style access (`song['title']`,
+    `song.get(...)`, `{**song}`) the rest of the code already uses; keys
+    outside the fixed fields go to a small `extra` dict.
+    """
+
+    __slots__ = (
+        "song_id", "title", "artist", "album", "_lyrics", "mood", "energy",
+        "_themes", "match_score", "reason", "analyzed_at", "extra"
+    )
+
+    def __init__(
+        self,
+        song_id,
+        title=None,
+        artist=None,
+        album=None,
+        lyrics=None,
+        mood=None,
+        energy=None,
+        themes=None,
+        match_score=None,
+        reason=None,
+        analyzed_at=None,
+        **extra
+    ):
+        self.song_id = song_id
+        self.title = title
+        self.artist = sys.intern(artist) if isinstance(artist, str) else artist
+        self.album = album
+        self._lyrics = lyrics
+        self.mood = mood
+        self.energy = energy
+        self._themes = themes
+        self.match_score = match_score
+        self.reason = reason
+        self.analyzed_at = analyzed_at
+        self.extra = extra or None
+
+    @classmethod
+    def coerce(cls, song):
+        """Return `song` as a Song, converting plain dicts."""
+        if isinstance(song, cls):
+            return song
+        return cls(**song)
+
+    @classmethod
+    def from_row(cls, row, with_lyrics=False):
+        """Build from (song_id, title, artist, mood, energy, themes, analyzed_at[, lyrics])."""
+        return cls(
+            song_id=row[0],
+            title=row[1],
+            artist=row[2],
+            mood=row[3],
+            energy=row[4],
+            themes=row[5],
+            analyzed_at=row[6],
+            lyrics=row[7] if with_lyrics else _DEFERRED
+        )
+
+    @property
+    def themes(self):
+        if isinstance(self._themes, str):
+            try:
+                self._themes = json.loads(self._themes)
+            except ValueError:
+                self._themes = []
+        return self._themes
+
+    @themes.setter
+    def themes(self, value):
+        self._themes = value
+
+    @property
+    def lyrics(self):
+        if self._lyrics is _DEFERRED:
+            from db.database import get_song_lyrics
+            self._lyrics = get_song_lyrics(self.song_id)
+        return self._lyrics
+
+    @lyrics.setter
+    def lyrics(self, value):
+        self._lyrics = value
+
+    def copy(self, **changes):
+        clone = Song.__new__(Song)
+        for name in Song.__slots__:
+            setattr(clone, name, getattr(self, name))
+        if self.extra:
+            clone.extra = dict(self.extra)
+        for key, value in changes.items():
+            clone[key] = value
+        return clone
+
+    def with_score(self, match_score, reason=""):
+        return self.copy(match_score=match_score, reason=reason)
+
+    def to_dict(self) -> dict:
+        return {key: self[key] for key in self.keys()}
+
+    # --- dict-style access ---
+
+    def __getitem__(self, key):
+        if key in FIELDS:
+            return getattr(self, key)
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in FIELDS:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        if key == "lyrics":
+            return self._lyrics is not None
+        if key == "themes":
+            return self._themes is not None
+        if key in FIELDS:
+            return getattr(self, key) is not None
+        return bool(self.extra) and key in self.extra
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        value = self[key]
+        return default if value is None else value
+
+    def keys(self):
+        # Deferred lyrics are left out so copying a record never hits the DB
+        keys = [
+            key for key in FIELDS
+            if key in self and not (key == "lyrics" and self._lyrics is _DEFERRED)
+        ]
+        if self.extra:
+            keys.extend(self.extra)
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __repr__(self):
+        return f"Song({self.song_id!r}, {self.title!r}, {self.artist!r})"
@@ -0,0 +1,38 @@
+# tests/conftest.py
+
+import os
+import sys
+import types
+
+import pytest
+
+# config.py builds the xAI clients at import time
+os.environ.setdefault("XAI_API_KEY", "test")
+
+
+@pytest.fixture
+def fake_ytmusic(monkeypatch):
+    """Stand-in for tools.ytmusic (which logs in on import); records calls."""
+    calls = []
+    module = types.ModuleType("tools.ytmusic")
+
+    def create_playlist(title, description=""):
+        calls.append(("create", title))
+        return f"PL{sum(1 for c in calls if c[0] == 'create')}"
+
+    module.create_playlist = create_playlist
+    module.add_to_playlist = lambda playlist_id, song_ids: calls.append(("add", playlist_id, list(song_ids)))
+    module.get_playlist_url = lambda playlist_id: f"https://music.youtube.com/playlist?list={playlist_id}"
+    module.calls = calls
+    monkeypatch.setitem(sys.modules, "tools.ytmusic", module)
+    return module
+
+
+@pytest.fixture
+def temp_db(monkeypatch, tmp_path):
+    """Fresh music.db in a temp directory."""
+    import db.database as database
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "music.db"))
+    monkeypatch.setattr(database, "_access", {})
+    database.init_db()
+    return database
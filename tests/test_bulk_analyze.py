@@ -0,0 +1,50 @@
+# tests/test_bulk_analyze.py
+
+import json
+
+import bulk_analyze
+from agents.lyrics_agent import LyricsAgent
+from llm_client import current_ledger
+from song import Song
+
+
+class MeteredAgent:
+    """Spends 100 tokens per analysis through the run's ledger."""
+
+    def analyze_and_cache(self, song, request, profile):
+        ledger = current_ledger()
+        ledger.check("lyric_analysis")
+        ledger.record("lyric_analysis", "m", 80, 20, 0.0, ok=True)
+        return {**song, "mood": "calm"}
+
+
+def test_run_stops_at_the_token_budget_and_leaves_the_rest_pending(temp_db, monkeypatch):
+    monkeypatch.setattr(bulk_analyze, "LyricsAgent", MeteredAgent)
+    temp_db.add_bulk_items("seed", [{"song_id": f"s{i}", "title": "T", "artist": "A"} for i in range(10)])
+
+    done = bulk_analyze.run_job("seed", workers=1, max_tokens=300)
+
+    progress = temp_db.get_bulk_progress("seed")
+    assert 3 <= done < 10
+    assert progress.get("done") == done
+    assert progress.get("pending") == 10 - done
+    assert not progress.get("failed")
+
+
+class ScoreLLM:
+    def invoke(self, messages, call_site="default"):
+        class Response:
+            content = json.dumps({"mood": "calm", "energy": 3, "themes": [], "match_score": 9, "reason": ""})
+        return Response()
+
+
+def test_bulk_scores_are_not_memoized(temp_db):
+    agent = object.__new__(LyricsAgent)
+    agent.analysis_llm = ScoreLLM()
+    agent.remember_scores = False
+
+    agent._analyze_single(Song(song_id="s1", title="T", artist="A"), bulk_analyze.CACHE_REQUEST, {})
+
+    conn = temp_db.get_connection()
+    assert conn.execute("SELECT COUNT(*) FROM match_scores").fetchone()[0] == 0
+    conn.close()
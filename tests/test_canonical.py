@@ -0,0 +1,100 @@
+# tests/test_canonical.py
+
+from tools.canonical import canonical_key, canonical_request, canonical_title, collapse_versions, version_tags
+
+
+def song(song_id, title, artist="Sid Sriram"):
+    return {"song_id": song_id, "title": title, "artist": artist}
+
+
+def groups(songs, request_text=""):
+    _, members = collapse_versions(songs, request_text=request_text)
+    return sorted(sorted(ids) for ids in members.values())
+
+
+def test_annotations_are_stripped_from_brackets_and_after_separators():
+    assert canonical_title("Inkem Inkem (Lyric Video)") == "inkem inkem"
+    assert canonical_title('Inkem Inkem - From "Geetha Govindam"') == "inkem inkem"
+    assert canonical_title("Inkem Inkem | Geetha Govindam | Aditya Music") == "inkem inkem"
+    assert canonical_title("Inkem Inkem [Slowed + Reverb]") == "inkem inkem"
+    assert canonical_title("Inkem Inkem Full Video Song") == "inkem inkem"
+
+
+def test_title_words_that_look_like_tags_are_kept():
+    assert canonical_title("Live Forever") == "live forever"
+    assert canonical_title("Cover Me Up") == "cover me up"
+    assert canonical_title("Audio Drama") == "audio drama"
+    assert version_tags("Live Forever") == []
+    assert version_tags("Live Forever (Live)") == ["live"]
+
+
+def test_uploads_of_one_song_merge():
+    assert groups([
+        song("a", "Inkem Inkem"),
+        song("b", "Inkem Inkem (Lyrical)"),
+        song("c", 'Inkem Inkem - From "Geetha Govindam"'),
+        song("d", "Inkem Inkem (Slowed + Reverb)"),
+    ]) == [["a", "b", "c", "d"]]
+
+
+def test_romanization_variants_by_one_artist_merge():
+    assert groups([
+        song("a", "Nuvvu Naaku Nachav"),
+        song("b", "Nuvu Naku Nachav"),
+    ]) == [["a", "b"]]
+
+
+def test_distinct_songs_stay_apart():
+    assert groups([
+        song("a", "Forever"),
+        song("b", "Live Forever"),
+        song("c", "Cover Me Up"),
+        song("d", "Me Up"),
+    ]) == [["a"], ["b"], ["c"], ["d"]]
+
+
+def test_short_titles_only_merge_exactly():
+    assert groups([song("a", "Feel"), song("b", "Fill")]) == [["a"], ["b"]]
+
+
+def test_same_title_by_different_artists_stays_apart():
+    assert groups([
+        song("a", "Nuvvu Naaku Nachav", "Sid Sriram"),
+        song("b", "Nuvvu Naaku Nachav", "Karthik"),
+    ]) == [["a"], ["b"]]
+
+
+def test_representative_prefers_the_original_unless_a_version_is_asked_for():
+    songs = [song("a", "Inkem Inkem (Lofi)"), song("b", "Inkem Inkem")]
+    assert [s["song_id"] for s in collapse_versions(songs)[0]] == ["b"]
+    assert [s["song_id"] for s in collapse_versions(songs, request_text="lofi songs")[0]] == ["a"]
+
+
+def test_requests_for_one_routine_share_a_key():
+    assert canonical_request("Gym playlist!") == "gym"
+    assert canonical_request("songs for my workout") == "gym"
+    assert canonical_request("songs to work out to") == "gym"
+    assert canonical_request("music for working out") == "gym"
+    assert canonical_request("road trip songs") == canonical_request("music for driving") == "drive"
+    assert canonical_request("Lo-fi vibes") == canonical_request("lo fi music") == "lofi"
+
+
+def test_ambiguous_words_are_not_folded():
+    assert canonical_request("music for work") == "work"
+    assert canonical_request("coding music") == "code"
+    assert canonical_request("focus songs") == "focus"
+    assert canonical_request("lofi songs") != canonical_request("chill songs")
+
+
+def test_request_key_ignores_filler():
+    assert canonical_request("sad rain songs") == canonical_request("give me some sad rain music") == "sad rain"
+
+
+def test_opposite_requests_have_different_keys():
+    assert canonical_request("happy not sad") != canonical_request("sad not happy")
+    assert canonical_request("gym playlist") != canonical_request("no gym playlist")
+
+
+def test_same_title_by_unknown_artists_stays_apart():
+    assert canonical_key(song("a", "Intro", "Unknown")) != canonical_key(song("b", "Intro", ""))
+    assert groups([song("a", "Intro", "Unknown"), song("b", "Intro", None)]) == [["a"], ["b"]]
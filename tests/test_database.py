@@ -0,0 +1,82 @@
+# tests/test_database.py
+
+
+def test_save_song_keeps_stored_features_and_lyrics(temp_db):
+    song = {"song_id": "s1", "title": "Song", "artist": "Artist", "lyrics": "la la"}
+    temp_db.save_song_features(song, {"word_count": 2})
+
+    temp_db.save_song({
+        "song_id": "s1", "title": "Song", "artist": "Artist",
+        "mood": "happy", "energy": 7, "themes": '["love"]'
+    })
+
+    stored = temp_db.get_song_features(["s1"])
+    assert stored["s1"] == ({"word_count": 2}, "la la")
+    assert temp_db.get_song("s1")["mood"] == "happy"
+
+
+def test_save_song_replaces_features_it_carries(temp_db):
+    song = {"song_id": "s1", "title": "Song", "artist": "Artist", "lyrics": "la"}
+    temp_db.save_song_features(song, {"word_count": 1})
+    temp_db.save_song({**song, "mood": "sad", "energy": 2, "features": {"word_count": 5}})
+
+    assert temp_db.get_song_features(["s1"])["s1"][0] == {"word_count": 5}
+
+
+def test_reads_are_buffered_until_flushed(temp_db):
+    temp_db.save_song({"song_id": "s1", "title": "Song", "artist": "Artist", "mood": "calm", "energy": 3})
+    conn = temp_db.get_connection()
+    before = conn.execute('SELECT last_accessed, access_count FROM songs').fetchone()
+
+    temp_db.get_song("s1")
+    temp_db.get_songs(["s1", "missing"])
+    assert conn.execute('SELECT last_accessed, access_count FROM songs').fetchone() == before
+
+    assert temp_db.flush_access_stats() == 1
+    last_accessed, access_count = conn.execute('SELECT last_accessed, access_count FROM songs').fetchone()
+    assert access_count == 2
+    assert last_accessed >= before[0]
+    conn.close()
+
+
+def test_canonical_keys_are_rebuilt_when_the_key_changes(temp_db):
+    temp_db.save_song({"song_id": "s1", "title": "Song (Live)", "artist": "Artist", "mood": "calm", "energy": 3})
+    conn = temp_db.get_connection()
+    conn.execute("UPDATE songs SET canonical = 'stale'")
+    conn.execute("PRAGMA user_version = 1")
+    conn.commit()
+    conn.close()
+
+    temp_db.init_db()
+
+    conn = temp_db.get_connection()
+    assert conn.execute("SELECT canonical FROM songs").fetchone()[0] == "artist|song"
+    conn.close()
+
+
+def catalog(temp_db):
+    for song_id, mood, energy, themes in [
+        ("s1", "romantic", 7, '["love", "rain"]'),
+        ("s2", "romantic", 4, '["love"]'),
+        ("s3", "sad", 6, '["loss"]'),
+    ]:
+        temp_db.save_song({
+            "song_id": song_id, "title": song_id, "artist": "A",
+            "mood": mood, "energy": energy, "themes": themes
+        })
+
+
+def test_query_catalog_ranks_by_matching_themes_and_moods(temp_db):
+    catalog(temp_db)
+
+    songs = temp_db.query_catalog(themes=["Love", "rain"], moods=["romantic"])
+
+    assert [s['song_id'] for s in songs] == ["s1", "s2"]
+
+
+def test_query_catalog_filters_energy_and_excluded_ids(temp_db):
+    catalog(temp_db)
+
+    songs = temp_db.query_catalog(energy_min="5.5", energy_max=10, exclude_ids=["s3", "s3"])
+
+    assert [s['song_id'] for s in songs] == ["s1"]
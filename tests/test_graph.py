@@ -0,0 +1,76 @@
+# tests/test_graph.py
+
+from db import graph
+
+
+def tracks(*ids):
+    return [{"song_id": i, "title": i.upper(), "artist": "A"} for i in ids]
+
+
+def edges(temp_db):
+    conn = temp_db.get_connection()
+    rows = dict(((src, dst), w) for src, dst, w in conn.execute('SELECT src, dst, weight FROM song_edges'))
+    conn.close()
+    return rows
+
+
+def test_watch_playlist_links_seed_and_neighbours_both_ways(temp_db):
+    # seed-a, seed-b, a-b; the seed echoed at the end adds b-seed adjacency
+    assert graph.record_watch_playlist("seed", tracks("a", "b", "seed")) == 6
+
+    weights = edges(temp_db)
+    assert weights[("seed", "a")] == weights[("a", "seed")] == 1.0
+    assert abs(weights[("seed", "b")] - (1 / 1.1 + graph.ADJACENT_WEIGHT)) < 1e-9
+    assert weights[("a", "b")] == graph.ADJACENT_WEIGHT
+    assert ("seed", "seed") not in weights
+
+
+def test_repeated_observations_add_up_to_the_cap(temp_db):
+    for _ in range(20):
+        graph.record_watch_playlist("seed", tracks("a"))
+
+    assert edges(temp_db)[("seed", "a")] == graph.MAX_EDGE_WEIGHT
+
+
+def test_expand_ranks_by_personalized_pagerank(temp_db):
+    # near is on both seeds' radio lists, far only one hop beyond it
+    graph.record_watch_playlist("s1", tracks("near", "mid"))
+    graph.record_watch_playlist("s2", tracks("near"))
+    graph.record_watch_playlist("mid", tracks("far"))
+
+    songs = graph.expand(["s1", "s2"], limit=10)
+
+    ids = [s['song_id'] for s in songs]
+    assert ids[0] == "near"
+    assert ids.index("mid") < ids.index("far")
+    assert "s1" not in ids and "s2" not in ids
+    assert songs[0]['title'] == "NEAR"
+    scores = [s['graph_score'] for s in songs]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_expand_respects_exclude_limit_and_seed_weights(temp_db):
+    graph.record_watch_playlist("s1", tracks("x"))
+    graph.record_watch_playlist("s2", tracks("y"))
+
+    assert [s['song_id'] for s in graph.expand({"s1": 1.0, "s2": 5.0}, limit=1)] == ["y"]
+    assert [s['song_id'] for s in graph.expand(["s1", "s2"], exclude=["x"])] == ["y"]
+    assert graph.expand({"s1": 0}) == []
+
+
+def test_prune_drops_weakest_edges_and_orphaned_nodes(temp_db):
+    graph.record_watch_playlist("s1", tracks("a", "b", "c"))
+    graph.record_watch_playlist("lone", tracks("z"))
+    conn = temp_db.get_connection()
+    conn.execute("UPDATE song_edges SET weight = 0.01 WHERE src IN ('lone', 'z')")
+    conn.commit()
+    conn.close()
+
+    total = len(edges(temp_db))
+    assert graph.prune_graph(max_edges=total - 2) == 2
+
+    weights = edges(temp_db)
+    assert ("lone", "z") not in weights and ("z", "lone") not in weights
+    # Nodes are radio tracks; z lost its last edge
+    assert graph.graph_stats()["nodes"] == 3
+    assert graph.prune_graph(max_edges=total) == 0
@@ -0,0 +1,120 @@
+# tests/test_jobs.py
+
+import time
+import asyncio
+
+import pytest
+
+import worker
+from db import jobs
+
+
+def test_claim_is_exclusive_and_expired_jobs_are_reclaimed(temp_db):
+    job_id = jobs.enqueue_job(1, 10, 100, "gym playlist")
+
+    job = jobs.claim_job("w1", lease_seconds=0)
+    assert job['id'] == job_id and job['attempts'] == 1
+    time.sleep(0.01)
+
+    # Lease expired: another worker takes over and the first loses it
+    assert jobs.claim_job("w2", lease_seconds=60)['attempts'] == 2
+    assert not jobs.heartbeat(job_id, "w1")
+    assert jobs.heartbeat(job_id, "w2")
+    assert jobs.claim_job("w3") is None
+
+
+def test_jobs_out_of_attempts_are_expired_once(temp_db):
+    job_id = jobs.enqueue_job(1, 10, 100, "gym playlist")
+    for attempt in range(jobs.MAX_ATTEMPTS):
+        assert jobs.claim_job(f"w{attempt}", lease_seconds=0)['id'] == job_id
+        time.sleep(0.01)
+
+    assert jobs.claim_job("late") is None
+    expired = jobs.expire_jobs()
+    assert [(j['id'], j['chat_id'], j['message_id']) for j in expired] == [(job_id, 10, 100)]
+    assert jobs.expire_jobs() == []
+    assert jobs.get_job(job_id)['status'] == 'failed'
+
+
+class FakeBot:
+    def __init__(self):
+        self.edits = []
+
+    async def edit_message_text(self, text, chat_id, message_id, parse_mode=None):
+        self.edits.append(text)
+
+
+class BlockingOrchestrator:
+    """Blocks the event loop for longer than the lease, like a sync pipeline stage."""
+
+    stolen = None
+
+    async def run(self, request, progress_callback=None, user_id=None):
+        time.sleep(1.0)
+        # Another worker polling now must not find the lease expired
+        self.stolen = jobs.claim_job("w2", lease_seconds=60)
+        return {"type": "chat", "message": "done"}
+
+
+def test_lease_survives_a_blocked_event_loop(temp_db, monkeypatch):
+    monkeypatch.setattr(worker, "JOB_LEASE_SECONDS", 0.3)
+    jobs.enqueue_job(1, 10, 100, "hi")
+    job = jobs.claim_job("w1", lease_seconds=0.3)
+    bot = FakeBot()
+    orchestrator = BlockingOrchestrator()
+
+    asyncio.run(worker.run_job(job, "w1", bot, orchestrator))
+
+    assert orchestrator.stolen is None
+    assert jobs.get_job(job['id'])['status'] == 'done'
+    assert bot.edits == ["done"]
+
+
+def test_a_users_jobs_run_one_at_a_time(temp_db):
+    first = jobs.enqueue_job(1, 10, 100, "gym playlist")
+    jobs.enqueue_job(1, 10, 101, "more")
+    other = jobs.enqueue_job(2, 20, 200, "rain songs")
+
+    assert jobs.claim_job("w1")['id'] == first
+    assert jobs.claim_job("w2")['id'] == other
+    assert jobs.claim_job("w3") is None
+
+    jobs.complete_job(first, "w1", {"type": "chat"})
+    assert jobs.claim_job("w3")['request'] == "more"
+
+
+class StopLoop(BaseException):
+    pass
+
+
+def test_worker_loop_survives_a_locked_database(temp_db, monkeypatch):
+    import sqlite3
+    import orchestrator
+
+    calls = []
+
+    def claim(worker_id, lease_seconds):
+        calls.append(worker_id)
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        raise StopLoop
+
+    class NullBot:
+        def __init__(self, token):
+            pass
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            pass
+
+    monkeypatch.setattr(orchestrator, "Orchestrator", lambda: None)
+    monkeypatch.setattr(worker, "Bot", NullBot)
+    monkeypatch.setattr(worker, "claim_job", claim)
+    monkeypatch.setattr(worker, "POLL_INTERVAL", 0.01)
+
+    with pytest.raises(StopLoop):
+        asyncio.run(worker.worker_loop("w1"))
+
+    assert len(calls) == 2
@@ -0,0 +1,215 @@
+# tests/test_llm_client.py
+
+import time
+import asyncio
+import threading
+
+import pytest
+
+from llm_client import (
+    CircuitBreaker, CircuitOpenError, LLMTimeoutError, ResilientLLM, RequestLedger, ledger_scope
+)
+
+
+class Response:
+    def __init__(self, content, input_tokens=100, output_tokens=20):
+        self.content = content
+        self.usage_metadata = {"input_tokens": input_tokens, "output_tokens": output_tokens}
+
+
+class ScriptedModel:
+    """Each invoke takes the next (delay, outcome) step; outcomes are responses or exceptions."""
+
+    def __init__(self, steps):
+        self.steps = list(steps)
+        self._lock = threading.Lock()
+
+    def invoke(self, messages, **kwargs):
+        with self._lock:
+            delay, outcome = self.steps.pop(0)
+        time.sleep(delay)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def make_llm(model, **kwargs):
+    return ResilientLLM(model, model_name="m", backoff_base=0.0, **kwargs)
+
+
+def test_failed_attempts_count_their_input_tokens():
+    llm = make_llm(ScriptedModel([(0, RuntimeError("503")), (0, Response("ok"))]))
+    ledger = RequestLedger()
+
+    with ledger_scope(ledger):
+        assert llm.invoke(["x" * 400], call_site="plan").content == "ok"
+
+    assert [(c["ok"], c["input_tokens"], c["output_tokens"]) for c in ledger.calls] == [
+        (False, 100, 0), (True, 100, 20)
+    ]
+    assert ledger.tokens == 220
+
+
+def test_hedged_duplicate_is_counted():
+    llm = make_llm(
+        ScriptedModel([(0.5, Response("slow")), (0, Response("fast"))]),
+        hedge_min_samples=1
+    )
+    llm.latencies["intent"].append(0.05)
+    ledger = RequestLedger()
+
+    with ledger_scope(ledger):
+        assert llm.invoke(["hi"], call_site="intent").content == "fast"
+
+    # The slow request was abandoned but already sent: its input is paid for
+    assert sorted((c["ok"], c["input_tokens"], c["output_tokens"]) for c in ledger.calls) == [
+        (False, 1, 0), (True, 100, 20)
+    ]
+
+
+def test_timed_out_attempts_are_counted():
+    llm = make_llm(ScriptedModel([(0.3, Response("late"))] * 2), max_retries=1)
+    ledger = RequestLedger()
+
+    with ledger_scope(ledger), pytest.raises(TimeoutError):
+        llm.invoke(["x" * 40], call_site="plan", deadline=0.1)
+
+    assert [(c["ok"], c["input_tokens"]) for c in ledger.calls] == [(False, 10)]
+
+
+def test_breaker_opens_then_lets_one_probe_through():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    # A failed probe re-opens, a successful one closes
+    breaker.record_failure()
+    assert breaker.state == "open"
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_open_circuit_fails_fast():
+    breaker = CircuitBreaker(failure_threshold=1)
+    breaker.record_failure()
+    llm = make_llm(ScriptedModel([]), breaker=breaker)
+
+    with pytest.raises(CircuitOpenError):
+        llm.invoke(["hi"], call_site="intent")
+
+
+def test_hedge_fires_after_the_latency_percentile():
+    llm = make_llm(
+        ScriptedModel([(0.5, Response("slow")), (0, Response("fast"))]),
+        hedge_min_samples=3
+    )
+    assert llm.hedge_delay("intent") is None
+    llm.latencies["intent"].extend([0.01, 0.02, 0.05])
+
+    started = time.monotonic()
+    assert llm.invoke(["hi"], call_site="intent").content == "fast"
+
+    assert time.monotonic() - started < 0.4
+    assert llm.hedges_fired["intent"] == 1
+
+
+def test_deadline_bounds_a_slow_call():
+    llm = make_llm(ScriptedModel([(0.5, Response("late"))] * 3), deadlines={"intent": 0.1})
+
+    started = time.monotonic()
+    with pytest.raises(LLMTimeoutError):
+        llm.invoke(["hi"], call_site="intent")
+
+    assert time.monotonic() - started < 0.3
+
+
+def test_stage_clients_time_out_at_their_own_deadline():
+    from config import LLM_DEADLINES, get_llm
+
+    assert get_llm("intent").model.request_timeout == LLM_DEADLINES["intent"]
+    assert get_llm("sequencing").model.request_timeout == LLM_DEADLINES["sequencing"]
+
+
+class Chunk:
+    def __init__(self, content):
+        self.content = content
+        self.usage_metadata = None
+
+
+class StreamingModel:
+    """Streams `chunks`, then blocks forever if `hang`."""
+
+    def __init__(self, chunks, hang=False):
+        self.chunks = chunks
+        self.hang = hang
+
+    async def astream(self, messages, **kwargs):
+        for chunk in self.chunks:
+            yield Chunk(chunk)
+        if self.hang:
+            await asyncio.Event().wait()
+
+
+def half_open_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    return breaker
+
+
+def test_stream_closed_early_releases_the_probe_and_is_counted():
+    breaker = half_open_breaker()
+    llm = make_llm(StreamingModel(["a", "b", "c"]), breaker=breaker)
+    ledger = RequestLedger()
+
+    async def first_chunk():
+        stream = llm.astream(["hi"], call_site="sequencing")
+        chunk = await stream.__anext__()
+        await stream.aclose()
+        return chunk
+
+    with ledger_scope(ledger):
+        assert asyncio.run(first_chunk()) == "a"
+
+    assert not breaker.probing and breaker.allow()
+    assert [c["ok"] for c in ledger.calls] == [False]
+
+
+def test_cancelled_stream_releases_the_probe():
+    breaker = half_open_breaker()
+    llm = make_llm(StreamingModel(["a"], hang=True), breaker=breaker)
+
+    async def consume():
+        async for _ in llm.astream(["hi"], call_site="sequencing"):
+            pass
+
+    async def cancel_midway():
+        task = asyncio.create_task(consume())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_midway())
+
+    assert not breaker.probing and breaker.allow()
+
+
+def test_completed_stream_closes_the_circuit():
+    breaker = half_open_breaker()
+    llm = make_llm(StreamingModel(["a", "b"]), breaker=breaker)
+
+    async def collect():
+        return [chunk async for chunk in llm.astream(["hi"], call_site="sequencing")]
+
+    assert asyncio.run(collect()) == ["a", "b"]
+    assert breaker.state == "closed"
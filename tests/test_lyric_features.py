@@ -0,0 +1,90 @@
+# tests/test_lyric_features.py
+
+import time
+import threading
+
+from agents.lyrics_agent import LyricsAgent
+from tools.lyric_features import dominant_script, extract_features, prefilter_reason, profile_terms
+
+PROFILE = {
+    "favorite_artists": "Sid Sriram",
+    "hated_artists": "Loud Band",
+    "loves": "rain, item songs",
+    "hates": "remix, DJ versions",
+    "languages": "telugu, tamil",
+}
+
+
+def test_profile_terms_split_values_and_skip_negative_keys():
+    assert profile_terms(PROFILE, ["artist"]) == ["sid sriram", "loud band"]
+    assert profile_terms(PROFILE, ["artist"], exclude=["hate"]) == ["sid sriram"]
+    assert profile_terms(None, ["artist"]) == []
+
+
+def test_dominant_script():
+    assert dominant_script("నీ కోసం nee") == "telugu"
+    assert dominant_script("Hello there") == "latin"
+    assert dominant_script("123 !!") is None
+
+
+def test_extract_features_counts_lines_words_and_repetition():
+    song = {"title": "Rain Song (Remix)", "lyrics": "la la rain\nla la rain\nsun comes out"}
+
+    features = extract_features(song, PROFILE)
+
+    assert features["has_lyrics"]
+    assert features["line_count"] == 3
+    assert features["word_count"] == 9
+    assert features["repetition_ratio"] == round(1 - 2 / 3, 3)
+    assert features["script"] == "latin"
+    assert features["title_markers"] == ["remix"]
+    assert features["like_hits"] == ["rain"]
+    assert features["hate_hits"] == ["remix"]
+
+
+def test_extract_features_without_lyrics():
+    features = extract_features({"title": "Theme (Instrumental)", "lyrics": None})
+
+    assert not features["has_lyrics"]
+    assert features["word_count"] == 0 and features["unique_word_ratio"] == 0.0
+    assert features["title_markers"] == ["instrumental"]
+
+
+def test_prefilter_reasons():
+    hated = extract_features({"title": "Song (DJ Version)", "lyrics": "x"}, PROFILE)
+    assert prefilter_reason(hated, PROFILE).startswith("title matches hates")
+
+    instrumental = extract_features({"title": "Theme BGM", "lyrics": ""})
+    assert prefilter_reason(instrumental) == "instrumental"
+
+    hindi = extract_features({"title": "Gaana", "lyrics": "तुम ही हो"}, PROFILE)
+    assert prefilter_reason(hindi, PROFILE).startswith("devanagari script")
+
+    romanized = extract_features({"title": "Gaana", "lyrics": "tum hi ho"}, PROFILE)
+    assert prefilter_reason(romanized, PROFILE) is None
+    assert prefilter_reason(hindi, {}) is None
+
+
+def test_prefilter_fetches_missing_lyrics_concurrently(temp_db, fake_ytmusic):
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def get_lyrics(song_id):
+        with lock:
+            active.append(song_id)
+            peak.append(len(active))
+        time.sleep(0.05)
+        with lock:
+            active.remove(song_id)
+        return {"lyrics": f"lyrics of {song_id}"}
+
+    fake_ytmusic.get_lyrics = get_lyrics
+    agent = object.__new__(LyricsAgent)
+    songs = [{"song_id": f"s{i}", "title": "T", "artist": "A"} for i in range(8)]
+
+    keep, dropped = agent.prefilter(songs, {})
+
+    assert [s["song_id"] for s in keep] == [f"s{i}" for i in range(8)] and dropped == []
+    assert keep[3]["lyrics"] == "lyrics of s3"
+    assert max(peak) > 1
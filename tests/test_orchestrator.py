@@ -0,0 +1,132 @@
+# tests/test_orchestrator.py
+
+import asyncio
+
+from orchestrator import Orchestrator
+from db.database import get_profile, profile_version
+from db.prebuilt import save_prebuilt
+from db.sessions import get_session, save_session
+from tools.canonical import canonical_request
+
+
+def make_orchestrator(intent):
+    orchestrator = object.__new__(Orchestrator)
+    orchestrator._session_locks = {}
+    orchestrator._check_intent = lambda request, session=None: intent
+    return orchestrator
+
+
+def pool(n):
+    return [
+        {"song_id": f"s{i}", "title": f"Song {i}", "artist": "A", "energy": i, "match_score": 10 - i}
+        for i in range(n)
+    ]
+
+
+def test_concurrent_follow_ups_add_distinct_songs(temp_db, fake_ytmusic):
+    save_session(1, "gym", {}, pool(10), "PL1", "Gym", ["s0", "s1"])
+    orchestrator = make_orchestrator({"intent": "followup", "followup": {"action": "extend", "count": 3}})
+
+    async def both():
+        return await asyncio.gather(
+            orchestrator.run("more", user_id=1), orchestrator.run("more please", user_id=1)
+        )
+
+    asyncio.run(both())
+
+    used = get_session(1)["used_ids"]
+    assert len(used) == len(set(used)) == 8
+    added = [song_id for call in fake_ytmusic.calls if call[0] == "add" for song_id in call[2]]
+    assert len(added) == len(set(added)) == 6
+
+
+def test_follow_up_energy_range_accepts_strings(temp_db, fake_ytmusic):
+    save_session(1, "gym", {}, pool(10), "PL1", "Gym", [])
+    orchestrator = make_orchestrator({
+        "intent": "followup",
+        "followup": {"action": "extend", "count": "3", "energy_range": ["6", "8"]}
+    })
+
+    playlist = asyncio.run(orchestrator.run("only the upbeat ones", user_id=1))
+
+    assert [s["song_id"] for s in playlist["songs"]] == ["s6", "s7", "s8"]
+
+
+def prebuild(request):
+    playlist = {"playlist_name": "Ready", "songs": pool(3)}
+    save_prebuilt(
+        canonical_request(request), request, profile_version(get_profile()), {}, playlist, pool(6)
+    )
+
+
+def test_prebuilt_playlist_is_served_for_playlist_requests(temp_db, fake_ytmusic):
+    prebuild("gym playlist")
+    orchestrator = make_orchestrator({"intent": "playlist"})
+
+    result = asyncio.run(orchestrator.run("workout songs", user_id=1))
+
+    assert result["type"] == "playlist"
+    assert [s["song_id"] for s in result["songs"]] == ["s0", "s1", "s2"]
+
+
+def test_prebuilt_playlist_is_not_served_for_a_request_with_the_same_words(temp_db, fake_ytmusic):
+    prebuild("gym playlist")
+    prebuild("gym songs not rap")
+    orchestrator = make_orchestrator({"intent": "playlist"})
+
+    async def noop(msg):
+        pass
+
+    for request in ("no gym playlist", "rap not gym", "not gym"):
+        assert asyncio.run(orchestrator._serve_prebuilt(request, 1, noop)) is None
+    # Serving marks the songs as recommended, so check the hit last
+    assert asyncio.run(orchestrator._serve_prebuilt("workout songs", 1, noop)) is not None
+
+
+def test_chat_is_not_answered_with_a_prebuilt_playlist(temp_db, fake_ytmusic):
+    prebuild("hi")
+    orchestrator = make_orchestrator({"intent": "chat", "response": "Hello!"})
+
+    result = asyncio.run(orchestrator.run("hi", user_id=1))
+
+    assert result == {"type": "chat", "message": "Hello!"}
+    assert fake_ytmusic.calls == []
+
+
+def test_catalog_query_skips_a_garbled_energy_range(temp_db):
+    temp_db.save_song({"song_id": "s1", "title": "T", "artist": "A", "mood": "calm", "energy": 3})
+    orchestrator = make_orchestrator({"intent": "playlist"})
+
+    songs = orchestrator._query_catalog({"energy_range": 7}, ["x", "x"])
+
+    assert [s['song_id'] for s in songs] == ["s1"]
+
+
+class NoSearchAgent:
+    def run(self, request, profile):
+        raise AssertionError("search agent should be skipped")
+
+
+def test_discovery_with_enough_graph_songs_skips_the_search_agent(temp_db, fake_ytmusic):
+    from db.graph import record_watch_playlist
+
+    searches = []
+    fake_ytmusic.search_songs = lambda query, limit=30: searches.append(query) or []
+    fake_ytmusic.get_artist_songs = lambda artist, limit=20: []
+    record_watch_playlist("liked", [{"song_id": f"g{i}", "title": f"G{i}", "artist": "A"} for i in range(8)])
+
+    orchestrator = make_orchestrator({"intent": "playlist"})
+    orchestrator.search_agent = NoSearchAgent()
+    orchestrator._get_library = lambda: {"liked_ids": {"liked"}, "liked_artists": set(), "history_ids": set()}
+    plan = {"target_songs": 3, "search_queries": ["q1", "q2", "q3"]}
+
+    async def noop(msg):
+        pass
+
+    sources, library = asyncio.run(
+        orchestrator._gather_sources("surprise me", plan, {}, [], noop)
+    )
+
+    assert searches == ["q1"]
+    assert len(sources[-1]) >= 6
+    assert library["liked_ids"] == {"liked"}
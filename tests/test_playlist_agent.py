@@ -0,0 +1,105 @@
+# tests/test_playlist_agent.py
+
+import json
+import asyncio
+
+from agents.playlist_agent import PlaylistAgent, StreamingPlaylistParser
+
+PLAYLIST = {
+    "playlist_name": "Evening \"Rain\" Mix",
+    "description": "Soft {and} slow",
+    "songs": [
+        {"position": 1, "song_id": "a", "title": "Nee {Kosam}", "artist": "X", "reason": "opener \"hook\""},
+        {"position": 2, "song_id": "b", "title": "B", "artist": "Y", "reason": "]"},
+        {"position": 3, "song_id": "c", "title": "C", "artist": "Z", "reason": ""},
+    ],
+    "flow_description": "calm",
+}
+
+
+def feed_in_chunks(text, size):
+    parser = StreamingPlaylistParser()
+    songs = []
+    for i in range(0, len(text), size):
+        songs += parser.feed(text[i:i + size])
+    return parser, songs
+
+
+def test_parser_yields_each_song_once_for_any_chunking():
+    text = json.dumps(PLAYLIST, indent=2)
+    for size in (1, 2, 7, 64, len(text)):
+        parser, songs = feed_in_chunks(text, size)
+        assert [s["song_id"] for s in songs] == ["a", "b", "c"]
+        assert songs[0]["title"] == "Nee {Kosam}"
+        assert parser.playlist_name == 'Evening "Rain" Mix'
+        assert parser.description == "Soft {and} slow"
+
+
+def test_parser_yields_songs_before_the_array_closes():
+    text = json.dumps(PLAYLIST)
+    cut = text.index('{"position": 2')
+    parser = StreamingPlaylistParser()
+    assert [s["song_id"] for s in parser.feed(text[:cut])] == ["a"]
+    assert parser.songs_started
+
+
+def test_parser_skips_malformed_song_and_keeps_going():
+    text = '{"playlist_name": "P", "songs": [{"song_id": "a",, }, {"song_id": "b"}]}'
+    _, songs = feed_in_chunks(text, 5)
+    assert [s["song_id"] for s in songs] == ["b"]
+
+
+def test_parser_ignores_objects_after_the_songs_array():
+    text = '{"songs": [{"song_id": "a"}], "extra": {"song_id": "z"}}'
+    _, songs = feed_in_chunks(text, 3)
+    assert [s["song_id"] for s in songs] == ["a"]
+
+
+class FailingStreamLLM:
+    """Streams the playlist name, then fails before any song."""
+
+    def __init__(self, sequenced):
+        self.sequenced = sequenced
+
+    async def astream(self, messages, call_site="default"):
+        yield '{"playlist_name": "Gym", "description": "loud", "songs": ['
+        await asyncio.sleep(0.01)
+        raise RuntimeError("stream dropped")
+
+    def invoke(self, messages, call_site="default"):
+        class Response:
+            content = json.dumps(self.sequenced)
+        return Response()
+
+    def record_fallback(self, call_site):
+        pass
+
+
+def test_stream_failure_reuses_the_playlist_already_created(fake_ytmusic):
+    songs = [{"song_id": s, "title": s, "artist": s, "match_score": 8} for s in "abc"]
+    agent = object.__new__(PlaylistAgent)
+    agent.llm = FailingStreamLLM({
+        "playlist_name": "Gym", "songs": [{"position": 1, "song_id": "a", "title": "a", "artist": "a"}]
+    })
+
+    playlist = asyncio.run(agent.create_playlist_streaming(songs, "gym", {}, target_length=1))
+
+    creates = [c for c in fake_ytmusic.calls if c[0] == "create"]
+    assert len(creates) == 1
+    assert playlist["playlist_id"] == "PL1"
+    assert ("add", "PL1", ["a"]) in fake_ytmusic.calls
+
+
+def test_local_order_accepts_mixed_energy_types():
+    agent = object.__new__(PlaylistAgent)
+    songs = [
+        {"song_id": "a", "artist": "X", "energy": "9"},
+        {"song_id": "b", "artist": "Y", "energy": 2},
+        {"song_id": "c", "artist": "Z", "energy": None},
+        {"song_id": "d", "artist": "W", "energy": "high"},
+    ]
+
+    ordered = agent._local_order(songs)
+
+    assert sorted(s["song_id"] for s in ordered) == ["a", "b", "c", "d"]
+    assert ordered[0]["song_id"] == "b"
@@ -0,0 +1,49 @@
+# tests/test_prerank.py
+
+from song import Song
+from tools.prerank import local_match_score, prerank_songs
+
+PLAN = {"themes": ["love"], "energy_range": [6, 10]}
+
+
+def ids(songs):
+    return [s['song_id'] for s in songs]
+
+
+def test_favourite_artist_ranks_first_and_hated_artist_is_not_boosted():
+    songs = [
+        Song(song_id="hated", title="A", artist="Loud Band"),
+        Song(song_id="neutral", title="B", artist="Someone"),
+        Song(song_id="fav", title="C", artist="Sid Sriram"),
+    ]
+    profile = {"favorite_artists": "Sid Sriram", "hated_artists": "Loud Band"}
+
+    ranked = prerank_songs(songs, {}, profile, PLAN, {})
+
+    assert ids(ranked) == ["fav", "hated", "neutral"]
+    assert ranked[1]['prerank_score'] == 0
+
+
+def test_search_agreement_and_cached_analysis_count():
+    songs = [Song(song_id=s, title=s, artist=s) for s in ("a", "b", "c")]
+    known = {"c": Song(song_id="c", title="c", artist="c", mood="happy", energy=8, themes='["love"]')}
+
+    ranked = prerank_songs(songs, {"b": 3}, {}, PLAN, known)
+
+    assert ids(ranked) == ["c", "b", "a"]
+    assert ranked[0]['prerank_score'] == 2.5
+    assert ranked[1]['prerank_score'] == 2
+
+
+def test_arrival_order_breaks_ties():
+    songs = [Song(song_id=s, title=s, artist=s) for s in ("x", "y", "z")]
+    assert ids(prerank_songs(songs, {}, {}, {}, {})) == ["x", "y", "z"]
+
+
+def test_local_score_ignores_hated_artists_and_coerces_energy():
+    song = Song(song_id="a", title="A", artist="Loud Band", mood="happy", energy=7, themes='[]')
+    plan = {"energy_range": ["6", "8"]}
+
+    assert local_match_score(song, plan, {"hated_artists": "Loud Band"}) == 7
+    assert local_match_score(song, plan, {"favorite_artists": "Loud Band"}) == 8
+    assert local_match_score({**song, "energy": "7"}, {"energy_range": ["x", 8]}, {}) == 5
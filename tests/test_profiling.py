@@ -0,0 +1,24 @@
+# tests/test_profiling.py
+
+import asyncio
+
+from profiling import profile_run
+
+
+def spin():
+    return sum(i * i for i in range(20000))
+
+
+class ThreadedOrchestrator:
+    async def run(self, request, progress_callback=None, user_id=None):
+        await asyncio.to_thread(spin)
+        return {"type": "playlist"}
+
+
+def test_report_includes_work_done_in_worker_threads(tmp_path):
+    result, path = asyncio.run(profile_run(ThreadedOrchestrator(), "gym", report_dir=str(tmp_path)))
+
+    report = open(path).read()
+    workers = report[report.index("== CPU, worker threads (1 tasks merged"):report.index("== Allocations")]
+    assert result == {"type": "playlist"}
+    assert "(spin)" in workers
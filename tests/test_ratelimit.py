@@ -0,0 +1,62 @@
+# tests/test_ratelimit.py
+
+import asyncio
+
+import pytest
+
+from tools.ratelimit import AdaptiveConcurrency, EndpointLimiter, is_throttled
+
+
+class HTTPError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+def test_throttle_signals():
+    assert is_throttled(Exception("Server returned HTTP 429: Too Many Requests."))
+    assert is_throttled(HTTPError(503))
+    assert not is_throttled(HTTPError(404))
+    assert not is_throttled(KeyError("videoId"))
+
+
+def test_only_throttling_halves_the_limit():
+    limiter = EndpointLimiter("test", rate=1000, burst=1000, concurrency=8, max_concurrency=16)
+
+    def fail(error):
+        raise error
+
+    with pytest.raises(KeyError):
+        limiter.call(fail, KeyError("videoId"))
+    assert limiter.concurrency.limit == 8
+
+    with pytest.raises(HTTPError):
+        limiter.call(fail, HTTPError(429))
+    assert limiter.concurrency.limit == 4
+    assert limiter.stats()["throttled"] == 1
+
+
+def test_success_grows_the_limit():
+    concurrency = AdaptiveConcurrency(initial=2, max_limit=4)
+    for _ in range(20):
+        concurrency.acquire()
+        concurrency.release(0.01, ok=True)
+    assert concurrency.limit > 2
+
+
+def test_calls_from_a_thread_leave_the_loop_free():
+    limiter = EndpointLimiter("slow", rate=20, burst=1, concurrency=1, max_concurrency=1)
+    ticks = []
+
+    async def ticker():
+        for _ in range(5):
+            ticks.append(1)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        calls = [asyncio.to_thread(limiter.call, lambda: None) for _ in range(3)]
+        await asyncio.gather(ticker(), *calls)
+
+    asyncio.run(main())
+    assert len(ticks) == 5
+    assert not limiter._warned_loop
@@ -0,0 +1,105 @@
+# tests/test_singleflight.py
+
+import json
+import time
+import asyncio
+import threading
+
+from agents.lyrics_agent import LyricsAgent
+from tools.singleflight import SingleFlight
+
+
+def test_overlapping_callers_collapse_to_one_call():
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    runs = []
+
+    def slow(key):
+        runs.append(key)
+        started.set()
+        release.wait(5)
+        return {"key": key}
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flights.do("g", "k", slow, "k", clone=dict)))
+    leader.start()
+    assert started.wait(5)
+    waiter = threading.Thread(target=lambda: results.append(flights.do("g", "k", slow, "k", clone=dict)))
+    waiter.start()
+    while flights.stats()["g"]["collapsed"] < 1:
+        time.sleep(0.01)
+    release.set()
+    leader.join(5)
+    waiter.join(5)
+
+    assert runs == ["k"]
+    assert results == [{"key": "k"}, {"key": "k"}]
+    assert results[0] is not results[1]
+    assert flights.stats()["g"] == {"calls": 2, "executions": 1, "collapsed": 1, "in_flight": 0}
+
+
+def test_waiters_get_the_leaders_exception():
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    errors = []
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("boom")
+
+    def call():
+        try:
+            flights.do("g", "k", failing)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=call)]
+    threads[0].start()
+    assert started.wait(5)
+    threads.append(threading.Thread(target=call))
+    threads[1].start()
+    while flights.stats()["g"]["collapsed"] < 1:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert errors == ["boom", "boom"]
+
+
+class SlowAnalysisLLM:
+    def __init__(self):
+        self.calls = 0
+
+    def invoke(self, messages, call_site="default"):
+        self.calls += 1
+        time.sleep(0.2)
+
+        class Response:
+            content = json.dumps({"mood": "calm", "energy": 3, "themes": [], "match_score": 7, "reason": ""})
+        return Response()
+
+    def record_fallback(self, call_site):
+        pass
+
+
+def test_overlapping_batches_analyze_a_song_once(temp_db, fake_ytmusic):
+    fake_ytmusic.get_lyrics = lambda song_id: None
+    agent = object.__new__(LyricsAgent)
+    agent.analysis_llm = SlowAnalysisLLM()
+    agent.scoring_llm = None
+    song = {"song_id": "s1", "title": "T", "artist": "A"}
+
+    async def both():
+        return await asyncio.gather(
+            agent.analyze_batch_with_progress([dict(song)], "rain", {}),
+            agent.analyze_batch_with_progress([dict(song)], "rain", {}),
+        )
+
+    first, second = asyncio.run(both())
+
+    assert agent.analysis_llm.calls == 1
+    assert first[0]["match_score"] == second[0]["match_score"] == 7
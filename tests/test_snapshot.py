@@ -0,0 +1,51 @@
+# tests/test_snapshot.py
+
+from db.snapshot import Snapshot, export_snapshot, import_snapshot
+
+
+def seed(temp_db):
+    temp_db.save_song({
+        "song_id": "b", "title": "Vachindamma", "artist": "Sid Sriram",
+        "mood": "romantic", "energy": 6, "themes": '["love", "wedding"]'
+    })
+    temp_db.save_song({
+        "song_id": "a", "title": "Naatu Naatu", "artist": "Rahul",
+        "mood": "energetic", "energy": "high", "themes": '["dance"]'
+    })
+    temp_db.save_song({"song_id": "c", "title": "Not analyzed", "artist": "X"})
+
+
+def test_export_load_lookup_round_trip(temp_db, tmp_path):
+    seed(temp_db)
+    path = str(tmp_path / "songs.snap")
+
+    assert export_snapshot(path, db_path=temp_db.DB_PATH) == 2
+
+    snapshot = Snapshot(path)
+    song = snapshot.get("b")
+    assert (song.title, song.artist, song.mood, song.energy) == ("Vachindamma", "Sid Sriram", "romantic", 6)
+    assert song.themes == ["love", "wedding"]
+    # Non-numeric stored energy is exported as unknown
+    assert snapshot.get("a").energy is None
+    assert snapshot.get("c") is None
+    assert set(snapshot.get_many(["a", "b", "z"])) == {"a", "b"}
+    assert len(snapshot.vector("b")) == snapshot.dim
+    snapshot.close()
+
+
+def test_snapshot_is_layered_under_the_live_cache(temp_db, tmp_path, monkeypatch):
+    seed(temp_db)
+    path = str(tmp_path / "songs.snap")
+    export_snapshot(path, db_path=temp_db.DB_PATH)
+
+    monkeypatch.setattr(temp_db, "DB_PATH", str(tmp_path / "fresh.db"))
+    monkeypatch.setattr(temp_db, "SNAPSHOT_PATH", path)
+    monkeypatch.setattr(temp_db, "_snapshot", None)
+    temp_db.init_db()
+
+    assert temp_db.get_song("b").mood == "romantic"
+    assert set(temp_db.get_songs(["a", "b", "z"])) == {"a", "b"}
+
+    assert import_snapshot(path) == 2
+    assert [s['song_id'] for s in temp_db.query_catalog(themes=["love"])] == ["b"]
+    temp_db.get_snapshot().close()
@@ -0,0 +1,46 @@
+# tests/test_webhook.py
+
+import threading
+import http.client
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from webhook import MAX_BODY_BYTES, SECRET_HEADER, make_handler
+
+
+@pytest.fixture
+def server():
+    # No app or loop: these requests are all rejected before reaching them
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(None, None, "/telegram", "sekret"))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address[1]
+    server.shutdown()
+
+
+def post(port, headers, body=b"{}"):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    conn.putrequest("POST", "/telegram")
+    for name, value in headers.items():
+        conn.putheader(name, value)
+    conn.endheaders()
+    conn.send(body)
+    status = conn.getresponse().status
+    conn.close()
+    return status
+
+
+def test_wrong_or_non_ascii_secret_is_forbidden(server):
+    assert post(server, {SECRET_HEADER: "nope", "Content-Length": "2"}) == 403
+    assert post(server, {SECRET_HEADER: "sekrét".encode("latin-1"), "Content-Length": "2"}) == 403
+
+
+def test_oversized_body_is_rejected_before_reading(server):
+    headers = {SECRET_HEADER: "sekret", "Content-Length": str(MAX_BODY_BYTES + 1)}
+    assert post(server, headers, body=b"") == 413
+
+
+def test_bad_content_length(server):
+    assert post(server, {SECRET_HEADER: "sekret", "Content-Length": "-5"}) == 400
+    assert post(server, {SECRET_HEADER: "sekret", "Content-Length": "lots"}) == 400
@@ -0,0 +1,260 @@
+# tools/canonical.py
+
+import re
+import unicodedata
+
+# Alternate renditions of the same song. Lower penalty = closer to the
+# original when picking which upload to keep.
+VERSION_TAGS = {
+    "lyric video": 0, "lyrical": 0,
+    "reprise": 2, "acoustic": 2, "unplugged": 2,
+    "live": 3, "cover": 3, "remix": 3, "mashup": 4,
+    "lofi": 4, "lo-fi": 4, "lo fi": 4,
+    "slowed": 5, "reverb": 5, "sped up": 5, "nightcore": 5, "8d": 5,
+    "instrumental": 6, "karaoke": 6, "bgm": 6,
+}
+
+# Upload noise that says nothing about the rendition. Like version tags,
+# it's only stripped from brackets and from after a separator, except the
+# multi-word phrases, which are also dropped from the end of the title.
+NOISE = [
+    "official music video", "official video", "official audio", "full video song",
+    "full video", "video song", "lyric video", "lyrical video", "lyrics", "lyrical",
+    "full song", "audio song", "audio", "hd", "4k",
+]
+
+# Bump when canonical_key changes: stored keys are rebuilt (db/database.py)
+KEY_VERSION = 3
+
+FUZZY_THRESHOLD = 0.75
+FUZZY_MIN_LENGTH = 6
+
+_BRACKETS = re.compile(r"[\(\[\{][^\)\]\}]*[\)\]\}]")
+_SEGMENTS = re.compile(r"\s+[-–—|:]\s+|\s*\|\s*")
+_FEAT = re.compile(r"\b(?:feat|ft|featuring)\b\.?.*$")
+_FROM = re.compile(r"\bfrom\s+[\"'“‘].*$")
+_TRAILING_NOISE = re.compile(
+    r"\s(?:" + "|".join(re.escape(p) for p in NOISE if " " in p) + r")\s*$"
+)
+_ARTIST_SPLIT = re.compile(r"\s*(?:,|&|\band\b|\bx\b|\bfeat\b\.?|\bft\b\.?|\bwith\b)\s*")
+
+
+def _fold_accents(text):
+    # Drop combining marks on Latin letters only: Indic vowel signs are
+    # combining marks too and carry meaning
+    out = []
+    for ch in unicodedata.normalize("NFKD", text):
+        if unicodedata.combining(ch) and out and out[-1].isascii():
+            continue
+        out.append(ch)
+    return unicodedata.normalize("NFC", "".join(out))
+
+
+def _fold_romanization(text):
+    """
+    Smooth romanization variance: nuvvu/nuvu, neelo/nilo, dhooram/duram.
+    Only used for fuzzy matching within one artist, never for exact keys.
+    """
+    if not text.isascii():
+        return text
+    text = text.replace("ee", "i").replace("oo", "u")
+    text = re.sub(r"([bcdgjkpt])h", r"\1", text)
+    return re.sub(r"(.)\1+", r"\1", text)
+
+
+def _clean(text):
+    # Unicode categories, not \w: Indic vowel signs aren't word characters
+    text = "".join(" " if unicodedata.category(ch)[0] in "PS" else ch for ch in text)
+    return " ".join(text.split())
+
+
+def _split_title(title):
+    """
+    Split an upload title into (song, annotations). Annotations are
+    bracketed groups and everything after a separator: "Song - From
+    "Movie"", "Song (Lyric Video)", "Song | Movie | Label".
+    """
+    title = _fold_accents(title or "").lower()
+    annotations = _BRACKETS.findall(title)
+    stripped = _BRACKETS.sub(" ", title).strip()
+    first, *rest = _SEGMENTS.split(stripped)
+    if not first.strip():
+        first, rest = stripped, []
+    return first, " ".join(annotations + rest)
+
+
+def _tags_in(text) -> list:
+    return [tag for tag in VERSION_TAGS if re.search(rf"\b{re.escape(tag)}\b", text)]
+
+
+def version_tags(title) -> list:
+    """Rendition tags in an upload title's brackets or after a separator."""
+    return _tags_in(_split_title(title)[1])
+
+
+def canonical_title(title) -> str:
+    """The song part of an upload title; words of the title itself are kept."""
+    first, _ = _split_title(title)
+    first = _FROM.sub("", _FEAT.sub("", first))
+    first = _TRAILING_NOISE.sub("", first)
+    return _clean(first) or _clean(_fold_accents(title or "").lower())
+
+
+def canonical_artist(artist) -> str:
+    artist = _fold_accents(artist or "").lower().strip()
+    first = _ARTIST_SPLIT.split(artist)[0] if artist else ""
+    return "" if first == "unknown" else _clean(first)
+
+
+def canonical_key(song) -> str:
+    # Word breaks vary across uploads: "Samaja Vara Gamana" / "Samajavaragamana"
+    title = canonical_title(song.get('title')).replace(" ", "")
+    # Same title, unknown artist says nothing: the upload is its own song.
+    # ":" can't occur in a cleaned artist name.
+    artist = canonical_artist(song.get('artist')) or (f"id:{song['song_id']}" if song.get('song_id') else "")
+    return f"{artist}|{title}"
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _artists_match(a, b):
+    if not a or not b:
+        return False
+    return a == b or set(a.split()) <= set(b.split()) or set(b.split()) <= set(a.split())
+
+
+class CanonicalIndex:
+    """
+    Assigns each song a canonical identity. Exact canonical keys match
+    directly; otherwise a trigram index finds titles by the same artist
+    within FUZZY_THRESHOLD Jaccard similarity, after folding romanization
+    variants. Titles shorter than FUZZY_MIN_LENGTH only match exactly.
+    """
+
+    def __init__(self, threshold=FUZZY_THRESHOLD):
+        self.threshold = threshold
+        self._keys = {}       # canonical key -> id
+        self._entries = []    # id -> (artist, title, trigrams)
+        self._grams = {}      # trigram -> ids
+
+    def identify(self, song) -> int:
+        key = canonical_key(song)
+        artist, title = key.split("|", 1)
+        if key in self._keys:
+            return self._keys[key]
+
+        folded = _fold_romanization(title)
+        grams = _trigrams(folded) if len(folded) >= FUZZY_MIN_LENGTH else set()
+        best, best_score = None, self.threshold
+        shared = {}
+        for gram in grams:
+            for ident in self._grams.get(gram, ()):
+                shared[ident] = shared.get(ident, 0) + 1
+        for ident, overlap in shared.items():
+            other_artist, other_title, other_grams = self._entries[ident]
+            if not _artists_match(artist, other_artist):
+                continue
+            score = overlap / len(grams | other_grams)
+            if score >= best_score:
+                best, best_score = ident, score
+
+        if best is None:
+            best = len(self._entries)
+            self._entries.append((artist, title, grams))
+            for gram in grams:
+                self._grams.setdefault(gram, set()).add(best)
+        self._keys[key] = best
+        return best
+
+
+def version_penalty(song, preferred=()) -> int:
+    """How far an upload is from the original; tags the user asked for count in its favour."""
+    tags = version_tags(song.get('title'))
+    return sum(-1 if tag in preferred else VERSION_TAGS[tag] for tag in tags)
+
+
+def collapse_versions(songs, source_counts=None, request_text=""):
+    """
+    Keep one upload per canonical song.
+
+    The representative is the version closest to the original (or to a
+    rendition named in `request_text`, e.g. "lofi"), then the one found by
+    more searches, then the earliest. Returns (representatives in arrival
+    order, {representative_id: [all song_ids in its group]}).
+    """
+    source_counts = source_counts or {}
+    preferred = set(_tags_in(_fold_accents(request_text or "").lower()))
+    index = CanonicalIndex()
+
+    groups = {}
+    order = []
+    for position, song in enumerate(songs):
+        ident = index.identify(song)
+        if ident not in groups:
+            groups[ident] = []
+            order.append(ident)
+        groups[ident].append((position, song))
+
+    representatives = []
+    members = {}
+    for ident in order:
+        group = groups[ident]
+        _, best = min(
+            group,
+            key=lambda item: (
+                version_penalty(item[1], preferred),
+                -source_counts.get(item[1]['song_id'], 1),
+                item[0]
+            )
+        )
+        representatives.append((group[0][0], best))
+        members[best['song_id']] = [song['song_id'] for _, song in group]
+
+    return [song for _, song in sorted(representatives, key=lambda item: item[0])], members
+
+
+# --- Requests ---
+
+# Words that don't change what a request is asking for
+REQUEST_FILLER = {
+    "a", "an", "the", "some", "me", "my", "i", "im", "i'm", "want", "need", "give", "make",
+    "play", "please", "pls", "playlist", "songs", "song", "music", "tracks", "mix", "for",
+    "to", "of", "with", "something", "anything", "can", "you", "create", "build", "get",
+    "vibes", "vibe", "mood", "time", "session", "while", "during", "and",
+}
+
+# Multi-word ways of saying one thing, folded before splitting into words
+REQUEST_PHRASES = {
+    "working out": "gym", "work out": "gym", "work-out": "gym",
+    "road trip": "drive", "lo fi": "lofi", "lo-fi": "lofi",
+}
+
+# Common ways of asking for the same routine intent. Only words with one
+# reading: "work" (office? workout?) and "focus" stay as they are.
+REQUEST_SYNONYMS = {
+    "workout": "gym", "workouts": "gym", "exercise": "gym", "lifting": "gym",
+    "running": "run", "jog": "run", "jogging": "run", "driving": "drive", "roadtrip": "drive",
+    "sleeping": "sleep", "bedtime": "sleep", "studying": "study", "coding": "code",
+    "melancholy": "melancholic", "chill": "calm", "relax": "calm", "relaxing": "calm",
+}
+
+_REQUEST_PHRASES = re.compile(
+    r"\b(?:" + "|".join(re.escape(p) for p in sorted(REQUEST_PHRASES, key=len, reverse=True)) + r")\b"
+)
+
+
+def canonical_request(request) -> str:
+    """
+    Key for what a request asks for: "Gym playlist!" and "songs for my
+    workout" both become "gym". Words stay in order so negations keep
+    their target: "happy not sad" and "sad not happy" differ.
+    """
+    text = _REQUEST_PHRASES.sub(
+        lambda m: REQUEST_PHRASES[m.group(0)], _fold_accents(request or "").lower()
+    )
+    words = re.findall(r"[\w'-]+", text)
+    terms = dict.fromkeys(REQUEST_SYNONYMS.get(w, w) for w in words if w not in REQUEST_FILLER)
+    return " ".join(terms) or (request or "").strip().lower()
@@ -0,0 +1,121 @@
+# tools/lyric_features.py
+
+import re
+import string
+import unicodedata
+from collections import Counter
+
+# Unicode script names (first word of the character name) -> language hints
+SCRIPT_LANGUAGES = {
+    "latin": ["english", "hinglish", "romanized"],
+    "telugu": ["telugu"],
+    "devanagari": ["hindi", "marathi", "sanskrit"],
+    "tamil": ["tamil"],
+    "kannada": ["kannada"],
+    "malayalam": ["malayalam"],
+    "bengali": ["bengali"],
+    "gurmukhi": ["punjabi"],
+    "arabic": ["urdu", "arabic"],
+    "hangul": ["korean"],
+    "cjk": ["chinese", "japanese"],
+    "hiragana": ["japanese"],
+    "katakana": ["japanese"],
+}
+
+TITLE_MARKERS = [
+    "remix", "lofi", "lo-fi", "slowed", "reverb", "sped up", "nightcore", "8d",
+    "instrumental", "karaoke", "bgm", "dj", "mashup", "cover", "live",
+    "unplugged", "reprise", "acoustic",
+]
+
+# Markers that mean there is nothing to sing along to
+INSTRUMENTAL_MARKERS = {"instrumental", "karaoke", "bgm"}
+
+
+def _script_of(ch):
+    try:
+        name = unicodedata.name(ch)
+    except ValueError:
+        return None
+    first = name.split(" ")[0].lower()
+    return "cjk" if first == "cjk" else first
+
+
+def dominant_script(text):
+    counts = Counter(
+        script for script in (_script_of(ch) for ch in text if ch.isalpha())
+        if script
+    )
+    if not counts:
+        return None
+    return counts.most_common(1)[0][0]
+
+
+# Profile keys whose values are things to stay away from
+NEGATIVE_KEYS = ["hate", "dislike", "avoid", "never", "skip"]
+
+
+def profile_terms(profile, keywords, exclude=()):
+    """Comma-separated values of profile keys containing any of `keywords`."""
+    terms = []
+    for key, value in (profile or {}).items():
+        if any(k in key.lower() for k in exclude):
+            continue
+        if any(k in key.lower() for k in keywords) and value:
+            terms.extend(t.strip().lower() for t in str(value).split(",") if t.strip())
+    return terms
+
+
+def _term_hits(terms, text):
+    # Loose match: "item songs" also matches "item song"
+    hits = []
+    for term in terms:
+        stem = term[:-1] if term.endswith("s") and len(term) > 3 else term
+        if re.search(rf"\b{re.escape(stem)}", text):
+            hits.append(term)
+    return hits
+
+
+def extract_features(song, profile=None) -> dict:
+    """Cheap, local features from a song's title and lyrics."""
+    title = (song.get("title") or "").lower()
+    lyrics = song.get("lyrics") or ""
+
+    lines = [l.strip().lower() for l in lyrics.splitlines() if l.strip()]
+    # Whitespace split: \w misses the vowel signs of Indic scripts
+    words = [w for w in (w.strip(string.punctuation) for w in lyrics.lower().split()) if w]
+
+    likes = profile_terms(profile, ["love", "like", "favorite", "favourite"], exclude=NEGATIVE_KEYS)
+    hates = profile_terms(profile, NEGATIVE_KEYS)
+
+    return {
+        "has_lyrics": bool(lines),
+        "line_count": len(lines),
+        "word_count": len(words),
+        "unique_word_ratio": round(len(set(words)) / len(words), 3) if words else 0.0,
+        "repetition_ratio": round(1 - len(set(lines)) / len(lines), 3) if lines else 0.0,
+        "script": dominant_script(lyrics) or dominant_script(title),
+        "title_markers": [m for m in TITLE_MARKERS if re.search(rf"\b{re.escape(m)}\b", title)],
+        "like_hits": _term_hits(likes, f"{title}\n{lyrics.lower()}"),
+        "hate_hits": _term_hits(hates, title),
+    }
+
+
+def prefilter_reason(features, profile=None):
+    """Why a song clearly isn't worth an LLM call, or None if it is."""
+    if features.get("hate_hits"):
+        return f"title matches hates: {', '.join(features['hate_hits'])}"
+
+    markers = set(features.get("title_markers") or [])
+    if not features.get("has_lyrics") and markers & INSTRUMENTAL_MARKERS:
+        return "instrumental"
+
+    languages = profile_terms(profile, ["language"])
+    script = features.get("script")
+    if languages and script and features.get("has_lyrics"):
+        allowed = SCRIPT_LANGUAGES.get(script, [])
+        # Latin script covers romanized lyrics of any language
+        if script != "latin" and not any(lang in allowed for lang in languages):
+            return f"{script} script, profile languages: {', '.join(languages)}"
+
+    return None
@@ -0,0 +1,117 @@
+# tools/prerank.py
+
+from tools.lyric_features import NEGATIVE_KEYS, profile_terms
+
+
+def _number(value):
+    """Stored and LLM-produced energies may be strings ("6"); None if not a number."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _energy_range(plan):
+    """The plan's (low, high) energy range as numbers, or None."""
+    bounds = [_number(x) for x in plan.get('energy_range') or []]
+    if len(bounds) != 2 or None in bounds:
+        return None
+    return tuple(bounds)
+
+
+def prerank_songs(songs, source_counts, profile, plan, known, library=None, past_counts=None):
+    """
+    Order candidates by cheap local signals so the analysis budget goes to
+    the most promising songs first.
+
+    songs         -- deduplicated candidates (arrival order breaks ties)
+    source_counts -- song_id -> number of independent searches that found it
+    known         -- song_id -> Song already in the DB (analysis may be set)
+    library       -- {"liked_ids", "liked_artists", "history_ids"} sets
+    past_counts   -- song_id -> times recommended before the recent window
+
+    Each song gets a `prerank_score`; returns a new, sorted list.
+    """
+    library = library or {}
+    past_counts = past_counts or {}
+    liked_ids = library.get("liked_ids", set())
+    liked_artists = library.get("liked_artists", set())
+    history_ids = library.get("history_ids", set())
+
+    # "hated_artists" etc. are artists too, but not favourites
+    favorite_artists = set(profile_terms(profile, ["artist"], exclude=NEGATIVE_KEYS))
+    plan_themes = {str(t).strip().lower() for t in plan.get('themes', []) or []}
+    energy_range = _energy_range(plan)
+
+    scored = []
+    for index, song in enumerate(songs):
+        song_id = song['song_id']
+        artist = (song.get('artist') or '').lower()
+        score = 0.0
+
+        # Taste
+        if artist and any(fav in artist or artist in fav for fav in favorite_artists):
+            score += 3
+        if song_id in liked_ids:
+            score += 3
+        elif artist in liked_artists:
+            score += 1
+        if song_id in history_ids:
+            score += 1.5
+
+        # Agreement between independent searches
+        score += min(source_counts.get(song_id, 1) - 1, 3)
+
+        # Existing analysis against the plan
+        cached = known.get(song_id)
+        if cached is not None and cached.get('mood'):
+            energy = _number(cached.get('energy'))
+            if energy_range and energy is not None:
+                low, high = energy_range
+                score += 1.5 if low <= energy <= high else -1.5
+            themes = {str(t).lower() for t in cached.themes or []}
+            score += min(len(themes & plan_themes), 2)
+
+        # Picked for an earlier playlist
+        if past_counts.get(song_id):
+            score += 0.5
+
+        song['prerank_score'] = score
+        scored.append((-score, index, song))
+
+    scored.sort(key=lambda item: (item[0], item[1]))
+    return [song for _, _, song in scored]
+
+
+def local_match_score(song, plan, profile) -> int:
+    """
+    1-10 match score for an analyzed song from its stored mood, energy and
+    themes against the plan, used instead of an LLM score when a request's
+    token budget runs low.
+    """
+    score = 5.0
+
+    energy = _number(song.get('energy'))
+    energy_range = _energy_range(plan)
+    if energy_range and energy is not None:
+        low, high = energy_range
+        if low <= energy <= high:
+            score += 2
+        else:
+            score -= min(abs(energy - (low if energy < low else high)), 3)
+
+    plan_themes = {str(t).strip().lower() for t in plan.get('themes', []) or []}
+    themes = {str(t).strip().lower() for t in song.get('themes') or []}
+    score += min(len(themes & plan_themes), 2)
+
+    plan_moods = f"{plan.get('playlist_mood', '')} {plan.get('inferred_mood', '')}".lower()
+    moods = [m.strip() for m in (song.get('mood') or '').lower().split(',') if m.strip()]
+    if any(m in plan_moods for m in moods):
+        score += 1
+
+    artist = (song.get('artist') or '').lower()
+    favorites = profile_terms(profile, ["artist"], exclude=NEGATIVE_KEYS)
+    if artist and any(fav in artist or artist in fav for fav in favorites):
+        score += 1
+
+    return int(round(max(1, min(10, score))))
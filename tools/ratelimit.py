@@ -0,0 +1,184 @@
+# tools/ratelimit.py
+
+import os
+import re
+import time
+import asyncio
+import threading
+
+# Status codes that mean "slow down" rather than a bad request
+THROTTLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Blocking token bucket: `rate` tokens per second, bursts up to `capacity`.
+    Sleeps in the calling thread, so it must not be used on the event loop.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD concurrency limit.
+
+    Successful calls grow the limit by roughly one slot per full window of
+    calls; throttling responses (429/5xx) halve it and latency spikes (well
+    above the running average) shrink it by a quarter. Other errors leave
+    it unchanged.
+    """
+
+    def __init__(self, initial=4, min_limit=1, max_limit=16, spike_factor=3.0):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.spike_factor = spike_factor
+        self.in_flight = 0
+        self.waiting = 0
+        self.avg_latency = None
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            self.waiting += 1
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.waiting -= 1
+            self.in_flight += 1
+
+    def release(self, latency, ok, throttled=False):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.min_limit, self.limit / 2)
+            elif not ok:
+                pass
+            elif self.avg_latency and latency > self.avg_latency * self.spike_factor:
+                self.limit = max(self.min_limit, self.limit * 0.75)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+            if ok:
+                if self.avg_latency is None:
+                    self.avg_latency = latency
+                else:
+                    self.avg_latency = 0.9 * self.avg_latency + 0.1 * latency
+            self._cond.notify_all()
+
+
+def is_throttled(error) -> bool:
+    """Whether an upstream error is a rate-limit / overload signal."""
+    response = getattr(error, "response", None)
+    status = getattr(error, "status_code", None) or getattr(response, "status_code", None)
+    if status is None:
+        # ytmusicapi: "Server returned HTTP 429: Too Many Requests."
+        match = re.search(r"\bHTTP (\d{3})\b", str(error))
+        status = int(match.group(1)) if match else None
+    return status in THROTTLE_STATUS or "too many requests" in str(error).lower()
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+class EndpointLimiter:
+    """Token bucket plus adaptive concurrency for one class of endpoints."""
+
+    def __init__(self, name, rate, burst, concurrency, max_concurrency):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = AdaptiveConcurrency(initial=concurrency, max_limit=max_concurrency)
+        self.calls = 0
+        self.errors = 0
+        self.throttled = 0
+        self._warned_loop = False
+
+    def call(self, fn, *args, **kwargs):
+        if _on_event_loop() and not self._warned_loop:
+            # Waiting here would freeze every update on the loop
+            self._warned_loop = True
+            print(f"Rate limiter '{self.name}' called on the event loop; use asyncio.to_thread")
+        self.concurrency.acquire()
+        started = time.monotonic()
+        ok = False
+        throttled = False
+        try:
+            self.bucket.acquire()
+            started = time.monotonic()
+            result = fn(*args, **kwargs)
+            ok = True
+            return result
+        except Exception as e:
+            throttled = is_throttled(e)
+            raise
+        finally:
+            self.calls += 1
+            if not ok:
+                self.errors += 1
+            if throttled:
+                self.throttled += 1
+            self.concurrency.release(time.monotonic() - started, ok, throttled)
+
+    def stats(self) -> dict:
+        return {
+            "rate": self.bucket.rate,
+            "tokens": round(self.bucket.tokens, 2),
+            "concurrency_limit": int(self.concurrency.limit),
+            "in_flight": self.concurrency.in_flight,
+            "queue_depth": self.concurrency.waiting,
+            "avg_latency": self.concurrency.avg_latency,
+            "calls": self.calls,
+            "errors": self.errors,
+            "throttled": self.throttled,
+        }
+
+
+def _limiter(name, rate, burst, concurrency, max_concurrency):
+    prefix = f"YTMUSIC_{name.upper()}"
+    return EndpointLimiter(
+        name,
+        rate=float(os.getenv(f"{prefix}_RATE", rate)),
+        burst=float(os.getenv(f"{prefix}_BURST", burst)),
+        concurrency=int(os.getenv(f"{prefix}_CONCURRENCY", concurrency)),
+        max_concurrency=int(os.getenv(f"{prefix}_MAX_CONCURRENCY", max_concurrency)),
+    )
+
+
+# Shared by every thread in the process
+LIMITERS = {
+    "search": _limiter("search", rate=4, burst=8, concurrency=4, max_concurrency=8),
+    "browse": _limiter("browse", rate=4, burst=8, concurrency=4, max_concurrency=8),
+    "lyrics": _limiter("lyrics", rate=4, burst=8, concurrency=4, max_concurrency=8),
+    "write": _limiter("write", rate=1, burst=2, concurrency=1, max_concurrency=2),
+}
+
+
+def limited(endpoint, fn, *args, **kwargs):
+    """Run a YouTube Music call under the limiter for its endpoint class."""
+    return LIMITERS[endpoint].call(fn, *args, **kwargs)
+
+
+def limiter_stats() -> dict:
+    return {name: limiter.stats() for name, limiter in LIMITERS.items()}
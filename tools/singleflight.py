@@ -0,0 +1,85 @@
+# tools/singleflight.py
+
+import threading
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls for the same key into one execution.
+
+    The first caller for a key runs the function; callers arriving while it
+    is in flight block and receive the same result (or exception). Nothing
+    is cached once the call returns.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def do(self, group, key, fn, *args, clone=None, **kwargs):
+        """
+        Run fn(*args, **kwargs) once per in-flight (group, key).
+
+        group -- metrics bucket, e.g. "search" or "analysis"
+        clone -- applied to the result handed to waiting callers, so they
+                 don't share mutable records with the caller that ran it
+        """
+        flight_key = (group, key)
+        with self._lock:
+            stats = self._stats.setdefault(group, {"calls": 0, "executions": 0, "collapsed": 0})
+            stats["calls"] += 1
+            call = self._calls.get(flight_key)
+            if call is None:
+                call = self._calls[flight_key] = _Call()
+                stats["executions"] += 1
+                leader = True
+            else:
+                call.waiters += 1
+                stats["collapsed"] += 1
+                leader = False
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return clone(call.result) if clone else call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[flight_key]
+            call.done.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_flight = {}
+            for group, _ in self._calls:
+                in_flight[group] = in_flight.get(group, 0) + 1
+            return {
+                group: dict(stats, in_flight=in_flight.get(group, 0))
+                for group, stats in self._stats.items()
+            }
+
+
+# Shared by tools/ytmusic.py and the lyrics analysis path
+FLIGHTS = SingleFlight()
+
+
+def flight_stats() -> dict:
+    return FLIGHTS.stats()
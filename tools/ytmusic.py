@@ -5,6 +5,10 @@ import json
 from pathlib import Path
 from ytmusicapi import YTMusic
 
+from song import Song
+from tools.ratelimit import limited
+from tools.singleflight import FLIGHTS
+
 # Check for Railway environment variable first
 YTMUSIC_AUTH = os.getenv("YTMUSIC_AUTH")
 
@@ -19,70 +23,125 @@ else:
 
 def get_history(limit=50):
     """Get recent listening history"""
-    history = yt.get_history()[:limit]
+    history = limited("browse", yt.get_history)[:limit]
     return [
-        {
-            "song_id": song['videoId'],
-            "title": song['title'],
-            "artist": song['artists'][0]['name'] if song.get('artists') else "Unknown",
-            "album": (song.get('album') or {}).get('name', ''),
-        }
+        Song(
+            song_id=song['videoId'],
+            title=song['title'],
+            artist=song['artists'][0]['name'] if song.get('artists') else "Unknown",
+            album=(song.get('album') or {}).get('name', ''),
+        )
         for song in history
     ]
 
+def _copy_songs(songs):
+    # Callers annotate the records they get back (prerank_score, ...)
+    return [s.copy() for s in songs]
+
 def search_songs(query, limit=40):
     """Search for songs"""
-    results = yt.search(query, filter="songs", limit=limit)
+    return FLIGHTS.do("search", (query, limit), _search_songs, query, limit, clone=_copy_songs)
+
+def _search_songs(query, limit):
+    results = limited("search", yt.search, query, filter="songs", limit=limit)
     return [
-        {
-            "song_id": r['videoId'],
-            "title": r['title'],
-            "artist": r['artists'][0]['name'] if r.get('artists') else "Unknown",
-            "album": (r.get('album') or {}).get('name', ''),
-        }
+        Song(
+            song_id=r['videoId'],
+            title=r['title'],
+            artist=r['artists'][0]['name'] if r.get('artists') else "Unknown",
+            album=(r.get('album') or {}).get('name', ''),
+        )
         for r in results
     ]
 
 def get_artist_songs(artist_name, limit=30):
     """Get songs by artist"""
-    search = yt.search(artist_name, filter="artists", limit=1)
+    return FLIGHTS.do("artist", (artist_name, limit), _get_artist_songs, artist_name, limit, clone=_copy_songs)
+
+def _get_artist_songs(artist_name, limit):
+    search = limited("search", yt.search, artist_name, filter="artists", limit=1)
     if not search:
         return []
     artist_id = search[0]['browseId']
-    artist = yt.get_artist(artist_id)
+    artist = limited("browse", yt.get_artist, artist_id)
     songs = artist.get('songs', {}).get('results', [])[:limit]
     return [
-        {
-            "song_id": s['videoId'],
-            "title": s['title'],
-            "artist": artist_name,
-        }
+        Song(
+            song_id=s['videoId'],
+            title=s['title'],
+            artist=artist_name,
+        )
         for s in songs
     ]
 
+def _watch_tracks(playlist):
+    return [
+        Song(
+            song_id=t['videoId'],
+            title=t['title'],
+            artist=t['artists'][0]['name'] if t.get('artists') else "Unknown",
+        )
+        for t in playlist.get('tracks', [])
+        if t.get('videoId')
+    ]
+
+def _record_graph(song_id, tracks):
+    """Keep the radio neighbours in the local co-occurrence graph."""
+    try:
+        from db.graph import record_watch_playlist
+        record_watch_playlist(song_id, tracks)
+    except Exception as e:
+        print(f"Graph record error for {song_id}: {e}")
+
+def _fetch_watch(song_id):
+    playlist = limited("browse", yt.get_watch_playlist, song_id)
+    _record_graph(song_id, _watch_tracks(playlist))
+    return playlist
+
+def _watch(song_id):
+    # Shared by get_watch_playlist and get_lyrics: one upstream call per song
+    return FLIGHTS.do("watch", song_id, _fetch_watch, song_id)
+
 def get_watch_playlist(song_id, limit=25):
     """Get 'radio' / related songs for a song"""
-    playlist = yt.get_watch_playlist(song_id)
-    tracks = playlist.get('tracks', [])[:limit]
+    return _watch_tracks(_watch(song_id))[:limit]
+
+def get_song_info(song_id):
+    """Get title/artist for a single song ID"""
+    details = limited("browse", yt.get_song, song_id).get('videoDetails', {})
+    return Song(
+        song_id=song_id,
+        title=details.get('title', ''),
+        artist=details.get('author', 'Unknown'),
+    )
+
+def get_playlist_songs(playlist_id, limit=100):
+    """Get songs in a playlist"""
+    playlist = limited("browse", yt.get_playlist, playlist_id, limit=limit)
     return [
-        {
-            "song_id": t['videoId'],
-            "title": t['title'],
-            "artist": t['artists'][0]['name'] if t.get('artists') else "Unknown",
-        }
-        for t in tracks
+        Song(
+            song_id=t['videoId'],
+            title=t['title'],
+            artist=t['artists'][0]['name'] if t.get('artists') else "Unknown",
+        )
+        for t in playlist.get('tracks', [])
+        if t.get('videoId')
     ]
 
 def get_lyrics(song_id):
     """Get lyrics for a song"""
+    return FLIGHTS.do("lyrics", song_id, _get_lyrics, song_id)
+
+def _get_lyrics(song_id):
     try:
-        watch = yt.get_watch_playlist(song_id)
+        # The lyrics lookup records the radio list in the graph for free
+        watch = _watch(song_id)
         lyrics_browse_id = watch.get('lyrics')
         
         if not lyrics_browse_id:
             return None
         
-        lyrics_data = yt.get_lyrics(lyrics_browse_id)
+        lyrics_data = limited("lyrics", yt.get_lyrics, lyrics_browse_id)
         
         if not lyrics_data:
             return None
@@ -98,12 +157,12 @@ def get_lyrics(song_id):
 
 def create_playlist(title, description=""):
     """Create a new playlist, returns playlist_id"""
-    playlist_id = yt.create_playlist(title, description)
+    playlist_id = limited("write", yt.create_playlist, title, description)
     return playlist_id
 
 def add_to_playlist(playlist_id, song_ids):
     """Add songs to a playlist"""
-    yt.add_playlist_items(playlist_id, song_ids)
+    limited("write", yt.add_playlist_items, playlist_id, song_ids)
     return {"status": "added", "count": len(song_ids)}
 
 def get_playlist_url(playlist_id):
@@ -112,13 +171,13 @@ def get_playlist_url(playlist_id):
 
 def get_liked_songs(limit=100):
     """Get user's liked songs"""
-    liked = yt.get_liked_songs(limit=limit)
+    liked = limited("browse", yt.get_liked_songs, limit=limit)
     return [
-        {
-            "song_id": t['videoId'],
-            "title": t['title'],
-            "artist": t['artists'][0]['name'] if t.get('artists') else "Unknown",
-        }
+        Song(
+            song_id=t['videoId'],
+            title=t['title'],
+            artist=t['artists'][0]['name'] if t.get('artists') else "Unknown",
+        )
         for t in liked.get('tracks', [])
     ]
 
@@ -0,0 +1,173 @@
+# webhook.py
+"""
+Webhook mode for the Telegram bot.
+
+An embedded HTTP server receives updates from Telegram, checks the
+X-Telegram-Bot-Api-Secret-Token header and hands each update to the
+Application's update queue, where the same handlers as in polling mode
+pick it up.
+
+Replay a recorded update against a local server (no Telegram needed when
+WEBHOOK_URL is unset):
+
+    BOT_MODE=webhook WEBHOOK_SECRET=dev python bot.py
+    python webhook.py update.json --secret dev
+    python webhook.py --text "gym playlist" --user-id 123 --secret dev
+"""
+
+import json
+import hmac
+import time
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram import Update
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Telegram updates are a few KB; anything near this is not one
+MAX_BODY_BYTES = 1024 * 1024
+
+
+def make_handler(app, loop, path, secret):
+    class WebhookHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            # Health check for load balancers
+            if self.path == "/healthz":
+                self._reply(200, b"ok")
+            else:
+                self._reply(404, b"not found")
+
+        def do_POST(self):
+            if self.path != path:
+                self._reply(404, b"not found")
+                return
+            # Bytes: compare_digest rejects non-ASCII str
+            if not hmac.compare_digest(self.headers.get(SECRET_HEADER, "").encode(), secret.encode()):
+                self._reply(403, b"forbidden")
+                return
+
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+            except ValueError:
+                length = -1
+            if length < 0:
+                self._reply(400, b"bad request")
+                return
+            if length > MAX_BODY_BYTES:
+                self._reply(413, b"payload too large")
+                return
+
+            try:
+                data = json.loads(self.rfile.read(length))
+                update = Update.de_json(data, app.bot)
+            except (ValueError, TypeError) as e:
+                print(f"Webhook payload error: {e}")
+                self._reply(400, b"bad request")
+                return
+
+            # Queue and return at once; Telegram only needs the 200
+            asyncio.run_coroutine_threadsafe(app.update_queue.put(update), loop)
+            self._reply(200, b"ok")
+
+        def _reply(self, status, body):
+            self.send_response(status)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return WebhookHandler
+
+
+async def serve(app, listen, port, path, secret, webhook_url=None):
+    """Run `app` behind the webhook server until cancelled."""
+    if not secret:
+        raise ValueError("WEBHOOK_SECRET must be set in webhook mode")
+
+    async with app:
+        if webhook_url:
+            await app.bot.set_webhook(
+                url=webhook_url.rstrip("/") + path,
+                secret_token=secret,
+                allowed_updates=Update.ALL_TYPES
+            )
+            print(f"Webhook registered at {webhook_url.rstrip('/') + path}")
+        else:
+            print("WEBHOOK_URL not set; not registering with Telegram (local replay only)")
+
+        await app.start()
+
+        server = ThreadingHTTPServer(
+            (listen, port),
+            make_handler(app, asyncio.get_running_loop(), path, secret)
+        )
+        thread = threading.Thread(target=server.serve_forever, name="webhook", daemon=True)
+        thread.start()
+        print(f"Webhook server listening on {listen}:{port}{path}")
+
+        try:
+            await asyncio.Event().wait()
+        finally:
+            server.shutdown()
+            await app.stop()
+
+
+def replay(payload, url, secret):
+    """POST a recorded update to a running webhook server. Returns the HTTP status."""
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError
+
+    request = Request(
+        url,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json", SECRET_HEADER: secret},
+        method="POST"
+    )
+    try:
+        with urlopen(request) as response:
+            return response.status
+    except HTTPError as e:
+        return e.code
+
+
+def text_update(text, user_id, chat_id=None):
+    """Minimal message update, for replaying without a recorded payload."""
+    now = int(time.time())
+    return {
+        "update_id": now,
+        "message": {
+            "message_id": now % 100000,
+            "date": now,
+            "chat": {"id": chat_id or user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Replay"},
+            "text": text
+        }
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    from config import WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, ALLOWED_USER_ID
+
+    parser = argparse.ArgumentParser(description="Replay Telegram updates against the webhook server")
+    parser.add_argument("payload", nargs="?", help="recorded update JSON file")
+    parser.add_argument("--text", help="send a synthetic message with this text instead")
+    parser.add_argument("--user-id", type=int, default=ALLOWED_USER_ID)
+    parser.add_argument("--url", default=f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    parser.add_argument("--secret", default=WEBHOOK_SECRET or "")
+    args = parser.parse_args()
+
+    if args.text:
+        payload = text_update(args.text, args.user_id)
+    elif args.payload:
+        with open(args.payload) as f:
+            payload = json.load(f)
+    else:
+        parser.error("give a payload file or --text")
+
+    print(f"{args.url} -> {replay(payload, args.url, args.secret)}")
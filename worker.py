@@ -0,0 +1,207 @@
+# worker.py
+"""
+Worker processes for the playlist job queue (WORKER_MODE=queue).
+
+The bot only enqueues jobs (db/jobs.py). Each worker process has its own
+Orchestrator, LLM clients and YouTube Music client, claims one job at a
+time under a lease, heartbeats while it runs, and delivers progress and
+the finished playlist by editing the bot's status message.
+
+    WORKER_MODE=queue python bot.py
+    python worker.py --workers 4
+"""
+
+import os
+import asyncio
+import socket
+import threading
+import multiprocessing
+
+from telegram import Bot
+
+from config import TELEGRAM_TOKEN, WORKER_PROCESSES, JOB_LEASE_SECONDS, PROFILE_RUNS
+from formatting import format_playlist_response
+from db.database import init_db, flush_access_stats
+from db.jobs import claim_job, expire_jobs, heartbeat, complete_job, fail_job
+from profiling import profile_run
+
+# Seconds between polls when the queue is empty
+POLL_INTERVAL = 1.0
+# Longest wait after repeated loop errors (e.g. "database is locked")
+MAX_ERROR_BACKOFF = 30.0
+# Seconds between the parent's checks for dead worker processes
+SUPERVISE_INTERVAL = 5.0
+
+
+def render_result(result: dict) -> tuple:
+    """(text, parse_mode) for a finished orchestrator result."""
+    if result.get('type') == 'chat':
+        return result.get('message', "Hey!"), None
+    if result.get('type') == 'settings':
+        return result.get('message', "Use /taste to set preferences."), None
+    return format_playlist_response(result), 'HTML'
+
+
+def _keep_lease(job_id, worker_id, stop, on_lost):
+    # Own thread: blocking stretches of the pipeline on the event loop
+    # can't delay renewal past the lease
+    while not stop.wait(JOB_LEASE_SECONDS / 3):
+        try:
+            owned = heartbeat(job_id, worker_id, JOB_LEASE_SECONDS)
+        except Exception as e:
+            print(f"Heartbeat error for job {job_id}: {e}")
+            continue
+        if not owned:
+            on_lost()
+            return
+
+
+async def run_job(job, worker_id, bot, orchestrator):
+    async def edit(text, parse_mode=None):
+        try:
+            await bot.edit_message_text(
+                text,
+                chat_id=job['chat_id'],
+                message_id=job['message_id'],
+                parse_mode=parse_mode
+            )
+        except Exception as e:
+            print(f"Progress update error: {e}")
+
+    if PROFILE_RUNS:
+        pipeline = profile_run(orchestrator, job['request'], progress_callback=edit, user_id=job['user_id'])
+    else:
+        pipeline = orchestrator.run(job['request'], progress_callback=edit, user_id=job['user_id'])
+    run = asyncio.create_task(pipeline)
+    loop = asyncio.get_running_loop()
+    stop = threading.Event()
+    lost = threading.Event()
+
+    def on_lost():
+        lost.set()
+        loop.call_soon_threadsafe(run.cancel, "lease lost")
+
+    keeper = threading.Thread(
+        target=_keep_lease, args=(job['id'], worker_id, stop, on_lost),
+        name=f"lease-{job['id']}", daemon=True
+    )
+    keeper.start()
+    try:
+        result = await run
+        if PROFILE_RUNS:
+            result, _ = result
+    except asyncio.CancelledError:
+        if lost.is_set():
+            print(f"[{worker_id}] Lost lease on job {job['id']}")
+            return
+        raise
+    except Exception as e:
+        if not lost.is_set():
+            await asyncio.to_thread(fail_job, job['id'], worker_id, e)
+            await edit(f"Something went wrong: {str(e)}")
+        return
+    finally:
+        stop.set()
+
+    if lost.is_set():
+        print(f"[{worker_id}] Lost lease on job {job['id']}; result dropped")
+        return
+
+    text, parse_mode = render_result(result)
+    await edit(text, parse_mode)
+    await asyncio.to_thread(complete_job, job['id'], worker_id, {"type": result.get('type'), "text": text})
+
+
+async def notify_expired(bot, job):
+    """Tell the user about a job given up on after its workers kept dying."""
+    try:
+        await bot.edit_message_text(
+            "Sorry, this playlist couldn't be finished. Please try again.",
+            chat_id=job['chat_id'],
+            message_id=job['message_id']
+        )
+    except Exception as e:
+        print(f"Expired job notice error: {e}")
+
+
+async def worker_loop(worker_id):
+    # Imported here so each process builds its own clients after fork/spawn
+    from orchestrator import Orchestrator
+
+    orchestrator = Orchestrator()
+    async with Bot(TELEGRAM_TOKEN) as bot:
+        print(f"[{worker_id}] Waiting for jobs...")
+        errors = 0
+        while True:
+            # A transient error (a locked database during the bot's
+            # maintenance, a Telegram hiccup) must not kill the worker: a
+            # claimed job's lease simply expires and it is retried
+            try:
+                ran = await poll_once(worker_id, bot, orchestrator)
+                errors = 0
+            except Exception as e:
+                errors += 1
+                delay = min(MAX_ERROR_BACKOFF, POLL_INTERVAL * 2 ** errors)
+                print(f"[{worker_id}] Worker loop error: {e}; retrying in {delay:.0f}s")
+                await asyncio.sleep(delay)
+                continue
+            if not ran:
+                await asyncio.sleep(POLL_INTERVAL)
+
+
+async def poll_once(worker_id, bot, orchestrator) -> bool:
+    """Expire dead jobs, then claim and run one job. False if the queue was empty."""
+    for expired in await asyncio.to_thread(expire_jobs):
+        await notify_expired(bot, expired)
+
+    job = await asyncio.to_thread(claim_job, worker_id, JOB_LEASE_SECONDS)
+    if job is None:
+        return False
+
+    print(f"[{worker_id}] Job {job['id']} (attempt {job['attempts']}): {job['request']}")
+    await run_job(job, worker_id, bot, orchestrator)
+    # Cache read counts for LRU eviction, batched per job
+    await asyncio.to_thread(flush_access_stats)
+    return True
+
+
+def start_worker(index):
+    process = multiprocessing.Process(target=worker_main, args=(index,), name=f"worker-{index}")
+    process.start()
+    return process
+
+
+def worker_main(index):
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{index}"
+    try:
+        asyncio.run(worker_loop(worker_id))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run playlist worker processes")
+    parser.add_argument("--workers", type=int, default=WORKER_PROCESSES)
+    args = parser.parse_args()
+
+    init_db()
+
+    if args.workers <= 1:
+        worker_main(0)
+    else:
+        processes = [start_worker(i) for i in range(args.workers)]
+        print(f"Started {len(processes)} workers")
+        try:
+            # Restart workers that died (their jobs are re-claimed on lease expiry)
+            while True:
+                for i, p in enumerate(processes):
+                    p.join(timeout=SUPERVISE_INTERVAL / len(processes))
+                    # Exit code 0 is a clean shutdown (Ctrl-C)
+                    if not p.is_alive() and p.exitcode != 0:
+                        print(f"Worker {p.name} exited ({p.exitcode}), restarting")
+                        processes[i] = start_worker(i)
+        except KeyboardInterrupt:
+            for p in processes:
+                p.terminate()